@@ -1,13 +1,18 @@
 """Script to add sample metrics data to the database"""
 from datetime import date, timedelta
 import random
+import pandas as pd
+from sqlalchemy import insert
 from app.db.session import SessionLocal
 from app.db.models import MetricsDaily
+from app.services.entities import assign_keys
+from app.services.versions import bump
 
 def add_sample_metrics():
     db = SessionLocal()
     try:
         today = date.today()
+        rows = []
 
         # Define some campaigns and ad groups
         entities = [
@@ -29,26 +34,21 @@ def add_sample_metrics():
                 base_conversions = base_clicks * random.uniform(0.03, 0.05)  # 3-5% conversion rate
                 base_conv_value = base_conversions * random.uniform(40, 60)  # $40-60 per conversion
 
-                metric = MetricsDaily(
+                rows.append(dict(
                     date=day,
-                    customer_id=entity["customer_id"],
-                    campaign_id=entity["campaign_id"],
-                    ad_group_id=entity["ad_group_id"],
+                    **entity,
                     impressions=base_impressions,
                     clicks=base_clicks,
                     cost=round(base_cost, 2),
                     conversions=round(base_conversions, 2),
                     conv_value=round(base_conv_value, 2)
-                )
-                db.add(metric)
+                ))
 
         # Add today's data with some anomalies
         # Entity 1: Normal data
-        db.add(MetricsDaily(
+        rows.append(dict(
             date=today,
-            customer_id=entities[0]["customer_id"],
-            campaign_id=entities[0]["campaign_id"],
-            ad_group_id=entities[0]["ad_group_id"],
+            **entities[0],
             impressions=1000,
             clicks=40,
             cost=80.0,
@@ -57,11 +57,9 @@ def add_sample_metrics():
         ))
 
         # Entity 2: COST SPIKE (anomaly)
-        db.add(MetricsDaily(
+        rows.append(dict(
             date=today,
-            customer_id=entities[1]["customer_id"],
-            campaign_id=entities[1]["campaign_id"],
-            ad_group_id=entities[1]["ad_group_id"],
+            **entities[1],
             impressions=1000,
             clicks=40,
             cost=500.0,  # Very high cost!
@@ -70,11 +68,9 @@ def add_sample_metrics():
         ))
 
         # Entity 3: CTR DROP (anomaly - very few clicks)
-        db.add(MetricsDaily(
+        rows.append(dict(
             date=today,
-            customer_id=entities[2]["customer_id"],
-            campaign_id=entities[2]["campaign_id"],
-            ad_group_id=entities[2]["ad_group_id"],
+            **entities[2],
             impressions=1000,
             clicks=10,  # Very low clicks = low CTR
             cost=25.0,
@@ -83,11 +79,9 @@ def add_sample_metrics():
         ))
 
         # Entity 4: CONVERSIONS DROP (anomaly)
-        db.add(MetricsDaily(
+        rows.append(dict(
             date=today,
-            customer_id=entities[3]["customer_id"],
-            campaign_id=entities[3]["campaign_id"],
-            ad_group_id=entities[3]["ad_group_id"],
+            **entities[3],
             impressions=1000,
             clicks=40,
             cost=80.0,
@@ -95,6 +89,13 @@ def add_sample_metrics():
             conv_value=10.0
         ))
 
+        # metrics_daily stores integer entity keys instead of the id strings
+        df = pd.DataFrame(rows)
+        df = pd.concat([df, assign_keys(db, df)], axis=1).drop(columns=["customer_id", "campaign_id", "ad_group_id"])
+        db.execute(insert(MetricsDaily), df.to_dict(orient="records"))
+
+        # invalidate cached responses (ETags) for every date written above
+        bump(db, [today - timedelta(days=i) for i in range(29)])
         db.commit()
 
         # Count records
@@ -0,0 +1,116 @@
+from sqlalchemy import inspect, text
+from app.db.models import Base
+
+def ensure_schema(engine):
+    """Create missing tables, then add any model columns/indexes that an older
+    database file is missing. Apart from the SQLite AUTOINCREMENT rebuild below,
+    only additive changes, the entity key migration and the anomaly dedupe below
+    are handled here."""
+    Base.metadata.create_all(bind=engine)
+    insp = inspect(engine)
+    if "ad_group_id" in {c["name"] for c in insp.get_columns("metrics_daily")}:
+        _migrate_entity_keys(engine, insp)
+        insp = inspect(engine)
+    if "ux_anomalies_end_entity_metric" not in {i["name"] for i in insp.get_indexes("anomalies")}:
+        _dedupe_anomalies(engine)
+    for table in Base.metadata.sorted_tables:
+        if engine.dialect.name == "sqlite" and table.dialect_options["sqlite"]["autoincrement"]:
+            _ensure_sqlite_autoincrement(engine, table, insp)
+            insp = inspect(engine)
+        existing_cols = {c["name"] for c in insp.get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in existing_cols]
+        if missing:
+            with engine.begin() as conn:
+                for col in missing:
+                    coltype = col.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {coltype}"))
+        existing_idx = {i["name"] for i in insp.get_indexes(table.name)}
+        for idx in table.indexes:
+            if idx.name not in existing_idx:
+                idx.create(bind=engine)
+    _backfill_anomaly_keys(engine)
+
+def _ensure_sqlite_autoincrement(engine, table, insp):
+    """SQLite only stops reusing deleted rowids when a table is declared
+    AUTOINCREMENT, which cannot be altered in place: copy the rows out, recreate
+    the table and copy them back (ids are kept, and seed sqlite_sequence)."""
+    with engine.begin() as conn:
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :n"),
+                           {"n": table.name}).scalar()
+        if ddl is None or "AUTOINCREMENT" in ddl.upper():
+            return
+        cols = ", ".join(c["name"] for c in insp.get_columns(table.name)
+                         if c["name"] in table.columns)
+        print(f"Rebuilding {table.name} with AUTOINCREMENT")
+        conn.execute(text(f"CREATE TEMP TABLE _rebuild_{table.name} AS SELECT {cols} FROM {table.name}"))
+        conn.execute(text(f"DROP TABLE {table.name}"))
+        table.create(conn)
+        conn.execute(text(f"INSERT INTO {table.name} ({cols}) SELECT {cols} FROM _rebuild_{table.name}"))
+        conn.execute(text(f"DROP TABLE _rebuild_{table.name}"))
+
+def _migrate_entity_keys(engine, insp):
+    """metrics_daily used to repeat the customer/campaign/ad group id strings on
+    every row. Register them in entities (an ad group's campaign and a
+    campaign's customer taken from its rows), then rebuild the table with the
+    integer keys in their place. Row ids are kept."""
+    from app.db.models import MetricsDaily
+    table = MetricsDaily.__table__
+    old = {c["name"] for c in insp.get_columns("metrics_daily")}
+    print("Moving metrics_daily ids into entities")
+    with engine.begin() as conn:
+        for entity_type, col, parent_type, parent_col in [
+            ("customer", "customer_id", None, None),
+            ("campaign", "campaign_id", "customer", "customer_id"),
+            ("ad_group", "ad_group_id", "campaign", "campaign_id"),
+        ]:
+            parent, join = "NULL", ""
+            if parent_type:
+                parent = "MAX(p.id)"
+                join = (f"JOIN entities p ON p.entity_type = '{parent_type}' "
+                        f"AND p.external_id = m.{parent_col} ")
+            conn.execute(text(
+                f"INSERT INTO entities (entity_type, external_id, parent_id) "
+                f"SELECT '{entity_type}', m.{col}, {parent} FROM metrics_daily m {join}"
+                f"WHERE NOT EXISTS (SELECT 1 FROM entities e WHERE e.entity_type = '{entity_type}' "
+                f"AND e.external_id = m.{col}) GROUP BY m.{col}"))
+        cols = [c.name for c in table.columns]
+        picked = {"customer_key": "c.id", "campaign_key": "p.id", "ad_group_key": "a.id"}
+        select_list = ", ".join(f"{picked[c]} AS {c}" if c in picked else
+                                f"m.{c}" if c in old else f"NULL AS {c}" for c in cols)
+        conn.execute(text(
+            f"CREATE TEMP TABLE _rebuild_metrics_daily AS SELECT {select_list} FROM metrics_daily m "
+            f"JOIN entities c ON c.entity_type = 'customer' AND c.external_id = m.customer_id "
+            f"JOIN entities p ON p.entity_type = 'campaign' AND p.external_id = m.campaign_id "
+            f"JOIN entities a ON a.entity_type = 'ad_group' AND a.external_id = m.ad_group_id"))
+        conn.execute(text("DROP TABLE metrics_daily"))
+        table.create(conn)
+        conn.execute(text(f"INSERT INTO metrics_daily ({', '.join(cols)}) "
+                          f"SELECT {', '.join(cols)} FROM _rebuild_metrics_daily"))
+        conn.execute(text("DROP TABLE _rebuild_metrics_daily"))
+
+def _dedupe_anomalies(engine):
+    """Before the unique (window_end, entity_id, metric) index, a day could hold the
+    same anomaly twice (overlapping writers); keep the newest row of each."""
+    with engine.begin() as conn:
+        n = conn.execute(text(
+            "DELETE FROM anomalies WHERE id NOT IN (SELECT MAX(id) FROM anomalies "
+            "GROUP BY window_end, entity_id, metric)")).rowcount
+    if n:
+        print(f"Removed {n} duplicate anomaly row(s)")
+
+def _backfill_anomaly_keys(engine):
+    """Fill the entity keys of anomalies stored before anomalies had them, from
+    entities (rows whose ad group is unknown stay null)."""
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM anomalies WHERE ad_group_key IS NULL LIMIT 1")).first() is None:
+            return
+        conn.execute(text(
+            "UPDATE anomalies SET ad_group_key = (SELECT e.id FROM entities e "
+            "WHERE e.entity_type = 'ad_group' AND e.external_id = anomalies.entity_id) "
+            "WHERE ad_group_key IS NULL AND entity_type = 'ad_group'"))
+        conn.execute(text(
+            "UPDATE anomalies SET campaign_key = (SELECT e.parent_id FROM entities e "
+            "WHERE e.id = anomalies.ad_group_key) WHERE campaign_key IS NULL AND ad_group_key IS NOT NULL"))
+        conn.execute(text(
+            "UPDATE anomalies SET customer_key = (SELECT e.parent_id FROM entities e "
+            "WHERE e.id = anomalies.campaign_key) WHERE customer_key IS NULL AND campaign_key IS NOT NULL"))
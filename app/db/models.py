@@ -1,25 +1,53 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, Float, Date, DateTime, func
+from sqlalchemy import Integer, BigInteger, String, Float, Date, DateTime, LargeBinary, Index, func
 
 class Base(DeclarativeBase):
     pass
 
+class Entity(Base):
+    """One customer, campaign or ad group. Fact tables store its integer id instead
+    of repeating the Google Ads id strings. Maintained by services.entities."""
+    __tablename__ = "entities"
+    __table_args__ = (Index("ux_entities_type_external", "entity_type", "external_id", unique=True),
+                      Index("ix_entities_parent", "parent_id"))
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    entity_type: Mapped[str] = mapped_column(String(20))   # 'customer', 'campaign' or 'ad_group'
+    external_id: Mapped[str] = mapped_column(String(32))   # the Google Ads / upload id
+    parent_id: Mapped[int] = mapped_column(Integer, nullable=True)  # customer of a campaign, campaign of an ad group
+    name: Mapped[str] = mapped_column(String(255), nullable=True)
+
 class MetricsDaily(Base):
     __tablename__ = "metrics_daily"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     date: Mapped[Date] = mapped_column(Date, index=True)
-    customer_id: Mapped[str] = mapped_column(String(20), index=True)
-    campaign_id: Mapped[str] = mapped_column(String(20), index=True)
-    ad_group_id: Mapped[str] = mapped_column(String(20), index=True)
+    # surrogate keys into entities (see services.entities for the string ids)
+    customer_key: Mapped[int] = mapped_column(Integer, index=True)
+    campaign_key: Mapped[int] = mapped_column(Integer, index=True)
+    ad_group_key: Mapped[int] = mapped_column(Integer, index=True)
 
     clicks: Mapped[int] = mapped_column(Integer, default=0)
     impressions: Mapped[int] = mapped_column(Integer, default=0)
     cost: Mapped[float] = mapped_column(Float, default=0.0)  # in micros or currency units (mock uses currency)
     conversions: Mapped[float] = mapped_column(Float, default=0.0)
     conv_value: Mapped[float] = mapped_column(Float, default=0.0)
+    # content hash of the metric columns; re-ingest only rewrites rows whose hash changed
+    row_hash: Mapped[int] = mapped_column(BigInteger, nullable=True)
 
 class Anomaly(Base):
     __tablename__ = "anomalies"
+    __table_args__ = (
+        # /anomalies/history: each filter's rows come out of one index in (window_end, id)
+        # order, so keyset pages need no sort
+        Index("ix_anomalies_end_id", "window_end", "id"),
+        Index("ix_anomalies_metric_end_id", "metric", "window_end", "id"),
+        Index("ix_anomalies_customer_end_id", "customer_key", "window_end", "id"),
+        Index("ix_anomalies_campaign_end_id", "campaign_key", "window_end", "id"),
+        Index("ix_anomalies_ad_group_end_id", "ad_group_key", "window_end", "id"),
+        # one row per day, entity and metric: re-detection upserts on it, so ids stay stable
+        Index("ux_anomalies_end_entity_metric", "window_end", "entity_id", "metric", unique=True),
+        # ids of deleted anomalies are never reused, so ids work as a stream cursor
+        {"sqlite_autoincrement": True},
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     entity_type: Mapped[str] = mapped_column(String(20))  # 'campaign' or 'ad_group'
     entity_id: Mapped[str] = mapped_column(String(32), index=True)
@@ -28,6 +56,68 @@ class Anomaly(Base):
     zscore: Mapped[float] = mapped_column(Float)
     observed: Mapped[float] = mapped_column(Float)
     expected: Mapped[float] = mapped_column(Float)
+    spans: Mapped[str] = mapped_column(String(32), nullable=True)  # baselines that fired, e.g. 'short,medium'
     window_start: Mapped[Date] = mapped_column(Date)
     window_end: Mapped[Date] = mapped_column(Date)
+    # entities keys of the ad group and its campaign and customer (null for rows stored before them)
+    customer_key: Mapped[int] = mapped_column(Integer, nullable=True)
+    campaign_key: Mapped[int] = mapped_column(Integer, nullable=True)
+    ad_group_key: Mapped[int] = mapped_column(Integer, nullable=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
+
+class AnomalyEpisode(Base):
+    """Consecutive days of anomalies with the same entity, metric and direction,
+    merged into one interval. Maintained by services.episodes."""
+    __tablename__ = "anomaly_episodes"
+    __table_args__ = (
+        # neighbour lookup when a day is (re)detected
+        Index("ix_episodes_entity_end", "entity_id", "end_date"),
+        # interval overlap: end_date >= :start narrows the scan, start_date <= :end filters it
+        Index("ix_episodes_end_start", "end_date", "start_date"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    entity_type: Mapped[str] = mapped_column(String(20))
+    entity_id: Mapped[str] = mapped_column(String(32))
+    metric: Mapped[str] = mapped_column(String(20))
+    direction: Mapped[str] = mapped_column(String(5))
+    start_date: Mapped[Date] = mapped_column(Date)
+    end_date: Mapped[Date] = mapped_column(Date)
+    days: Mapped[int] = mapped_column(Integer)
+    peak_z: Mapped[float] = mapped_column(Float)   # signed z of the day with the largest |z|
+    peak_date: Mapped[Date] = mapped_column(Date)
+
+class DataVersion(Base):
+    """Monotonic per-date counter, bumped whenever an ingest changes that date's rows.
+    Response ETags are derived from it, so unchanged dates never need recomputing."""
+    __tablename__ = "data_versions"
+    date: Mapped[Date] = mapped_column(Date, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class CusumState(Base):
+    """Running change-point state of one ad group metric, advanced once per ingested day."""
+    __tablename__ = "cusum_state"
+    ad_group_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    metric: Mapped[str] = mapped_column(String(20), primary_key=True)
+    n: Mapped[int] = mapped_column(Integer, default=0)          # days observed
+    mean: Mapped[float] = mapped_column(Float, default=0.0)     # reference level
+    var: Mapped[float] = mapped_column(Float, default=0.0)      # reference variance
+    pos: Mapped[float] = mapped_column(Float, default=0.0)      # upper cumulative sum
+    neg: Mapped[float] = mapped_column(Float, default=0.0)      # lower cumulative sum
+    pos_start: Mapped[Date] = mapped_column(Date, nullable=True)  # first day of the current upward run
+    neg_start: Mapped[Date] = mapped_column(Date, nullable=True)
+    last_date: Mapped[Date] = mapped_column(Date)
+
+class MetricSketch(Base):
+    """Log-bucket quantile sketch of one metric over a campaign's ad groups on one
+    day. Sketches merge by adding bucket counts, so customer and portfolio
+    distributions are built from these rows. Maintained by services.sketches."""
+    __tablename__ = "metric_sketches"
+    date: Mapped[Date] = mapped_column(Date, primary_key=True)
+    metric: Mapped[str] = mapped_column(String(20), primary_key=True)
+    campaign_id: Mapped[str] = mapped_column(String(20), primary_key=True)
+    customer_id: Mapped[str] = mapped_column(String(20))
+    alpha: Mapped[float] = mapped_column(Float)     # relative accuracy the buckets were built with
+    n: Mapped[int] = mapped_column(Integer)         # values sketched (ad groups where the metric is defined)
+    zeros: Mapped[int] = mapped_column(Integer)     # values <= 0
+    bins: Mapped[bytes] = mapped_column(LargeBinary)  # little-endian int64 (bucket index, count) pairs
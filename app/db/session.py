@@ -4,8 +4,10 @@ from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data/metrics.db")
 
-# For SQLite, check_same_thread=False for FastAPI threaded workers
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+# For SQLite, check_same_thread=False for FastAPI threaded workers; a writer waits up to
+# SQLITE_TIMEOUT seconds for another transaction's write lock (e.g. an ingest recompute)
+connect_args = ({"check_same_thread": False, "timeout": float(os.getenv("SQLITE_TIMEOUT", "30"))}
+                if DATABASE_URL.startswith("sqlite") else {})
 
 engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
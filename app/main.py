@@ -1,10 +1,54 @@
-from fastapi import FastAPI
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from app.db.session import SessionLocal, engine
+from app.db.migrate import ensure_schema
 from app.routers.ingest import router as ingest_router
 from app.routers.anomalies import router as anomalies_router
 from app.routers.explain import router as explain_router
+from app.routers.timeseries import router as timeseries_router
+from app.routers.percentiles import router as percentiles_router
+from app.routers.admin import router as admin_router
+from app.utils import telemetry, profiling
 
-app = FastAPI(title="Google Ads Anomaly Radar (GAAR)")
+# Routers import pandas/numpy lazily, so booting a worker only pays for FastAPI
+# and SQLAlchemy. WARMUP=1 loads the data stack and runs one detection pass
+# before the first request is accepted instead.
+WARMUP = os.getenv("WARMUP", "0") == "1"
+
+def _warm_up():
+    from app.services.pipeline import warm_up
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        out = warm_up(db)
+    finally:
+        db.close()
+    print(f"Warm-up: {out} in {time.perf_counter() - t0:.2f}s")
+
+def _backfill_episodes():
+    from app.services.episodes import backfill_if_empty
+    db = SessionLocal()
+    try:
+        n = backfill_if_empty(db)
+    finally:
+        db.close()
+    if n:
+        print(f"Built {n} anomaly episodes from stored anomalies")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_schema(engine)
+    await run_in_threadpool(_backfill_episodes)
+    if WARMUP:
+        await run_in_threadpool(_warm_up)
+    yield
+
+app = FastAPI(title="Google Ads Anomaly Radar (GAAR)", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,6 +61,65 @@ app.add_middleware(
 app.include_router(ingest_router)
 app.include_router(anomalies_router)
 app.include_router(explain_router)
+app.include_router(timeseries_router)
+app.include_router(percentiles_router)
+app.include_router(admin_router)
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """Request telemetry, plus an on-demand profile for admin requests with X-Profile: 1
+    (one middleware layer for both, so unprofiled requests pay for a header check only).
+    A streamed body (no Content-Length, e.g. ndjson ranges) is generated after the
+    endpoint returns, so its request is recorded when the body ends."""
+    token = telemetry.begin_request()
+    t0 = time.perf_counter()
+    status = 500
+    streamed = False
+
+    def finish():
+        route = request.scope.get("route")
+        telemetry.end_request(token, route.path if route else "unmatched", request.method,
+                              status, time.perf_counter() - t0)
+    try:
+        if not profiling.wants_profile(request):
+            response = await call_next(request)
+        elif not profiling.is_admin(request.headers.get("x-admin-token")):
+            response = JSONResponse({"detail": "profiling requires a valid X-Admin-Token"}, status_code=403)
+        else:
+            response = await _profiled(request, call_next)
+        status = response.status_code
+        if "content-length" not in response.headers and hasattr(response, "body_iterator"):
+            response.body_iterator = _finish_after(response.body_iterator, finish)
+            streamed = True
+        return response
+    finally:
+        if not streamed:
+            finish()
+
+async def _finish_after(body, finish):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        finish()
+
+async def _profiled(request: Request, call_next):
+    capture_token, capture = profiling.begin_capture()
+    try:
+        response = await call_next(request)
+    finally:
+        profiling.end_capture(capture_token)
+    if "id" in capture:
+        response.headers["X-Profile-Id"] = capture["id"]
+        response.headers["X-Profile-Summary"] = profiling.header_summary(capture["summary"])
+    elif capture.get("busy"):
+        response.headers["X-Profile-Id"] = "busy"
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint: request latency, per-stage timings and item counts."""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 def health():
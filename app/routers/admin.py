@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app.utils.profiling import require_admin, load_summary, list_profiles
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@router.get("/profiles")
+def profiles():
+    """Ids of stored request profiles, newest first."""
+    return {"profiles": list_profiles()}
+
+@router.get("/profiles/{profile_id}")
+def profile(profile_id: str):
+    """Top functions of one captured request; the .prof/.folded files sit next to it in PROFILE_DIR."""
+    summary = load_summary(profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return summary
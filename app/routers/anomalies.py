@@ -1,15 +1,39 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import os
+from sqlalchemy import select, func, tuple_
 from sqlalchemy.orm import Session
-from sqlalchemy import select
 from datetime import timedelta, date as date_type
 from app.db.session import SessionLocal
-from app.db.models import MetricsDaily, Anomaly
-from app.services.detect import detect_anomalies
+from app.db.models import Anomaly
+from app.services.versions import etag
+from app.utils.http import not_modified, tabular_response
 from app.utils.time import parse_date
-import pandas as pd
+from app.utils import profiling
+from app.utils.profiling import profiled
+from app.utils.concurrency import SingleFlight, Admission
+from app.utils.events import anomaly_events
+import json
 
 router = APIRouter()
 
+# identical in-flight detections (same date/min_z, or same range) run once and share the result
+_inflight = SingleFlight()
+# caps concurrent CPU-bound range scans; extra requests queue briefly, then get 429
+_range_admission = Admission(
+    "/anomalies/range",
+    limit=int(os.getenv("RANGE_MAX_CONCURRENCY", "2")),
+    max_queue=int(os.getenv("RANGE_MAX_QUEUE", "16")),
+    timeout=float(os.getenv("RANGE_QUEUE_TIMEOUT", "30")),
+)
+# /anomalies/stream re-checks the table at least this often, which also picks up
+# rows written by other worker processes or scripts
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "15"))
+_STREAM_BATCH = 500
+
 def get_db():
     db = SessionLocal()
     try:
@@ -18,53 +42,139 @@ def get_db():
         db.close()
 
 @router.get("/anomalies")
-def anomalies(date: str = Query(default="today"), min_z: float = 2.0, db: Session = Depends(get_db)):
+@profiled
+def anomalies(
+    request: Request,
+    date: str = Query(default="today"),
+    min_z: float = 2.0,
+    format: str = Query(default="json", pattern="^(json|arrow|parquet)$"),
+    db: Session = Depends(get_db),
+):
+    from app.services.detect import detect_anomalies
+    from app.services.pipeline import HISTORY_DAYS, load_window, persist_anomalies
+
     today = parse_date(date)
-    history_q = (
-        select(MetricsDaily)
-        .where(MetricsDaily.date < today)
-        .where(MetricsDaily.date >= today - timedelta(days=28))
-    )
-    today_q = select(MetricsDaily).where(MetricsDaily.date == today)
-
-    history_df = _to_df(db.execute(history_q).scalars().all())
-    today_df = _to_df(db.execute(today_q).scalars().all())
-
-    if history_df.empty or today_df.empty:
-        return {"anomalies": []}
-
-    det = detect_anomalies(history_df, today_df, min_z=min_z)
-    # persist
-    db.query(Anomaly).filter(Anomaly.window_end == today).delete()  # clean duplicates for same day
-    for _, r in det.iterrows():
-        a = Anomaly(
-            entity_type=r["entity_type"],
-            entity_id=r["entity_id"],
-            metric=r["metric"],
-            direction=r["direction"],
-            zscore=float(r["zscore"]),
-            observed=float(r["observed"]),
-            expected=float(r["expected"]),
-            window_start=r["window_start"],
-            window_end=today,
-        )
-        db.add(a)
-    db.commit()
-
-    return {"anomalies": det.to_dict(orient="records")}
+    window = (today - timedelta(days=HISTORY_DAYS), today)
+    # unchanged data and stored anomalies -> the client's copy is still current
+    tag = etag(db, *window, "anomalies", min_z, format, anomalies_of=today)
+    cached = not_modified(request, tag)
+    if cached:
+        return cached
+
+    def detect_and_persist():
+        history_df, today_df = load_window(db, today)
+        if history_df.empty or today_df.empty:
+            return []
+        det = detect_anomalies(history_df, today_df, min_z=min_z)
+        # persist
+        # upserts on (entity, metric): ids of anomalies already stored for the day don't change
+        ids, written = persist_anomalies(db, today, det)
+        db.commit()
+        if written:
+            anomaly_events.publish()
+        if not det.empty:
+            det.insert(0, "id", ids)  # so clients can call /explain without guessing
+        return det.to_dict(orient="records")
+
+    # concurrent callers for the same day share one detection (and one set of stored rows)
+    records, _ = _inflight.do(("anomalies", today, min_z), detect_and_persist)
+
+    # persisting may have added or dropped this day's anomalies, so the tag is taken afterwards
+    tag = etag(db, *window, "anomalies", min_z, format, anomalies_of=today)
+    return tabular_response(request, {"anomalies": records}, "anomalies", format, tag)
+
+def _iter_range(db: Session, start, end, min_z: float):
+    """Yield (date, anomalies DataFrame) for each day from start to end, one day at a time."""
+    import pandas as pd
+    from app.services.detect import detect_anomalies
+    from app.services.pipeline import iter_windows
+
+    # history is loaded once per block of days and sliced per day
+    for current_date, history_df, current_df in iter_windows(db, start, end):
+        det = pd.DataFrame()
+        if not history_df.empty and not current_df.empty:
+            det = detect_anomalies(history_df, current_df, min_z=min_z)
+
+            if not det.empty:
+                # Add the date to each anomaly
+                det['detection_date'] = str(current_date)
+
+        yield current_date, det
+
+def _ndjson_range(start, end, min_z: float, ticket):
+    """One JSON line per day as soon as it is computed, then a summary line.
+    Uses its own session because the body is produced after the handler returns,
+    and holds the admission `ticket` until the stream ends."""
+    db = SessionLocal()
+    try:
+        dates_checked, total = [], 0
+        for current_date, det in _iter_range(db, start, end, min_z):
+            dates_checked.append(str(current_date))
+            records = det.to_dict(orient="records")
+            total += len(records)
+            yield json.dumps(jsonable_encoder({"date": str(current_date), "anomalies": records})) + "\n"
+        yield json.dumps({
+            "date_range": {"start": str(start), "end": str(end)},
+            "dates_checked": dates_checked,
+            "total_anomalies": total,
+        }) + "\n"
+    finally:
+        db.close()
+        ticket.release()
+
+def _range_payload(db: Session, start, end, min_z: float) -> dict:
+    all_anomalies = []
+    dates_checked = []
+
+    # Check each date in the range
+    for current_date, det in _iter_range(db, start, end, min_z):
+        dates_checked.append(str(current_date))
+        if not det.empty:
+            all_anomalies.append(det)
+
+    # Combine all anomalies
+    if all_anomalies:
+        import pandas as pd
+        combined = pd.concat(all_anomalies, ignore_index=True)
+        anomalies_list = combined.to_dict(orient="records")
+    else:
+        anomalies_list = []
+
+    return {
+        "anomalies": anomalies_list,
+        "date_range": {"start": str(start), "end": str(end)},
+        "dates_checked": dates_checked,
+        "total_anomalies": len(anomalies_list)
+    }
 
 @router.get("/anomalies/range")
+@profiled
 def anomalies_range(
+    request: Request,
     start_date: str = Query(default=None, description="Start date (YYYY-MM-DD)"),
     end_date: str = Query(default=None, description="End date (YYYY-MM-DD)"),
     days: int = Query(default=7, description="Number of days to look back if dates not specified"),
     min_z: float = 2.0,
+    format: str = Query(default="json", pattern="^(json|ndjson|arrow|parquet)$",
+                        description="'ndjson' streams one line per day as it is computed; "
+                                    "'arrow'/'parquet' return the anomalies table in binary form"),
+    collapse: bool = Query(default=False, description="Merge consecutive-day anomalies of the same entity, "
+                                                      "metric and direction into episodes (not for ndjson)"),
     db: Session = Depends(get_db)
 ):
     """
     Detect anomalies across a date range.
     Returns all anomalies found for each day in the range.
+    With format=ndjson the response is streamed: one {"date", "anomalies"} line
+    per day, followed by a summary line. Responses carry an ETag; a matching
+    If-None-Match returns 304 without running detection.
+    With collapse=true, consecutive days of the same anomaly come back as one
+    episode (start_date, end_date, days, peak_z, peak_date).
+    Identical concurrent requests share one computation, and at most
+    RANGE_MAX_CONCURRENCY ranges are computed at once (429 when the queue is full).
     """
+    from app.services.pipeline import HISTORY_DAYS
+
     # Determine date range
     if end_date:
         end = parse_date(end_date)
@@ -78,63 +188,266 @@ def anomalies_range(
 
     print(f"Checking anomalies from {start} to {end}")
 
-    all_anomalies = []
-    dates_checked = []
+    tag = etag(db, start - timedelta(days=HISTORY_DAYS), end, "range", start, end, min_z, format, collapse)
+    cached = not_modified(request, tag)
+    if cached:
+        return cached
 
-    # Check each date in the range
-    current_date = start
-    while current_date <= end:
-        dates_checked.append(str(current_date))
+    if format == "ndjson":
+        ticket = _range_admission.reserve()
+        body = ticket.bind(_ndjson_range(start, end, min_z, ticket))
+        if profiling.active():
+            body = iter(list(body))  # compute inside the profiled endpoint
+        return StreamingResponse(body, media_type="application/x-ndjson",
+                                 headers={"ETag": tag, "Cache-Control": "no-cache"})
 
-        # Get history (28 days before current date)
-        history_q = (
-            select(MetricsDaily)
-            .where(MetricsDaily.date < current_date)
-            .where(MetricsDaily.date >= current_date - timedelta(days=28))
-        )
-        # Get data for current date
-        current_q = select(MetricsDaily).where(MetricsDaily.date == current_date)
+    def compute():
+        with _range_admission.slot():
+            return _range_payload(db, start, end, min_z)
 
-        history_df = _to_df(db.execute(history_q).scalars().all())
-        current_df = _to_df(db.execute(current_q).scalars().all())
+    payload, _ = _inflight.do(("range", start, end, min_z), compute)
+    if collapse:
+        from app.services.episodes import merge_runs
+        rows = [{**a, "day": date_type.fromisoformat(a["detection_date"])} for a in payload["anomalies"]]
+        payload = {k: v for k, v in payload.items() if k != "anomalies"}
+        payload["episodes"] = merge_runs(rows)
+        return tabular_response(request, payload, "episodes", format, tag)
+    return tabular_response(request, payload, "anomalies", format, tag)
 
-        if not history_df.empty and not current_df.empty:
-            det = detect_anomalies(history_df, current_df, min_z=min_z)
+@router.get("/anomalies/episodes")
+@profiled
+def anomaly_episodes(
+    request: Request,
+    start_date: str = Query(default=None, description="Start date (YYYY-MM-DD)"),
+    end_date: str = Query(default=None, description="End date (YYYY-MM-DD)"),
+    days: int = Query(default=30, description="Number of days to look back if start_date is not given"),
+    ongoing: bool = Query(default=False, description="Only episodes still open on the latest detected day"),
+    entity_id: str = Query(default=None),
+    metric: str = Query(default=None),
+    min_z: float = Query(default=0.0, description="Minimum |peak_z|"),
+    format: str = Query(default="json", pattern="^(json|arrow|parquet)$"),
+    db: Session = Depends(get_db),
+):
+    """
+    Stored anomaly episodes (runs of consecutive days with the same entity,
+    metric and direction) that overlap the date range. Read from the episode
+    index, so no detection runs.
+    """
+    from app.services.episodes import overlapping
 
-            if not det.empty:
-                # Add the date to each anomaly
-                det['detection_date'] = str(current_date)
-                all_anomalies.append(det)
+    if ongoing:
+        latest = db.execute(select(func.max(Anomaly.window_end))).scalar()
+        if latest is None:
+            return tabular_response(request, {"episodes": []}, "episodes", format)
+        start = end = latest
+    else:
+        end = parse_date(end_date) if end_date else date_type.today()
+        start = parse_date(start_date) if start_date else end - timedelta(days=days - 1)
 
-        current_date += timedelta(days=1)
+    found = overlapping(db, start, end, entity_id=entity_id, metric=metric, min_peak_z=min_z)
+    records = [{
+        "id": e.id,
+        "entity_type": e.entity_type,
+        "entity_id": e.entity_id,
+        "metric": e.metric,
+        "direction": e.direction,
+        "start_date": e.start_date,
+        "end_date": e.end_date,
+        "days": e.days,
+        "peak_z": e.peak_z,
+        "peak_date": e.peak_date,
+    } for e in found]
+    payload = {"date_range": {"start": str(start), "end": str(end)}, "episodes": records}
+    return tabular_response(request, payload, "episodes", format)
 
-    # Combine all anomalies
-    if all_anomalies:
-        combined = pd.concat(all_anomalies, ignore_index=True)
-        anomalies_list = combined.to_dict(orient="records")
-    else:
-        anomalies_list = []
+@router.get("/anomalies/history")
+@profiled
+def anomalies_history(
+    request: Request,
+    customer_id: str = Query(default=None),
+    campaign_id: str = Query(default=None),
+    ad_group_id: str = Query(default=None),
+    metric: str = Query(default=None, description="e.g. ctr, or cost_shift for change points"),
+    direction: str = Query(default=None, pattern="^(up|down)$"),
+    start_date: str = Query(default=None, description="Earliest detection date (YYYY-MM-DD)"),
+    end_date: str = Query(default=None, description="Latest detection date (YYYY-MM-DD)"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str = Query(default=None, description="next_cursor of the previous page"),
+    format: str = Query(default="json", pattern="^(json|arrow|parquet)$"),
+    db: Session = Depends(get_db),
+):
+    """
+    Stored anomalies, newest detection date first, filtered by entity, metric,
+    direction and date range. No detection runs. Pages are keyset-paginated:
+    pass the previous page's `next_cursor` (also sent as X-Next-Cursor) to
+    continue. Each page is one range scan of a (filter, window_end, id) index,
+    so page 1000 costs the same as page 1.
+    """
+    from app.services import entities
 
-    return {
-        "anomalies": anomalies_list,
-        "date_range": {"start": str(start), "end": str(end)},
-        "dates_checked": dates_checked,
-        "total_anomalies": len(anomalies_list)
-    }
+    keys = {entity_type: entities.key_of(db, entity_type, value) for entity_type, value in
+            (("customer", customer_id), ("campaign", campaign_id), ("ad_group", ad_group_id)) if value}
+    rows, more = [], False
+    if None not in keys.values():  # an unknown id matches nothing
+        q = select(Anomaly)
+        for entity_type, key in keys.items():
+            q = q.where(getattr(Anomaly, f"{entity_type}_key") == key)
+        if metric:
+            q = q.where(Anomaly.metric == metric)
+        if direction:
+            q = q.where(Anomaly.direction == direction)
+        if start_date:
+            q = q.where(Anomaly.window_end >= parse_date(start_date))
+        if end_date:
+            q = q.where(Anomaly.window_end <= parse_date(end_date))
+        if cursor:
+            try:
+                day, _, last_id = cursor.partition(":")
+                after = (date_type.fromisoformat(day), int(last_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            q = q.where(tuple_(Anomaly.window_end, Anomaly.id) < after)
+        rows = db.execute(q.order_by(Anomaly.window_end.desc(), Anomaly.id.desc()).limit(limit + 1)).scalars().all()
+        more, rows = len(rows) > limit, rows[:limit]
+
+    names = entities.external_ids(db, {k for a in rows for k in (a.customer_key, a.campaign_key) if k is not None})
+    records = [{
+        "id": a.id,
+        "entity_type": a.entity_type,
+        "entity_id": a.entity_id,
+        "metric": a.metric,
+        "direction": a.direction,
+        "zscore": a.zscore,
+        "observed": a.observed,
+        "expected": a.expected,
+        "spans": a.spans,
+        "window_start": a.window_start,
+        "window_end": a.window_end,
+        "customer_id": names.get(a.customer_key),
+        "campaign_id": names.get(a.campaign_key),
+        "ad_group_id": a.entity_id if a.entity_type == "ad_group" else None,
+    } for a in rows]
+    next_cursor = f"{rows[-1].window_end}:{rows[-1].id}" if more else None
+    response = tabular_response(request, {"anomalies": records, "next_cursor": next_cursor}, "anomalies", format)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+class SweepLabel(BaseModel):
+    date: str
+    ad_group_id: str
+    metric: str
+    direction: str | None = None
 
-def _to_df(rows):
+class SweepReq(BaseModel):
+    start_date: str | None = None
+    end_date: str | None = None
+    days: int = 7
+    thresholds: list[float] | None = None      # min_z grid, defaults to sweep.THRESHOLDS
+    min_impressions: list[int] | None = None   # impression floors, defaults to sweep.IMPRESSION_FLOORS
+    labels: list[SweepLabel] | None = None     # ground truth, e.g. rows of generate_synthetic_data.py --labels
+
+@router.post("/anomalies/sweep")
+@profiled
+def anomalies_sweep(req: SweepReq, db: Session = Depends(get_db)):
+    """
+    Anomaly counts per metric and direction for every min_z in `thresholds` and
+    every impression floor in `min_impressions`, from one z-score pass over the
+    range. With `labels`, also precision/recall/F1 per threshold and floor.
+    Shares the /anomalies/range concurrency limit.
+    """
     import pandas as pd
-    if not rows:
-        return pd.DataFrame()
-    data = [{
-        "date": r.date,
-        "customer_id": r.customer_id,
-        "campaign_id": r.campaign_id,
-        "ad_group_id": r.ad_group_id,
-        "clicks": r.clicks,
-        "impressions": r.impressions,
-        "cost": r.cost,
-        "conversions": r.conversions,
-        "conv_value": r.conv_value,
-    } for r in rows]
-    return pd.DataFrame(data)
+    from app.services import sweep
+
+    end = parse_date(req.end_date) if req.end_date else date_type.today()
+    start = parse_date(req.start_date) if req.start_date else end - timedelta(days=req.days - 1)
+    thresholds = req.thresholds or sweep.THRESHOLDS
+    floors = req.min_impressions if req.min_impressions is not None else sweep.IMPRESSION_FLOORS
+
+    labels = None
+    if req.labels is not None:
+        labels = pd.DataFrame([l.model_dump() for l in req.labels],
+                              columns=["date", "ad_group_id", "metric", "direction"])
+        labels["date"] = [parse_date(d) for d in labels["date"]]
+        labels = labels[(labels["date"] >= start) & (labels["date"] <= end)]
+
+    def compute():
+        with _range_admission.slot():
+            return sweep.candidates(db, start, end)
+
+    # concurrent sweeps of the same range (e.g. different grids) share the z-scores
+    cand, _ = _inflight.do(("sweep", start, end), compute)
+    return {"date_range": {"start": str(start), "end": str(end)},
+            "scored": len(cand), **sweep.sweep(cand, thresholds, floors, labels)}
+
+def _anomalies_after(last_id: int, min_z: float, limit: int) -> list[dict]:
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(Anomaly)
+            .where(Anomaly.id > last_id)
+            .where(func.abs(Anomaly.zscore) >= min_z)
+            .order_by(Anomaly.id)
+            .limit(limit)
+        ).scalars().all()
+        return [{
+            "id": a.id,
+            "entity_type": a.entity_type,
+            "entity_id": a.entity_id,
+            "metric": a.metric,
+            "direction": a.direction,
+            "zscore": a.zscore,
+            "observed": a.observed,
+            "expected": a.expected,
+            "spans": a.spans,
+            "window_start": str(a.window_start),
+            "window_end": str(a.window_end),
+            "created_at": str(a.created_at),
+        } for a in rows]
+    finally:
+        db.close()
+
+def _latest_anomaly_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.execute(select(func.max(Anomaly.id))).scalar() or 0
+    finally:
+        db.close()
+
+async def _sse_anomalies(last_id: int, min_z: float):
+    sub = anomaly_events.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            sub.clear()  # before reading, so a commit during the read still wakes us
+            rows = await run_in_threadpool(_anomalies_after, last_id, min_z, _STREAM_BATCH)
+            for r in rows:
+                last_id = r["id"]
+                yield f"id: {last_id}\nevent: anomaly\ndata: {json.dumps(r)}\n\n"
+            if len(rows) == _STREAM_BATCH:
+                continue
+            if not await sub.wait(STREAM_POLL_SECONDS):
+                yield ": keep-alive\n\n"
+    finally:
+        sub.close()
+
+@router.get("/anomalies/stream")
+async def anomalies_stream(
+    last_event_id: int | None = Query(default=None, description="Resume after this anomaly id"),
+    min_z: float = Query(default=0.0, description="Only push anomalies with |z| >= min_z"),
+    last_event_id_header: int | None = Header(default=None, alias="Last-Event-ID"),
+):
+    """
+    Server-sent events: one `anomaly` event per newly stored Anomaly row, pushed
+    as soon as the detection that wrote it commits (post-ingest recompute or
+    /anomalies). Event ids are anomaly ids, so a reconnecting EventSource
+    resumes via Last-Event-ID; without one the stream starts at the newest row.
+    Re-detecting a day updates its stored rows in place under the same ids, so
+    only anomalies that are new to the day are pushed; changed values are not
+    re-sent (read them from /anomalies or /anomalies/history).
+    """
+    resume = last_event_id_header if last_event_id_header is not None else last_event_id
+    if resume is None:
+        resume = await run_in_threadpool(_latest_anomaly_id)
+    return StreamingResponse(_sse_anomalies(resume, min_z), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app.db.session import SessionLocal
 from app.db.models import Anomaly
-from app.services.explain import explain_anomaly
+from app.services.explain import explain_many
+from app.utils.time import parse_date
+from app.utils.telemetry import stage, count
+from app.utils.profiling import profiled
 
 router = APIRouter()
 
@@ -17,12 +21,12 @@ def get_db():
 class ExplainReq(BaseModel):
     anomaly_id: int
 
-@router.post("/explain")
-def explain(req: ExplainReq, db: Session = Depends(get_db)):
-    a = db.query(Anomaly).filter(Anomaly.id == req.anomaly_id).first()
-    if not a:
-        return {"error": "anomaly not found"}
-    payload = {
+class ExplainBatchReq(BaseModel):
+    anomaly_ids: list[int] | None = None
+    date: str | None = None  # explain every anomaly stored for this date instead
+
+def _payload(a: Anomaly) -> dict:
+    return {
         "metric": a.metric,
         "direction": a.direction,
         "zscore": a.zscore,
@@ -30,6 +34,49 @@ def explain(req: ExplainReq, db: Session = Depends(get_db)):
         "expected": a.expected,
         "entity_type": a.entity_type,
         "entity_id": a.entity_id,
+        "window_end": a.window_end,
     }
-    out = explain_anomaly(payload)
+
+@router.post("/explain")
+@profiled
+def explain(req: ExplainReq, db: Session = Depends(get_db)):
+    with stage("sql_fetch"):
+        a = db.query(Anomaly).filter(Anomaly.id == req.anomaly_id).first()
+    if not a:
+        return {"error": "anomaly not found"}
+    from app.services.drivers import drivers_for
+
+    payload = _payload(a)
+    [drivers] = drivers_for(db, [payload])
+    with stage("explain"):
+        [out] = explain_many([payload], [drivers])
     return {"anomaly_id": a.id, **out}
+
+@router.post("/explain/batch")
+@profiled
+def explain_batch(req: ExplainBatchReq, db: Session = Depends(get_db)):
+    """Explain many anomalies with one query: either `anomaly_ids` or every anomaly of `date`.
+    Drivers are decomposed per day from one metrics load, not per anomaly."""
+    from app.services.drivers import drivers_for
+
+    if (req.anomaly_ids is None) == (req.date is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of anomaly_ids or date")
+    q = select(Anomaly)
+    if req.anomaly_ids is not None:
+        q = q.where(Anomaly.id.in_(req.anomaly_ids))
+    else:
+        q = q.where(Anomaly.window_end == parse_date(req.date))
+    with stage("sql_fetch"):
+        found = db.execute(q.order_by(Anomaly.id)).scalars().all()
+    count("anomalies", len(found))
+
+    payloads = [_payload(a) for a in found]
+    drivers = drivers_for(db, payloads)
+    with stage("explain"):
+        explanations = [{"anomaly_id": a.id, **e}
+                        for a, e in zip(found, explain_many(payloads, drivers))]
+    out = {"explanations": explanations}
+    if req.anomaly_ids is not None:
+        seen = {a.id for a in found}
+        out["missing"] = [i for i in req.anomaly_ids if i not in seen]
+    return out
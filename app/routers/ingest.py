@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Depends, Query, UploadFile, File, HTTPException
-from sqlalchemy import select, delete
 from sqlalchemy.orm import Session
-from datetime import timedelta, datetime
-from app.db.session import SessionLocal, engine
-from app.db.models import Base, MetricsDaily
-from app.services.google_ads import fetch_daily_metrics
+from app.db.session import SessionLocal
 from app.utils.time import parse_date
-import pandas as pd
+from app.utils.telemetry import stage, count
+from app.utils.profiling import profiled
+from app.utils.events import anomaly_events
 import io
 
 router = APIRouter()
@@ -18,51 +16,64 @@ def get_db():
     finally:
         db.close()
 
-# Ensure tables exist on import
-Base.metadata.create_all(bind=engine)
+def _summary(result: dict) -> dict:
+    changed = result["changed"]
+    return {
+        "inserted": result["inserted"],
+        "updated": result["updated"],
+        "unchanged": result["unchanged"],
+        "deleted": result["deleted"],
+        "changed_entities": sum(len(v) for v in changed.values()),
+    }
 
 @router.post("/ingest")
+@profiled
 def ingest(date: str = Query(default="today"), db: Session = Depends(get_db)):
+    from app.services.google_ads import fetch_daily_metrics
+    from app.services.ingest import normalize_metrics, upsert_metrics
+    from app.services.pipeline import recompute_changed
+
     target_date = parse_date(date)
 
-    # clear existing rows for idempotency
-    db.execute(delete(MetricsDaily).where(MetricsDaily.date == target_date))
-
-    df = fetch_daily_metrics(target_date)
-    rows = [
-        MetricsDaily(
-            date=target_date,
-            customer_id=str(r["customer_id"]),
-            campaign_id=str(r["campaign_id"]),
-            ad_group_id=str(r["ad_group_id"]),
-            clicks=int(r["clicks"]),
-            impressions=int(r["impressions"]),
-            cost=float(r["cost"]),
-            conversions=float(r["conversions"]),
-            conv_value=float(r["conv_value"]),
-        )
-        for _, r in df.iterrows()
-    ]
-    db.add_all(rows)
-    db.commit()
-    return {"status": "ok", "date": str(target_date), "rows": len(rows)}
+    with stage("fetch"):
+        df = normalize_metrics(fetch_daily_metrics(target_date).assign(date=target_date))
+    count("rows_received", len(df))
+    # writes only new/changed rows and drops vanished ones, so re-ingest is idempotent
+    with stage("upsert"):
+        result = upsert_metrics(db, df)
+    with stage("recompute"):
+        recomputed = recompute_changed(db, result["changed"])
+    with stage("commit"):
+        db.commit()
+    if recomputed:
+        anomaly_events.publish()
+    return {"status": "ok", "date": str(target_date), "rows": len(df),
+            **_summary(result), "anomalies_recomputed": recomputed}
 
 @router.post("/ingest/upload")
-async def ingest_upload(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def ingest_upload(file: UploadFile = File(...), db: Session = Depends(get_db)):
     """
     Upload CSV file with Google Ads metrics data.
+    A plain def, like /ingest: the upsert and the re-detection of the changed
+    (and following) days run in the threadpool, not on the event loop.
 
     Required columns: date, customer_id, campaign_id, ad_group_id,
                      clicks, impressions, cost, conversions, conv_value
     """
+    import pandas as pd
+    from app.services.ingest import normalize_metrics, upsert_metrics
+    from app.services.pipeline import recompute_changed
+
     # Validate file type
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="File must be a CSV")
 
     try:
         # Read CSV file
-        contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
+        contents = file.file.read()
+        with stage("parse_csv"):
+            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
+        count("rows_received", len(df))
 
         # Validate required columns
         required_cols = ['date', 'customer_id', 'campaign_id', 'ad_group_id',
@@ -87,46 +98,40 @@ async def ingest_upload(file: UploadFile = File(...), db: Session = Depends(get_
         # Get unique dates in the uploaded data
         unique_dates = df['date'].unique()
 
-        # Clear existing data for those dates (idempotency)
-        for date_val in unique_dates:
-            db.execute(delete(MetricsDaily).where(MetricsDaily.date == date_val))
-
-        # Insert new rows
-        rows_inserted = 0
+        # Validate numeric columns up front so a bad row rejects the whole upload
         errors = []
-
-        for idx, row in df.iterrows():
-            try:
-                metric = MetricsDaily(
-                    date=row['date'],
-                    customer_id=str(row['customer_id']),
-                    campaign_id=str(row['campaign_id']),
-                    ad_group_id=str(row['ad_group_id']),
-                    clicks=int(row['clicks']),
-                    impressions=int(row['impressions']),
-                    cost=float(row['cost']),
-                    conversions=float(row['conversions']),
-                    conv_value=float(row['conv_value']),
-                )
-                db.add(metric)
-                rows_inserted += 1
-            except Exception as e:
-                errors.append(f"Row {idx + 2}: {str(e)}")  # +2 because of header and 0-indexing
+        for col in ['clicks', 'impressions', 'cost', 'conversions', 'conv_value']:
+            values = pd.to_numeric(df[col], errors='coerce')
+            for idx in df.index[values.isna()][:10]:
+                errors.append(f"Row {idx + 2}: invalid {col} value {df.at[idx, col]!r}")  # +2 because of header and 0-indexing
+            df[col] = values
 
         if errors:
-            db.rollback()
             raise HTTPException(
                 status_code=400,
                 detail=f"Errors parsing data:\n" + "\n".join(errors[:10])  # Show first 10 errors
             )
 
-        db.commit()
+        # Upsert by content hash: unchanged rows are left alone (idempotency)
+        with stage("upsert"):
+            result = upsert_metrics(db, normalize_metrics(df))
+        with stage("recompute"):
+            recomputed = recompute_changed(db, result["changed"])
+
+        with stage("commit"):
+            db.commit()
+        if recomputed:
+            anomaly_events.publish()
 
         return {
             "status": "ok",
-            "rows": rows_inserted,
+            "rows": len(df),
             "dates": [str(d) for d in unique_dates],
-            "message": f"Successfully uploaded {rows_inserted} rows across {len(unique_dates)} date(s)"
+            **_summary(result),
+            "anomalies_recomputed": recomputed,
+            "message": (f"Uploaded {len(df)} rows across {len(unique_dates)} date(s): "
+                        f"{result['inserted']} inserted, {result['updated']} updated, "
+                        f"{result['unchanged']} unchanged, {result['deleted']} deleted")
         }
 
     except HTTPException:
@@ -0,0 +1,104 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.db.session import SessionLocal
+from app.db.models import MetricsDaily
+from app.services.versions import etag
+from app.utils.http import not_modified, tabular_response
+from app.utils.time import parse_date
+from app.utils.profiling import profiled
+
+router = APIRouter()
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+_KEYS = ["customer_id", "campaign_id", "ad_group_id"]
+_BASE = ["clicks", "impressions", "cost", "conversions", "conv_value"]
+
+@router.get("/metrics/percentiles")
+@profiled
+def percentiles(
+    request: Request,
+    date: str = Query(default="today"),
+    metric: str = Query(default="ctr"),
+    peers: str = Query(default="portfolio", pattern="^(portfolio|customer|campaign)$",
+                       description="Rank each ad group against the whole portfolio, its customer or its campaign"),
+    customer_id: str = Query(default=None),
+    campaign_id: str = Query(default=None),
+    ad_group_id: str = Query(default=None),
+    max_tail: float = Query(default=1.0, ge=0.0, le=1.0,
+                            description="Only ad groups whose two-sided tail mass is at most this"),
+    format: str = Query(default="json", pattern="^(json|arrow|parquet)$"),
+    db: Session = Depends(get_db),
+):
+    """
+    Percentile rank of each ad group's metric on one day among its peers, read
+    from the stored quantile sketches (no other entity's rows are loaded).
+    `tail` = 2 x min(p, 1 - p) is the peer-relative anomaly score: 0.02 means
+    only 2% of peers are at least as far out. Thin ad groups are ranked too.
+    """
+    import numpy as np
+    import pandas as pd
+    from app.services import entities, sketches
+
+    if metric not in sketches.SKETCH_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {metric}; "
+                                                    f"use one of {', '.join(sketches.SKETCH_METRICS)}")
+    day = parse_date(date)
+    tag = etag(db, day, day, "percentiles", metric, peers, customer_id, campaign_id, ad_group_id,
+               max_tail, format, sketches.SKETCH_ALPHA)
+    cached = not_modified(request, tag)
+    if cached:
+        return cached
+
+    sketches.ensure_day(db, day)
+    keys = {entity_type: entities.key_of(db, entity_type, value) for entity_type, value in
+            (("customer", customer_id), ("campaign", campaign_id), ("ad_group", ad_group_id)) if value}
+    rows = []
+    if None not in keys.values():  # an unknown id matches nothing
+        q = (select(*(getattr(MetricsDaily, c) for c in entities.KEY_COLUMNS + _BASE))
+             .where(MetricsDaily.date == day))
+        for entity_type, key in keys.items():
+            q = q.where(getattr(MetricsDaily, f"{entity_type}_key") == key)
+        rows = db.execute(q).all()
+    df = pd.DataFrame(rows, columns=entities.KEY_COLUMNS + _BASE)
+    names = entities.external_ids(db, np.unique(df[entities.KEY_COLUMNS].to_numpy()).tolist())
+    for key, col in zip(entities.KEY_COLUMNS, _KEYS):
+        df[col] = df[key].map(names).astype(object)
+    df["value"] = sketches.metric_values(df, metric)
+    df = df[df["value"].notna()].reset_index(drop=True)
+
+    by = {"customer": "customer_id", "campaign": "campaign_id"}.get(peers)
+    groups = sketches.peer_sketches(db, day, metric, peers, df[by].unique() if by else None)
+    values = df["value"].to_numpy()
+    pct, n_peers = np.full(len(df), np.nan), np.zeros(len(df), dtype=np.int64)
+    for key, idx in (df.groupby(by).indices.items() if by else [(None, np.arange(len(df)))]):
+        sketch = groups.get(key)
+        if sketch is not None:
+            pct[idx] = sketch.rank(values[idx])
+            n_peers[idx] = sketch.n
+    df["percentile"], df["peers"] = pct, n_peers
+    df["tail"] = 2 * np.minimum(df["percentile"], 1 - df["percentile"])
+    df["direction"] = np.where(df["percentile"] >= 0.5, "up", "down")
+    df = df[df["tail"] <= max_tail].sort_values(["tail", "ad_group_id"], kind="stable")
+
+    out = df[_KEYS + ["impressions", "value", "percentile", "tail", "direction", "peers"]].copy()
+    out["percentile"] = (out["percentile"] * 100).round(2)
+    out["tail"] = out["tail"].round(4)
+    payload = {
+        "date": str(day),
+        "metric": metric,
+        "peers": peers,
+        "groups": [
+            {by or "scope": key if by else "portfolio", "n": s.n,
+             **{f"p{round(q * 100):02d}": s.quantile(q) for q in sketches.QUANTILES}}
+            for key, s in groups.items()
+        ],
+        "entities": out.to_dict(orient="records"),
+    }
+    return tabular_response(request, payload, "entities", format, tag)
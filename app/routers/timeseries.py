@@ -0,0 +1,103 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from datetime import timedelta
+from app.db.session import SessionLocal
+from app.db.models import MetricsDaily
+from app.services.versions import etag
+from app.utils.http import not_modified, tabular_response
+from app.utils.time import parse_date
+from app.utils.profiling import profiled
+
+router = APIRouter()
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# days of extra history loaded so the first points still get a full expectation window
+_PERIOD_DAYS = {"day": 1, "week": 7, "month": 31}
+_BAND_WINDOW = 28
+
+@router.get("/metrics/timeseries")
+@profiled
+def timeseries(
+    request: Request,
+    customer_id: str = Query(default=None),
+    campaign_id: str = Query(default=None),
+    ad_group_id: str = Query(default=None),
+    metrics: str = Query(default="cost,ctr,cvr", description="Comma-separated metric names"),
+    start_date: str = Query(default=None, description="Start date (YYYY-MM-DD), defaults to a year before end"),
+    end_date: str = Query(default="today", description="End date (YYYY-MM-DD)"),
+    freq: str = Query(default="day", pattern="^(day|week|month)$"),
+    max_points: int = Query(default=500, ge=3, description="Downsample each series to at most this many points (LTTB)"),
+    band: bool = Query(default=True, description="Include the EWMA expectation band"),
+    k: float = Query(default=2.0, description="Band half-width in standard deviations"),
+    db: Session = Depends(get_db),
+):
+    """
+    Metric history for a customer, campaign or ad group (rows matching all given
+    ids are summed per period), with the EWMA expectation band used by detection.
+    """
+    import numpy as np
+    import pandas as pd
+    from app.services import entities
+    from app.services.timeseries import BASE_METRICS, DERIVED_METRICS, aggregate, expectation_band, lttb
+
+    if not (customer_id or campaign_id or ad_group_id):
+        raise HTTPException(status_code=400, detail="Provide customer_id, campaign_id and/or ad_group_id")
+    wanted = [m.strip() for m in metrics.split(",") if m.strip()]
+    unknown = [m for m in wanted if m not in BASE_METRICS + DERIVED_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}")
+
+    end = parse_date(end_date)
+    start = parse_date(start_date) if start_date else end - timedelta(days=365)
+    load_start = start - timedelta(days=_BAND_WINDOW * _PERIOD_DAYS[freq]) if band else start
+
+    tag = etag(db, load_start, end, "timeseries", customer_id, campaign_id, ad_group_id,
+               tuple(wanted), start, end, freq, max_points, band, k)
+    cached = not_modified(request, tag)
+    if cached:
+        return cached
+
+    keys = {entity_type: entities.key_of(db, entity_type, value) for entity_type, value in
+            (("customer", customer_id), ("campaign", campaign_id), ("ad_group", ad_group_id)) if value}
+    rows = []
+    if None not in keys.values():  # an unknown id matches nothing
+        q = (
+            select(MetricsDaily.date, *(getattr(MetricsDaily, m) for m in BASE_METRICS))
+            .where(MetricsDaily.date >= load_start)
+            .where(MetricsDaily.date <= end)
+        )
+        for entity_type, key in keys.items():
+            q = q.where(getattr(MetricsDaily, f"{entity_type}_key") == key)
+        rows = db.execute(q).all()
+
+    payload = {
+        "entity": {"customer_id": customer_id, "campaign_id": campaign_id, "ad_group_id": ad_group_id},
+        "freq": freq,
+        "date_range": {"start": str(start), "end": str(end)},
+        "series": {m: [] for m in wanted},
+    }
+    if not rows:
+        return tabular_response(request, payload, "series", "json", tag)
+
+    agg = aggregate(pd.DataFrame(rows, columns=["date", *BASE_METRICS]), freq)
+    in_range = (agg["date"] >= pd.Timestamp(start)).to_numpy()
+    for m in wanted:
+        out = pd.DataFrame({"date": agg["date"].dt.date.astype(str), "value": agg[m]})
+        if band:
+            out = pd.concat([out, expectation_band(agg[m], window=_BAND_WINDOW, k=k)], axis=1)
+        out = out[in_range].reset_index(drop=True)
+        keep = np.arange(len(out))
+        if len(out) > max_points:
+            # empty periods (NaN) carry no shape; downsample the points that have a value
+            keep = np.flatnonzero(out["value"].notna().to_numpy())
+            keep = keep[lttb(keep.astype(float), out["value"].to_numpy(dtype=float)[keep], max_points)]
+        out = out.iloc[keep].astype(object)
+        payload["series"][m] = out.where(out.notna(), None).to_dict(orient="records")
+    return tabular_response(request, payload, "series", "json", tag)
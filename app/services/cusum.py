@@ -0,0 +1,190 @@
+"""Streaming CUSUM change-point detection on the detection metrics.
+
+Each (ad group, metric) keeps a handful of floats in `cusum_state`: a slowly
+adapting reference mean and variance, and the upper and lower cumulative sums
+of standardized deviations from it (tabular CUSUM, allowance CUSUM_K, decision
+interval CUSUM_H). A newly ingested day advances every state by one
+constant-time step, vectorized across entities. A sum crossing the decision
+interval is stored as an Anomaly with metric "<metric>_shift". zscore holds
+the signed cumulative sum, window_start is the day the shift began, and
+expected is the level before it. The sum is then reset and the reference
+re-anchored at the new level. Each day's standardized deviation is clipped to
++/- CUSUM_H / 2 before it is summed, so a single-day spike can neither fire an
+alarm nor drag the re-anchored level with it.
+
+A day at or before an entity's last processed day (a correction or backfill)
+cannot be applied incrementally. Those entities are replayed from their stored
+history instead.
+"""
+from __future__ import annotations
+import os
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import Session
+from app.db.models import Anomaly, CusumState
+from app.services.detect import METRICS, MIN_IMPRESSIONS, add_derived_metrics
+from app.services.pipeline import load_metrics, from_day_number, with_keys
+from app.services import episodes
+from app.utils.telemetry import stage, count
+
+CUSUM_K = float(os.getenv("CUSUM_K", "0.5"))
+CUSUM_H = float(os.getenv("CUSUM_H", "8.0"))
+CUSUM_ALPHA = float(os.getenv("CUSUM_ALPHA", "0.02"))  # adaptation rate of the reference
+CUSUM_WARMUP = int(os.getenv("CUSUM_WARMUP", "28"))    # days used to seed the reference
+SUFFIX = "_shift"
+
+_STATE = ["n", "mean", "var", "pos", "neg", "pos_start", "neg_start"]
+_CHUNK = 500
+
+def step(state: pd.DataFrame, x: np.ndarray, impressions: np.ndarray, day: date):
+    """Advance `state` (columns _STATE, one row per entity/metric) by one day of
+    values `x`. Returns (new state, alarms) where alarms is a frame with the
+    row positions, direction, statistic, level before the shift and run start."""
+    n = state["n"].to_numpy(dtype=float)
+    mean = state["mean"].to_numpy(dtype=float).copy()
+    var = state["var"].to_numpy(dtype=float).copy()
+    pos = state["pos"].to_numpy(dtype=float)
+    neg = state["neg"].to_numpy(dtype=float)
+    pos_start = state["pos_start"].to_numpy(dtype=object).copy()
+    neg_start = state["neg_start"].to_numpy(dtype=object).copy()
+
+    warm = n >= CUSUM_WARMUP
+    sd = np.sqrt(var)
+    z = np.divide(x - mean, sd, out=np.zeros(len(x)), where=warm & (sd > 0))
+    z = np.clip(z, -CUSUM_H / 2, CUSUM_H / 2)
+    new_pos = np.where(warm, np.maximum(0.0, pos + z - CUSUM_K), 0.0)
+    new_neg = np.where(warm, np.maximum(0.0, neg - z - CUSUM_K), 0.0)
+    pos_start[(new_pos > 0) & (pos == 0)] = day
+    neg_start[(new_neg > 0) & (neg == 0)] = day
+    pos_start[new_pos == 0] = None
+    neg_start[new_neg == 0] = None
+
+    loud = impressions >= MIN_IMPRESSIONS
+    up = (new_pos > CUSUM_H) & loud
+    down = (new_neg > CUSUM_H) & loud & ~up
+    fired = up | down
+    alarms = pd.DataFrame({
+        "row": np.flatnonzero(fired),
+        "direction": np.where(up[fired], "up", "down"),
+        "zscore": np.where(up, new_pos, -new_neg)[fired],
+        "observed": x[fired],
+        "expected": mean[fired],
+        "window_start": np.where(up, pos_start, neg_start)[fired],
+    })
+
+    # reference: running mean/variance while seeding, exponentially weighted after;
+    # an alarmed day is off the old level, so it leaves the variance alone
+    ref = mean
+    d = x - ref
+    seed_w = 1.0 / (n + 1.0)
+    mean = ref + np.where(warm, CUSUM_ALPHA, seed_w) * d
+    var = np.where(fired, var, np.where(warm, (1 - CUSUM_ALPHA) * (var + CUSUM_ALPHA * d * d),
+                                        var + (d * (x - mean) - var) * seed_w))
+    # after an alarm the sums restart from the estimated new level,
+    # reference +/- sd * (k + sum / run length); a one-day run keeps the reference
+    if fired.any():
+        starts = np.where(up, pos_start, neg_start)
+        run = np.array([(day - s).days + 1 if s else 1 for s in starts[fired]], dtype=float)
+        level = sd[fired] * (CUSUM_K + np.where(up, new_pos, new_neg)[fired] / run)
+        mean[fired] = np.where(run > 1, ref[fired] + np.where(up[fired], level, -level), ref[fired])
+        new_pos[fired] = new_neg[fired] = 0.0
+        pos_start[fired] = neg_start[fired] = None
+
+    new_state = pd.DataFrame({"n": (n + 1).astype(int), "mean": mean, "var": var, "pos": new_pos, "neg": new_neg,
+                              "pos_start": pos_start, "neg_start": neg_start}, index=state.index)
+    return new_state, alarms
+
+def _observations(day_df: pd.DataFrame) -> pd.DataFrame:
+    """One row per (ad_group_id, metric) with the day's value `x` and the row's impressions."""
+    d = add_derived_metrics(day_df).astype({"ad_group_id": str})
+    return (d[["ad_group_id", "impressions", *METRICS]]
+            .melt(id_vars=["ad_group_id", "impressions"], value_vars=METRICS, var_name="metric", value_name="x")
+            .set_index(["ad_group_id", "metric"]))
+
+def _empty_states() -> pd.DataFrame:
+    return pd.DataFrame(columns=["last_date", *_STATE],
+                        index=pd.MultiIndex.from_tuples([], names=["ad_group_id", "metric"]))
+
+def _load_states(db: Session, ad_group_ids: list[str]) -> pd.DataFrame:
+    rows = []
+    for i in range(0, len(ad_group_ids), _CHUNK):
+        rows.extend(db.execute(
+            select(CusumState.ad_group_id, CusumState.metric, CusumState.last_date,
+                   *(getattr(CusumState, c) for c in _STATE))
+            .where(CusumState.ad_group_id.in_(ad_group_ids[i:i + _CHUNK]))
+        ).all())
+    if not rows:
+        return _empty_states()
+    return pd.DataFrame(rows, columns=["ad_group_id", "metric", "last_date", *_STATE]).set_index(["ad_group_id", "metric"])
+
+def _advance(states: pd.DataFrame, day: date, day_df: pd.DataFrame):
+    """Apply one day to the in-memory states; returns (states, shift anomaly dicts)."""
+    obs = _observations(day_df)
+    prev = states.reindex(obs.index)[_STATE]
+    fresh = prev["n"].isna()
+    prev.loc[fresh, ["n", "mean", "var", "pos", "neg"]] = 0.0
+    prev.loc[fresh, ["pos_start", "neg_start"]] = None
+    new, alarms = step(prev, obs["x"].to_numpy(dtype=float), obs["impressions"].to_numpy(dtype=float), day)
+    new["last_date"] = day
+    states = pd.concat([states.drop(obs.index, errors="ignore"), new])
+    keys = obs.index[alarms["row"].to_numpy()]
+    found = [
+        {"entity_type": "ad_group", "entity_id": ag, "metric": f"{metric}{SUFFIX}",
+         "direction": a.direction, "zscore": round(float(a.zscore), 3),
+         "observed": round(float(a.observed), 6), "expected": round(float(a.expected), 6),
+         "window_start": a.window_start or day, "window_end": day}
+        for (ag, metric), a in zip(keys, alarms.itertuples(index=False))
+    ]
+    return states, found
+
+def _delete(db: Session, model_filter, ad_group_ids: list[str]):
+    for i in range(0, len(ad_group_ids), _CHUNK):
+        db.execute(model_filter(ad_group_ids[i:i + _CHUNK]))
+
+def update_changed(db: Session, changed: dict) -> int:
+    """Advance CUSUM state for an ingest's changed entities ({date: set(ad_group_id)},
+    as returned by upsert_metrics) and store the shifts found. Returns their count."""
+    if not changed:
+        return 0
+    with stage("cusum"):
+        ids = sorted(set().union(*changed.values()))
+        states = _load_states(db, ids)
+        last = states.groupby(level="ad_group_id")["last_date"].max()
+        # a changed day the entity has already processed cannot be applied incrementally
+        replay = sorted({ag for day, ags in changed.items() for ag in ags
+                         if ag in last.index and day <= last[ag]})
+        found = []
+        if replay:
+            states = states.drop(replay, level="ad_group_id")
+            _delete(db, lambda chunk: delete(Anomaly).where(Anomaly.metric.endswith(SUFFIX, autoescape=True))
+                    .where(Anomaly.entity_id.in_(chunk)), replay)
+            history = load_metrics(db, date.min, date.max, replay)
+            for day, day_df in (history.groupby("date", sort=True) if not history.empty else ()):
+                states, shifts = _advance(states, from_day_number(day), day_df)
+                found.extend(shifts)
+        for day, ags in sorted(changed.items()):
+            fresh = sorted(set(ags).difference(replay))
+            day_df = load_metrics(db, day, day, fresh) if fresh else pd.DataFrame()
+            if not day_df.empty:
+                states, shifts = _advance(states, day, day_df)
+                found.extend(shifts)
+
+        _delete(db, lambda chunk: delete(CusumState).where(CusumState.ad_group_id.in_(chunk)), ids)
+        recs = states.reset_index().astype(object)
+        recs = recs.where(recs.notna(), None).to_dict(orient="records")
+        if recs:
+            db.execute(insert(CusumState), recs)
+        if found:
+            db.execute(insert(Anomaly), with_keys(db, found))
+        if replay:
+            episodes.rebuild(db, replay)
+        shifted = {}
+        for r in found:
+            if r["entity_id"] not in replay:
+                shifted.setdefault(r["window_end"], set()).add(r["entity_id"])
+        for day, ags in shifted.items():
+            episodes.refresh(db, day, ags)
+    count("shifts", len(found))
+    return len(found)
@@ -2,17 +2,32 @@ from __future__ import annotations
 from datetime import date, timedelta
 import pandas as pd
 import numpy as np
+from app.utils.telemetry import stage, count
+
+METRICS = ["cost", "ctr", "cvr"]
+# name -> (EWMA span, history window in days). Short catches sudden spikes, long
+# catches slow drifts; all are computed in one pass over the loaded history.
+BASELINES = {
+    "short": (7, 28),
+    "medium": (14, 28),
+    "long": (28, 56),
+}
+MIN_IMPRESSIONS = 200
+_KEYS = ["customer_id", "campaign_id", "ad_group_id"]
+_RATES = {"ctr": ("clicks", "impressions"), "cpc": ("cost", "clicks"),
+          "cvr": ("conversions", "clicks"), "roas": ("conv_value", "cost")}
 
 def _safe_rate(n, d):
     return (n / d) if d else 0.0
 
 def add_derived_metrics(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df["ctr"] = df.apply(lambda r: _safe_rate(r["clicks"], r["impressions"]), axis=1)
-    df["cpc"] = df.apply(lambda r: _safe_rate(r["cost"], r["clicks"]), axis=1)
-    df["cvr"] = df.apply(lambda r: _safe_rate(r["conversions"], r["clicks"]), axis=1)
-    df["roas"] = df.apply(lambda r: _safe_rate(r["conv_value"], r["cost"]), axis=1)
-    return df
+    with stage("derived_metrics"):
+        df = df.copy()
+        for name, (num, den) in _RATES.items():
+            n = df[num].to_numpy(dtype=float)
+            d = df[den].to_numpy(dtype=float)
+            df[name] = np.divide(n, d, out=np.zeros(len(df)), where=d != 0)
+        return df
 
 def ewma_expected(series: pd.Series, span: int = 14):
     if series.size == 0:
@@ -23,38 +38,135 @@ def ewma_expected(series: pd.Series, span: int = 14):
     std = float(resid.std(ddof=1)) if resid.size > 1 else 0.0
     return exp, std
 
+def compute_zscores(history: pd.DataFrame, today_df: pd.DataFrame, metrics=METRICS) -> pd.DataFrame:
+    """Today's value of each entity/metric scored against every baseline in BASELINES.
+
+    One row per (entity, metric) with the entity keys, `observed`, `impressions`,
+    the last history day `window_end`, and `expected_<b>`, `std_<b>`, `z_<b>` and
+    `window_start_<b>` per baseline (z is NaN where the spread is zero or undefined). Each
+    baseline equals ewma_expected over the entity's last `window` days of history.
+    """
+    if history.empty or today_df.empty:
+        return pd.DataFrame()
+    day = today_df["date"].max()
+    with stage("zscores"):
+        return _zscores(add_derived_metrics(history), add_derived_metrics(today_df), metrics, day)
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    """Days since 1970-01-01; load_metrics frames already store them (int32)."""
+    if pd.api.types.is_integer_dtype(dates):
+        return dates.to_numpy().astype(np.int64)
+    return pd.to_datetime(dates).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+def _zscores(history: pd.DataFrame, today_df: pd.DataFrame, metrics, day) -> pd.DataFrame:
+    today_df = today_df.drop_duplicates(_KEYS, keep="first")
+    # entities that have both history and a row for today, as in the per-group loop
+    h = history.merge(today_df[_KEYS], on=_KEYS).sort_values(_KEYS + ["date"], kind="stable")
+    if h.empty:
+        return pd.DataFrame()
+    ent = h.groupby(_KEYS, sort=False, observed=True).ngroup().to_numpy()
+    n_ent = ent.max() + 1
+    count("entities", n_ent)
+
+    # (entity, step, metric) cube; each entity's observations are right-aligned so
+    # the last column is its latest day and shorter histories are NaN-padded on the left
+    sizes = np.bincount(ent, minlength=n_ent)
+    steps = sizes.max()
+    first = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    col = np.arange(len(h)) - first[ent] + (steps - sizes[ent])
+    values = np.full((n_ent, steps, len(metrics)), np.nan)
+    values[ent, col] = h[metrics].to_numpy(dtype=float)
+    days = np.full((n_ent, steps), np.iinfo(np.int64).min)
+    days[ent, col] = _day_numbers(h["date"])
+
+    # every baseline advances together through one scan over the steps
+    names = list(BASELINES)
+    spans = np.array([BASELINES[b][0] for b in names], dtype=float)
+    alpha = (2.0 / (spans + 1.0))[:, None, None]
+    cutoff = _day_numbers(pd.Series([day]))[0] - np.array([BASELINES[b][1] for b in names])
+    in_window = days[None, :, :] >= cutoff[:, None, None]  # (baseline, entity, step)
+
+    shape = (len(names), n_ent, len(metrics))
+    level = np.full(shape, np.nan)
+    n = np.zeros(shape)
+    total = np.zeros(shape)
+    total_sq = np.zeros(shape)
+    start = np.full((len(names), n_ent), np.iinfo(np.int64).max)
+    for t in range(steps):
+        v = values[None, :, t, :]
+        use = in_window[:, :, t, None] & ~np.isnan(v)
+        level = np.where(use, np.where(np.isnan(level), v, level + alpha * (v - level)), level)
+        resid = np.where(use, v - level, 0.0)
+        n += use
+        total += resid
+        total_sq += resid * resid
+        start = np.where(in_window[:, :, t], np.minimum(start, days[:, t]), start)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(np.maximum(total_sq - total * total / n, 0.0) / (n - 1))
+    std = np.where(n > 1, std, 0.0)
+
+    keys = h[_KEYS].iloc[first].reset_index(drop=True)
+    t = keys.merge(today_df, on=_KEYS, how="left")
+    observed = t[metrics].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, (observed[None] - level) / std, np.nan)
+
+    out = keys.loc[np.repeat(np.arange(n_ent), len(metrics))].reset_index(drop=True)
+    out["metric"] = np.tile(metrics, n_ent)
+    out["observed"] = observed.ravel()
+    out["impressions"] = np.repeat(t["impressions"].to_numpy(dtype=float), len(metrics))
+    epoch = np.datetime64("1970-01-01", "D")
+    out["window_end"] = np.repeat(pd.to_datetime(epoch + days[:, -1]).date, len(metrics))
+    for i, b in enumerate(names):
+        out[f"expected_{b}"] = level[i].ravel()
+        out[f"std_{b}"] = std[i].ravel()
+        out[f"z_{b}"] = z[i].ravel()
+        first_day = np.full(n_ent, np.datetime64("NaT"), dtype="datetime64[D]")
+        has = start[i] != np.iinfo(np.int64).max
+        first_day[has] = epoch + start[i][has]
+        out[f"window_start_{b}"] = np.repeat(pd.Series(pd.to_datetime(first_day)).dt.date.to_numpy(), len(metrics))
+    return out
+
 def detect_anomalies(history: pd.DataFrame, today_df: pd.DataFrame, min_z: float = 2.0) -> pd.DataFrame:
     """Return anomalies DataFrame with columns:
-    [entity_type, entity_id, metric, direction, zscore, observed, expected, window_start, window_end]
+    [entity_type, entity_id, metric, direction, zscore, observed, expected, spans, window_start, window_end]
+    An entity/metric is anomalous when any baseline's |z| >= min_z; `spans` lists
+    the baselines that fired and zscore/expected come from the strongest one.
     """
-    metrics = ["cost", "ctr", "cvr"]
-    out = []
-    # Group key at ad_group level for higher resolution
-    for (cust, camp, ag), h in history.groupby(["customer_id", "campaign_id", "ad_group_id"]):
-        t = today_df[(today_df.customer_id==cust)&(today_df.campaign_id==camp)&(today_df.ad_group_id==ag)]
-        if t.empty: 
-            continue
-        h = add_derived_metrics(h.sort_values("date"))
-        t = add_derived_metrics(t).iloc[0]
-        for m in metrics:
-            exp, std = ewma_expected(h[m])
-            if exp is None or std is None or std == 0:
-                continue
-            obs = float(t[m])
-            z = (obs - exp) / std
-            if abs(z) >= min_z and t["impressions"] >= 200:
-                out.append({
-                    "entity_type": "ad_group",
-                    "entity_id": ag,
-                    "metric": m,
-                    "direction": "up" if z>0 else "down",
-                    "zscore": round(float(z), 3),
-                    "observed": round(obs, 6),
-                    "expected": round(float(exp), 6),
-                    "window_start": h["date"].min(),
-                    "window_end": h["date"].max(),
-                    "customer_id": cust,
-                    "campaign_id": camp,
-                    "ad_group_id": ag,
-                })
-    return pd.DataFrame(out)
+    with stage("detect"):
+        out = _detect(history, today_df, min_z)
+    count("anomalies", len(out))
+    return out
+
+def _detect(history: pd.DataFrame, today_df: pd.DataFrame, min_z: float) -> pd.DataFrame:
+    scores = compute_zscores(history, today_df)
+    if scores.empty:
+        return pd.DataFrame()
+    names = list(BASELINES)
+    z = scores[[f"z_{b}" for b in names]].to_numpy()
+    fired = (np.abs(np.nan_to_num(z)) >= min_z) & (scores["impressions"].to_numpy() >= MIN_IMPRESSIONS)[:, None]
+    rows = fired.any(axis=1)
+    if not rows.any():
+        return pd.DataFrame()
+    z, fired, s = z[rows], fired[rows], scores[rows].reset_index(drop=True)
+    s[_KEYS] = s[_KEYS].astype(str)  # plain ids in the output, whatever the input key dtype
+    best = np.argmax(np.where(fired, np.abs(z), -1.0), axis=1)
+    zbest = z[np.arange(len(s)), best]
+    pick = np.arange(len(s)), best
+    expected = s[[f"expected_{b}" for b in names]].to_numpy()[pick]
+    window_start = s[[f"window_start_{b}" for b in names]].to_numpy()[pick]
+    return pd.DataFrame({
+        "entity_type": "ad_group",
+        "entity_id": s["ad_group_id"],
+        "metric": s["metric"],
+        "direction": np.where(zbest > 0, "up", "down"),
+        "zscore": np.round(zbest, 3),
+        "observed": np.round(s["observed"].to_numpy(), 6),
+        "expected": np.round(expected, 6),
+        "spans": [",".join(b for b, f in zip(names, row) if f) for row in fired],
+        "window_start": window_start,
+        "window_end": s["window_end"],
+        "customer_id": s["customer_id"],
+        "campaign_id": s["campaign_id"],
+        "ad_group_id": s["ad_group_id"],
+    })
@@ -0,0 +1,153 @@
+"""Driver decomposition: why did an anomalous metric move?
+
+Each metric is a product of drivers, e.g. cost = impressions x CTR x CPC, so its
+log change is the sum of the drivers' log changes (signed), and each driver's
+share of that sum is its contribution. Changes are measured against the entity's
+mean day over the detection history. The same change is computed for the
+entity's sibling ad groups (same campaign, entity excluded) to tell
+campaign-wide moves from local ones.
+
+Only the anomalies' campaigns are loaded: for each distinct day, the history
+window of the anomalous ad groups and their siblings is aggregated per ad group
+once, and that day's anomalies are decomposed in a few vectorized passes.
+"""
+from __future__ import annotations
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from app.services.pipeline import load_window
+from app.services import entities
+from app.utils.telemetry import stage
+
+BASE = ["impressions", "clicks", "cost", "conversions", "conv_value"]
+# rate -> (numerator, denominator)
+RATES = {
+    "ctr": ("clicks", "impressions"),
+    "cpc": ("cost", "clicks"),
+    "cvr": ("conversions", "clicks"),
+    "cpa": ("cost", "conversions"),
+    "roas": ("conv_value", "cost"),
+    "value_per_conv": ("conv_value", "conversions"),
+}
+# metric -> [(driver, exponent)]; the product of driver**exponent equals the metric
+DRIVERS = {
+    "cost": [("impressions", 1), ("ctr", 1), ("cpc", 1)],
+    "clicks": [("impressions", 1), ("ctr", 1)],
+    "conversions": [("clicks", 1), ("cvr", 1)],
+    "conv_value": [("conversions", 1), ("value_per_conv", 1)],
+    "ctr": [("clicks", 1), ("impressions", -1)],
+    "cvr": [("conversions", 1), ("clicks", -1)],
+    "cpc": [("cost", 1), ("clicks", -1)],
+    "cpa": [("cpc", 1), ("cvr", -1)],
+    "roas": [("value_per_conv", 1), ("cvr", 1), ("cpc", -1)],
+}
+TOP_DRIVERS = 3
+
+def day_aggregates(history: pd.DataFrame, today: pd.DataFrame) -> pd.DataFrame:
+    """One row per ad group: its campaign, today's base metrics (t_*) and the mean
+    day of its history (b_*), plus the same for its siblings (st_*, sb_*)."""
+    t = today.groupby("ad_group_id", observed=True).agg(
+        campaign_id=("campaign_id", "first"), **{f"t_{m}": (m, "sum") for m in BASE})
+    days = max(history["date"].nunique(), 1) if not history.empty else 1
+    b = history.groupby("ad_group_id", observed=True)[BASE].sum() / days
+    agg = t.join(b.add_prefix("b_"), how="left").fillna(0.0)
+    agg["baseline_days"] = days
+
+    cols = [f"{p}_{m}" for p in ("t", "b") for m in BASE]
+    campaign = agg.groupby("campaign_id")[cols].transform("sum")
+    for p in ("t", "b"):
+        for m in BASE:
+            agg[f"s{p}_{m}"] = campaign[f"{p}_{m}"] - agg[f"{p}_{m}"]
+    agg["siblings"] = agg.groupby("campaign_id")["campaign_id"].transform("size") - 1
+    return agg
+
+def _value(agg: pd.DataFrame, prefix: str, name: str) -> np.ndarray:
+    if name in RATES:
+        num, den = RATES[name]
+        n = agg[f"{prefix}_{num}"].to_numpy(dtype=float)
+        d = agg[f"{prefix}_{den}"].to_numpy(dtype=float)
+        return np.divide(n, d, out=np.full(len(agg), np.nan), where=d > 0)
+    return agg[f"{prefix}_{name}"].to_numpy(dtype=float)
+
+def _log_change(new: np.ndarray, old: np.ndarray) -> np.ndarray:
+    ok = (new > 0) & (old > 0)
+    return np.log(new, out=np.full(len(new), np.nan), where=ok) - np.log(old, out=np.zeros(len(old)), where=ok)
+
+def _pct(dlog: float):
+    return None if np.isnan(dlog) else round(float(np.expm1(dlog)) * 100, 1)
+
+def decompose(anomalies: pd.DataFrame, agg: pd.DataFrame) -> list[dict | None]:
+    """Drivers and sibling comparison for each row of `anomalies` (entity_id,
+    metric), aligned with its rows. None where the entity or metric is unknown."""
+    out: list = [None] * len(anomalies)
+    if anomalies.empty or agg.empty:
+        return out
+    rows = agg.reindex(anomalies["entity_id"].to_numpy())
+    pos = np.arange(len(anomalies))
+    for name, idx in anomalies.groupby("metric").indices.items():
+        metric = name.removesuffix("_shift")  # change-point findings decompose like their metric
+        drivers = DRIVERS.get(metric)
+        if not drivers:
+            continue
+        sub = rows.iloc[idx]
+        found = sub["campaign_id"].notna().to_numpy()
+        entity = _log_change(_value(sub, "t", metric), _value(sub, "b", metric))
+        sibling = _log_change(_value(sub, "st", metric), _value(sub, "sb", metric))
+        parts = np.column_stack([
+            exp * _log_change(_value(sub, "t", d), _value(sub, "b", d)) for d, exp in drivers
+        ])
+        total = np.nansum(parts, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            share = parts / total[:, None]
+        t_vals = np.column_stack([_value(sub, "t", d) for d, _ in drivers])
+        b_vals = np.column_stack([_value(sub, "b", d) for d, _ in drivers])
+        order = np.argsort(-np.nan_to_num(np.abs(parts), nan=-1.0), axis=1)[:, :TOP_DRIVERS]
+
+        for j, i in enumerate(pos[idx]):
+            if not found[j]:
+                continue
+            ranked = [
+                {
+                    "driver": drivers[k][0],
+                    "baseline": round(float(b_vals[j, k]), 6),
+                    "observed": round(float(t_vals[j, k]), 6),
+                    "change_pct": _pct(drivers[k][1] * parts[j, k]),
+                    "share": None if not np.isfinite(share[j, k]) else round(float(share[j, k]), 3),
+                }
+                for k in order[j] if not np.isnan(parts[j, k])
+            ]
+            out[i] = {
+                "baseline_days": int(sub["baseline_days"].iat[j]),
+                "metric_change_pct": _pct(entity[j]),
+                "drivers": ranked,
+                "siblings": {
+                    "ad_groups": int(sub["siblings"].iat[j]),
+                    "change_pct": _pct(sibling[j]),
+                    "campaign_wide": bool(np.isfinite(sibling[j]) and np.isfinite(entity[j])
+                                          and np.sign(sibling[j]) == np.sign(entity[j])
+                                          and abs(sibling[j]) >= 0.5 * abs(entity[j])),
+                },
+            }
+    return out
+
+def drivers_for(db: Session, anomalies: list[dict]) -> list[dict | None]:
+    """Decompose stored anomalies (dicts with entity_id, metric, window_end),
+    loading the window of their campaigns once per distinct day."""
+    out: list = [None] * len(anomalies)
+    by_day = defaultdict(list)
+    for i, a in enumerate(anomalies):
+        by_day[a["window_end"]].append(i)
+    for day, idx in sorted(by_day.items()):
+        scope = entities.siblings(db, {anomalies[i]["entity_id"] for i in idx})
+        if not scope:
+            continue
+        history, today = load_window(db, day, scope)
+        if today.empty:
+            continue
+        with stage("drivers"):
+            agg = day_aggregates(history, today)
+            frame = pd.DataFrame([anomalies[i] for i in idx], columns=["entity_id", "metric"])
+            for i, d in zip(idx, decompose(frame, agg)):
+                out[i] = d
+    return out
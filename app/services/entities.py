@@ -0,0 +1,224 @@
+"""Integer surrogate keys for customers, campaigns and ad groups.
+
+metrics_daily stores entities.id (customer_key, campaign_key, ad_group_key)
+instead of the id strings. The API keeps speaking string ids and translates
+through here, both ways, via an in-process cache. A key and its external id
+never change, so cached pairs never go stale. The one catch is rollback: a key
+inserted by a transaction that rolls back can be handed out again. Keys
+written in a session are therefore kept in the session until it commits, and
+only then enter the shared cache.
+"""
+from __future__ import annotations
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session, aliased
+from app.db.models import Entity
+from app.utils.telemetry import count
+
+# (entity type, id column, parent id column, key column), top of the hierarchy first
+LEVELS = [
+    ("customer", "customer_id", None, "customer_key"),
+    ("campaign", "campaign_id", "customer_id", "campaign_key"),
+    ("ad_group", "ad_group_id", "campaign_id", "ad_group_key"),
+]
+KEY_COLUMNS = [key for *_, key in LEVELS]
+_CHUNK = 500
+_PENDING = "entity_keys"
+
+_lock = threading.Lock()
+_by_external: dict = {t: {} for t, *_ in LEVELS}   # type -> {external id: (key, parent key, name)}
+_by_key: dict = {}                                  # key -> external id
+
+def _pending(db: Session) -> dict:
+    """Keys this session wrote, in the same shape as the shared cache."""
+    return db.info.setdefault(_PENDING, {"external": {}, "key": {}})
+
+def _remember(cache_external: dict, cache_key: dict, entity_type: str, row):
+    key, external_id, parent_id, name = row
+    cache_external.setdefault(entity_type, {})[external_id] = (key, parent_id, name)
+    cache_key[key] = external_id
+
+@event.listens_for(Session, "after_commit")
+def _promote(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        with _lock:
+            for entity_type, rows in pending["external"].items():
+                for external_id, (key, parent_id, name) in rows.items():
+                    _remember(_by_external, _by_key, entity_type, (key, external_id, parent_id, name))
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(_PENDING, None)
+
+def _fetch(db: Session, entity_type: str, external_ids: list[str], share: bool = True) -> dict:
+    """{external id: (key, parent key, name)} read from the table. With `share`,
+    rows this session has not written (so are committed) also go into the shared cache."""
+    pending = _pending(db)["external"].get(entity_type, {}) if share else None
+    found = {}
+    for i in range(0, len(external_ids), _CHUNK):
+        found.update((r.external_id, (r.id, r.parent_id, r.name)) for r in db.execute(
+            select(Entity.id, Entity.external_id, Entity.parent_id, Entity.name)
+            .where(Entity.entity_type == entity_type)
+            .where(Entity.external_id.in_(external_ids[i:i + _CHUNK]))))
+    if pending is None:
+        return found
+    with _lock:
+        for external_id, (key, parent_id, name) in found.items():
+            if external_id not in pending:
+                _remember(_by_external, _by_key, entity_type, (key, external_id, parent_id, name))
+    return found
+
+def _insert_ignore(db: Session):
+    # a concurrent ingest may register the same entity first; keep its row
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(Entity).on_conflict_do_nothing(index_elements=["entity_type", "external_id"])
+
+def _register(db: Session, entity_type: str, entities: list[tuple]) -> dict:
+    """{external id: key} for (external id, parent key, name) tuples, inserting
+    unknown entities and updating moved or renamed ones (name None = keep)."""
+    pending = _pending(db)
+    mine = pending["external"].get(entity_type, {})
+    out, todo = {}, []
+    with _lock:
+        known = _by_external[entity_type]
+        for external_id, parent_id, name in entities:
+            hit = mine.get(external_id) or known.get(external_id)
+            if hit and hit[1] == parent_id and (name is None or hit[2] == name):
+                out[external_id] = hit[0]
+            else:
+                todo.append((external_id, parent_id, name))
+    if not todo:
+        return out
+
+    found = _fetch(db, entity_type, [t[0] for t in todo])
+    new, changed = [], []
+    for external_id, parent_id, name in todo:
+        row = found.get(external_id)
+        if row is None:
+            new.append({"entity_type": entity_type, "external_id": external_id,
+                        "parent_id": parent_id, "name": name})
+        elif row[1] != parent_id or (name is not None and row[2] != name):
+            changed.append((external_id, {"id": row[0], "parent_id": parent_id,
+                                          "name": row[2] if name is None else name}))
+        else:
+            out[external_id] = row[0]
+    if changed:
+        db.execute(update(Entity), [r for _, r in changed])
+        for external_id, r in changed:
+            _remember(pending["external"], pending["key"], entity_type,
+                      (r["id"], external_id, r["parent_id"], r["name"]))
+            out[external_id] = r["id"]
+    if new:
+        db.execute(_insert_ignore(db), new)
+        written = _fetch(db, entity_type, [r["external_id"] for r in new], share=False)
+        for external_id, (key, parent_id, name) in written.items():
+            _remember(pending["external"], pending["key"], entity_type, (key, external_id, parent_id, name))
+            out[external_id] = key
+        count("entities_created", len(new))
+    return out
+
+def assign_keys(db: Session, df: pd.DataFrame) -> pd.DataFrame:
+    """customer_key, campaign_key and ad_group_key for each row of `df` (string
+    customer_id/campaign_id/ad_group_id, optionally customer_name/campaign_name/
+    ad_group_name). Registers unseen entities; the last row of an entity decides
+    its parent and name. The caller commits."""
+    keys, parents, strings = {}, None, {}
+    for entity_type, col, parent_col, key_col in LEVELS:
+        ids = strings.setdefault(col, df[col].astype(str).to_numpy(dtype=object))
+        codes, uniques = pd.factorize(ids)
+        # row of each entity's last occurrence, in code order
+        _, rev = np.unique(codes[::-1], return_index=True)
+        last = len(codes) - 1 - rev
+        parent_ids = [None] * len(uniques)
+        if parent_col:
+            parent_ext = strings.setdefault(parent_col, df[parent_col].astype(str).to_numpy(dtype=object))
+            parent_ids = [parents[p] for p in parent_ext[last]]
+        names = [None] * len(uniques)
+        if f"{entity_type}_name" in df:
+            names = [None if pd.isna(n) else str(n) for n in df[f"{entity_type}_name"].to_numpy()[last]]
+        mapping = _register(db, entity_type, list(zip(uniques.tolist(), parent_ids, names)))
+        keys[key_col] = np.asarray([mapping[e] for e in uniques.tolist()], dtype=np.int64)[codes]
+        parents = mapping
+    return pd.DataFrame(keys, index=df.index)
+
+def keys_of(db: Session, entity_type: str, external_ids) -> dict:
+    """{external id: key} of the known entities among `external_ids`."""
+    mine = _pending(db)["external"].get(entity_type, {})
+    out, missing = {}, []
+    with _lock:
+        known = _by_external[entity_type]
+        for external_id in {str(e) for e in external_ids}:
+            hit = mine.get(external_id) or known.get(external_id)
+            if hit:
+                out[external_id] = hit[0]
+            else:
+                missing.append(external_id)
+    if missing:
+        out.update((e, row[0]) for e, row in _fetch(db, entity_type, sorted(missing)).items())
+    return out
+
+def key_of(db: Session, entity_type: str, external_id: str) -> int | None:
+    return keys_of(db, entity_type, [external_id]).get(str(external_id))
+
+def external_ids(db: Session, keys) -> dict:
+    """{key: external id} for `keys` (of any entity type)."""
+    pending = _pending(db)
+    out, missing = {}, []
+    with _lock:
+        for key in {int(k) for k in keys}:
+            external_id = pending["key"].get(key) or _by_key.get(key)
+            if external_id is None:
+                missing.append(key)
+            else:
+                out[key] = external_id
+    if missing:
+        rows = []
+        for i in range(0, len(missing), _CHUNK):
+            rows.extend(db.execute(
+                select(Entity.id, Entity.external_id, Entity.parent_id, Entity.name, Entity.entity_type)
+                .where(Entity.id.in_(missing[i:i + _CHUNK]))).all())
+        with _lock:
+            for key, external_id, parent_id, name, entity_type in rows:
+                out[key] = external_id
+                if key not in pending["key"]:
+                    _remember(_by_external, _by_key, entity_type, (key, external_id, parent_id, name))
+    return out
+
+def lineage(db: Session, ad_group_ids) -> dict:
+    """{ad_group_id: (customer_key, campaign_key, ad_group_key)} of the known ad groups."""
+    campaign = aliased(Entity)
+    ids, out = sorted({str(a) for a in ad_group_ids}), {}
+    for i in range(0, len(ids), _CHUNK):
+        out.update((r[0], tuple(r[1:])) for r in db.execute(
+            select(Entity.external_id, campaign.parent_id, Entity.parent_id, Entity.id)
+            .join(campaign, campaign.id == Entity.parent_id)
+            .where(Entity.entity_type == "ad_group")
+            .where(Entity.external_id.in_(ids[i:i + _CHUNK]))))
+    return out
+
+def siblings(db: Session, ad_group_ids) -> list[str]:
+    """External ids of every ad group in the campaigns of `ad_group_ids` (them included)."""
+    campaign = aliased(Entity)
+    ids, out = sorted({str(a) for a in ad_group_ids}), set()
+    for i in range(0, len(ids), _CHUNK):
+        parents = (select(campaign.parent_id).where(campaign.entity_type == "ad_group")
+                   .where(campaign.external_id.in_(ids[i:i + _CHUNK])))
+        out.update(db.scalars(select(Entity.external_id).where(Entity.entity_type == "ad_group")
+                              .where(Entity.parent_id.in_(parents))))
+    return sorted(out)
+
+def categorical(db: Session, keys: np.ndarray) -> pd.Categorical:
+    """The external ids of integer `keys` as a categorical with sorted categories."""
+    codes, uniques = pd.factorize(keys)
+    names = external_ids(db, uniques.tolist())
+    labels = np.array([names[k] for k in uniques.tolist()], dtype=object)
+    order = np.argsort(labels, kind="stable")
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return pd.Categorical.from_codes(rank[codes], categories=labels[order])
@@ -0,0 +1,131 @@
+"""Anomaly episodes: runs of consecutive days on which the same entity, metric
+and direction was anomalous, stored as one interval with its peak.
+
+Episodes are kept up to date incrementally. Whenever the anomalies of a day
+are rewritten, only the episodes touching that day (for the affected entities)
+are dropped and re-merged from the stored rows around them. Plain Python, so
+the module also works without the data stack.
+"""
+from __future__ import annotations
+from datetime import date, timedelta
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+from app.db.models import Anomaly, AnomalyEpisode
+
+_CHUNK = 500
+_ONE = timedelta(days=1)
+
+def merge_runs(rows) -> list[dict]:
+    """Merge anomaly records (dicts with entity_type, entity_id, metric, direction,
+    day and zscore) into episodes of consecutive days."""
+    out, cur = [], {}
+    for r in sorted(rows, key=lambda r: (r["entity_id"], r["metric"], r["direction"], r["day"])):
+        key = (r["entity_id"], r["metric"], r["direction"])
+        ep = cur.get(key)
+        if ep is not None and r["day"] <= ep["end_date"] + _ONE:
+            if r["day"] > ep["end_date"]:
+                ep["end_date"] = r["day"]
+                ep["days"] += 1
+            if abs(r["zscore"]) > abs(ep["peak_z"]):
+                ep["peak_z"], ep["peak_date"] = r["zscore"], r["day"]
+            continue
+        ep = cur[key] = {
+            "entity_type": r["entity_type"], "entity_id": r["entity_id"], "metric": r["metric"],
+            "direction": r["direction"], "start_date": r["day"], "end_date": r["day"], "days": 1,
+            "peak_z": r["zscore"], "peak_date": r["day"],
+        }
+        out.append(ep)
+    return out
+
+def _anomaly_rows(db: Session, start: date, end: date, entity_ids=None) -> list[dict]:
+    q = (
+        select(Anomaly.entity_type, Anomaly.entity_id, Anomaly.metric, Anomaly.direction,
+               Anomaly.window_end.label("day"), Anomaly.zscore)
+        .where(Anomaly.window_end >= start)
+        .where(Anomaly.window_end <= end)
+    )
+    if entity_ids is None:
+        return [r._asdict() for r in db.execute(q)]
+    ids, rows = sorted(entity_ids), []
+    for i in range(0, len(ids), _CHUNK):
+        rows.extend(r._asdict() for r in db.execute(q.where(Anomaly.entity_id.in_(ids[i:i + _CHUNK]))))
+    return rows
+
+def refresh(db: Session, day: date, entity_ids=None) -> int:
+    """Re-merge the episodes around `day` after its anomalies (for `entity_ids`,
+    or all entities) were rewritten. The caller commits. Returns episodes written."""
+    q = (
+        select(AnomalyEpisode)
+        .where(AnomalyEpisode.end_date >= day - _ONE)
+        .where(AnomalyEpisode.start_date <= day + _ONE)
+    )
+    if entity_ids is None:
+        touching = list(db.execute(q).scalars())
+    else:
+        ids, touching = sorted(entity_ids), []
+        for i in range(0, len(ids), _CHUNK):
+            touching.extend(db.execute(q.where(AnomalyEpisode.entity_id.in_(ids[i:i + _CHUNK]))).scalars())
+
+    # per key, the span the old episodes covered plus the day itself
+    spans = {}
+    for ep in touching:
+        key = (ep.entity_id, ep.metric, ep.direction)
+        lo, hi = spans.get(key, (day, day))
+        spans[key] = (min(lo, ep.start_date), max(hi, ep.end_date))
+    lo = min([day] + [s for s, _ in spans.values()])
+    hi = max([day] + [e for _, e in spans.values()])
+    rows = _anomaly_rows(db, lo, hi, entity_ids)
+    # rows of the span of an episode that does not touch `day` belong to that episode
+    keep = []
+    for r in rows:
+        span = spans.get((r["entity_id"], r["metric"], r["direction"]))
+        if r["day"] == day or (span and span[0] <= r["day"] <= span[1]):
+            keep.append(r)
+
+    for ep in touching:
+        db.delete(ep)
+    db.flush()
+    merged = merge_runs(keep)
+    db.add_all(AnomalyEpisode(**e) for e in merged)
+    db.flush()
+    return len(merged)
+
+def rebuild(db: Session, entity_ids=None) -> int:
+    """Drop and re-merge every episode (of `entity_ids`, or all). The caller commits."""
+    if entity_ids is None:
+        db.execute(delete(AnomalyEpisode))
+    else:
+        ids = sorted(entity_ids)
+        for i in range(0, len(ids), _CHUNK):
+            db.execute(delete(AnomalyEpisode).where(AnomalyEpisode.entity_id.in_(ids[i:i + _CHUNK])))
+    merged = merge_runs(_anomaly_rows(db, date.min, date.max, entity_ids))
+    db.add_all(AnomalyEpisode(**e) for e in merged)
+    db.flush()
+    return len(merged)
+
+def backfill_if_empty(db: Session) -> int:
+    """Build episodes once for a database that has anomalies but no episodes yet."""
+    if db.execute(select(AnomalyEpisode.id).limit(1)).first() is not None:
+        return 0
+    if db.execute(select(Anomaly.id).limit(1)).first() is None:
+        return 0
+    n = rebuild(db)
+    db.commit()
+    return n
+
+def overlapping(db: Session, start: date, end: date, entity_id: str | None = None,
+                metric: str | None = None, min_peak_z: float = 0.0) -> list[AnomalyEpisode]:
+    """Episodes intersecting [start, end], longest-ongoing first."""
+    q = (
+        select(AnomalyEpisode)
+        .where(AnomalyEpisode.end_date >= start)
+        .where(AnomalyEpisode.start_date <= end)
+        .where(func.abs(AnomalyEpisode.peak_z) >= min_peak_z)
+    )
+    if entity_id:
+        q = q.where(AnomalyEpisode.entity_id == entity_id)
+    if metric:
+        q = q.where(AnomalyEpisode.metric == metric)
+    return list(db.execute(
+        q.order_by(AnomalyEpisode.end_date.desc(), AnomalyEpisode.start_date, AnomalyEpisode.id)
+    ).scalars())
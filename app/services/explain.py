@@ -33,12 +33,52 @@ PLAYBOOKS = {
     ],
 }
 
-def explain_anomaly(anomaly: dict) -> dict:
+def explain_anomaly(anomaly: dict, drivers: dict | None = None) -> dict:
+    """Playbook explanation; with `drivers` (from services.drivers) the summary
+    also says which components moved and whether sibling ad groups moved too."""
     metric = anomaly.get("metric")
     direction = anomaly.get("direction")
-    tips = PLAYBOOKS.get((metric, direction), [])[:3]
+    # change-point findings ("cost_shift") share the playbook of their metric
+    tips = PLAYBOOKS.get((metric.removesuffix("_shift"), direction), [])[:3]
     summary = f"{metric.upper()} moved {direction} (z={anomaly.get('zscore')}). Observed {anomaly.get('observed')} vs expected {anomaly.get('expected')}."
-    return {
+    out = {
         "summary": summary,
         "actions": tips
     }
+    if drivers:
+        out["summary"] = f"{summary} {_driver_sentence(drivers)}".rstrip()
+        out["drivers"] = drivers["drivers"]
+        out["siblings"] = drivers["siblings"]
+    return out
+
+def explain_many(anomalies: list[dict], drivers: list[dict | None] | None = None) -> list[dict]:
+    """explain_anomaly for each anomaly. With OPENAI_API_KEY set, the LLM writes
+    the analysis and actions, shared by anomalies with the same normalized
+    features (see services.llm). Anomalies the LLM did not answer keep the
+    playbook actions."""
+    drivers = drivers or [None] * len(anomalies)
+    out = [explain_anomaly(a, d) for a, d in zip(anomalies, drivers)]
+    from app.services import llm
+    if not llm.enabled() or not anomalies:
+        return out
+    keys = [llm.features(a, d) for a, d in zip(anomalies, drivers)]
+    answers = llm.explain_features(keys)
+    for o, k in zip(out, keys):
+        answer = answers.get(k)
+        o["source"] = "llm" if answer else "playbook"
+        if answer:
+            o["analysis"] = answer["analysis"]
+            o["actions"] = answer["actions"] or o["actions"]
+    return out
+
+def _fmt_pct(p) -> str:
+    return "n/a" if p is None else f"{p:+.1f}%"
+
+def _driver_sentence(d: dict) -> str:
+    parts = [f"{x['driver'].upper()} {_fmt_pct(x['change_pct'])}" for x in d["drivers"][:2]]
+    text = f"Mainly driven by {' and '.join(parts)} vs the {d['baseline_days']}-day average." if parts else ""
+    sib = d["siblings"]
+    if sib["ad_groups"]:
+        where = "campaign-wide" if sib["campaign_wide"] else "specific to this ad group"
+        text += f" Sibling ad groups moved {_fmt_pct(sib['change_pct'])}, so the change looks {where}."
+    return text.strip()
@@ -5,10 +5,19 @@ import numpy as np
 
 def fetch_daily_metrics(target_date: date) -> pd.DataFrame:
     """Fetch Google Ads daily metrics for all (customer, campaign, ad_group) combos.
-    If MOCK_GADS=1, returns a deterministic synthetic dataset.
+    If MOCK_GADS=1, returns a deterministic synthetic dataset (sized by MOCK_GADS_SHAPE if set).
     Real implementation stub is provided at bottom.
     """
     if os.getenv("MOCK_GADS", "1") != "0":
+        # MOCK_GADS_SHAPE="customers,campaigns,ad_groups" swaps the four demo ad groups
+        # for a scalable synthetic dataset (see app/services/synthetic.py)
+        shape = os.getenv("MOCK_GADS_SHAPE")
+        if shape:
+            from app.services.synthetic import generate_day
+            customers, campaigns, ad_groups = (int(x) for x in shape.split(","))
+            return generate_day(target_date, customers, campaigns, ad_groups,
+                                seed=int(os.getenv("MOCK_GADS_SEED", "42")))
+
         # Use same entities as add_sample_metrics.py for consistency
         entities = [
             {"customer_id": "1234567890", "campaign_id": "campaign_12345", "ad_group_id": "adgroup_11111"},
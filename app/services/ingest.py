@@ -0,0 +1,101 @@
+from __future__ import annotations
+import pandas as pd
+import numpy as np
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import Session
+from app.db.models import MetricsDaily
+from app.services import entities, versions
+
+KEY_COLUMNS = ["customer_id", "campaign_id", "ad_group_id"]
+NAME_COLUMNS = ["customer_name", "campaign_name", "ad_group_name"]
+METRIC_COLUMNS = ["clicks", "impressions", "cost", "conversions", "conv_value"]
+
+# SQLite caps bound parameters per statement; keep IN lists well below it
+_CHUNK = 500
+
+def normalize_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """Coerce an incoming frame to the metrics_daily column types.
+    Duplicate (date, entity) rows keep the last occurrence. Optional
+    customer_name/campaign_name/ad_group_name columns are kept for entities."""
+    out = pd.DataFrame({
+        "date": df["date"].values,
+        **{c: df[c].astype(str).values for c in KEY_COLUMNS},
+        "clicks": df["clicks"].astype("int64").values,
+        "impressions": df["impressions"].astype("int64").values,
+        "cost": df["cost"].astype("float64").values,
+        "conversions": df["conversions"].astype("float64").values,
+        "conv_value": df["conv_value"].astype("float64").values,
+        **{c: df[c].values for c in NAME_COLUMNS if c in df},
+    })
+    return out.drop_duplicates(subset=["date", *KEY_COLUMNS], keep="last").reset_index(drop=True)
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Stable 64-bit content hash of the metric columns, as signed ints so SQLite can store them."""
+    h = pd.util.hash_pandas_object(df[METRIC_COLUMNS], index=False).to_numpy()
+    return h.view(np.int64)
+
+def upsert_metrics(db: Session, df: pd.DataFrame) -> dict:
+    """Write a normalized metrics frame, touching only rows whose content changed.
+
+    Per date present in `df`: new entities are inserted, entities whose hash
+    differs are updated in place, and entities no longer reported are deleted.
+    Returns row counts plus `changed`: {date: set(ad_group_id)} of the entities
+    that need downstream recomputation. The data version of every changed date
+    is bumped. Rows are stored under entity surrogate keys; unseen entities are
+    registered. The caller commits.
+    """
+    df = df.copy()
+    df["row_hash"] = row_hashes(df)
+    df[entities.KEY_COLUMNS] = entities.assign_keys(db, df)
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    changed = {}
+
+    for day, day_df in df.groupby("date", sort=True):
+        existing = pd.DataFrame(
+            db.execute(
+                select(MetricsDaily.id, MetricsDaily.customer_key, MetricsDaily.campaign_key,
+                       MetricsDaily.ad_group_key, MetricsDaily.row_hash)
+                .where(MetricsDaily.date == day)
+            ).all(),
+            columns=["id", *entities.KEY_COLUMNS, "old_hash"],
+        ).astype({"id": "Int64", "old_hash": "Int64"})
+        # nullable ints survive the outer merge without a lossy float round-trip
+        day_df = day_df.astype({"clicks": "Int64", "impressions": "Int64", "row_hash": "Int64"})
+        merged = day_df.merge(existing, on=entities.KEY_COLUMNS, how="outer", indicator=True)
+
+        new = merged[merged["_merge"] == "left_only"]
+        both = merged[merged["_merge"] == "both"]
+        # legacy rows written before hashing have no hash and are rewritten once
+        dirty = both[(both["old_hash"] != both["row_hash"]).fillna(True)]
+        gone = merged[merged["_merge"] == "right_only"]
+
+        cols = ["date", *entities.KEY_COLUMNS, *METRIC_COLUMNS, "row_hash"]
+        if not new.empty:
+            db.execute(insert(MetricsDaily), _records(new[cols]))
+        if not dirty.empty:
+            upd = dirty[["id", *METRIC_COLUMNS, "row_hash"]].astype({"id": "int64"})
+            db.execute(update(MetricsDaily), _records(upd))
+        gone_ids = gone["id"].astype("int64").tolist()
+        for i in range(0, len(gone_ids), _CHUNK):
+            db.execute(delete(MetricsDaily).where(MetricsDaily.id.in_(gone_ids[i:i + _CHUNK])))
+
+        counts["inserted"] += len(new)
+        counts["updated"] += len(dirty)
+        counts["deleted"] += len(gone)
+        counts["unchanged"] += len(both) - len(dirty)
+
+        # vanished rows only have keys
+        gone_groups = entities.external_ids(db, gone["ad_group_key"].astype("int64").tolist()).values()
+        touched = set(new["ad_group_id"]) | set(dirty["ad_group_id"]) | set(gone_groups)
+        if touched:
+            changed[day] = touched
+
+    versions.bump(db, changed.keys())
+    return {**counts, "changed": changed}
+
+def _records(df: pd.DataFrame) -> list[dict]:
+    # to_dict keeps numpy scalars; the DB drivers want plain Python values
+    return [
+        {k: (v.item() if isinstance(v, np.generic) else v) for k, v in r.items()}
+        for r in df.to_dict(orient="records")
+    ]
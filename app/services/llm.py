@@ -0,0 +1,174 @@
+"""Optional LLM-written explanations (any OpenAI-compatible chat completions API).
+
+Enabled when OPENAI_API_KEY is set. Anomalies are reduced to normalized features
+(metric, direction, z bucket, leading drivers, campaign-wide or not), so many
+anomalies share one cached answer. The features still missing from the cache are
+sent in batches of LLM_BATCH_SIZE per prompt, at most LLM_MAX_CONCURRENCY
+prompts at a time, over one pooled HTTP client. Calls that time out or return
+something unusable are left out of the result, and the caller uses the
+playbook for those anomalies.
+
+Point OPENAI_BASE_URL at mock_llm_server.py to run without a real provider.
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.telemetry import stage, count
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "15"))
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+
+SYSTEM_PROMPT = (
+    "You are a senior Google Ads analyst. For each case you get a metric anomaly of one "
+    "ad group: the metric, its direction, how severe it is, which components drove it and "
+    "whether sibling ad groups in the campaign moved the same way. Reply with a JSON object "
+    '{"results": [{"case": <case number>, "analysis": "<one or two sentences on the likely '
+    'cause>", "actions": ["<up to three concrete checks or fixes>"]}]} covering every case. '
+    "Do not invent numbers."
+)
+
+_Z_BUCKETS = ((6.0, "6+"), (4.0, "4-6"), (3.0, "3-4"), (0.0, "<3"))
+
+def enabled() -> bool:
+    return bool(OPENAI_API_KEY)
+
+def features(anomaly: dict, drivers: dict | None) -> tuple:
+    """Normalized, hashable description of an anomaly; the cache key."""
+    z = abs(float(anomaly.get("zscore") or 0.0))
+    bucket = next(label for lo, label in _Z_BUCKETS if z >= lo)
+    leading, scope = (), "unknown"
+    if drivers:
+        leading = tuple(
+            f"{d['driver']} {'up' if (d['change_pct'] or 0) > 0 else 'down'}"
+            for d in drivers["drivers"][:2]
+            if d["share"] is not None and abs(d["share"]) >= 0.2
+        )
+        if drivers["siblings"]["ad_groups"]:
+            scope = "campaign-wide" if drivers["siblings"]["campaign_wide"] else "this ad group only"
+    return (anomaly.get("metric"), anomaly.get("direction"), bucket, leading, scope)
+
+class TTLCache:
+    """LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+cache = TTLCache(LLM_CACHE_SIZE, LLM_CACHE_TTL)
+
+_client = None
+_pool = None
+_init_lock = threading.Lock()
+
+def _resources():
+    """Shared HTTP client and worker pool, created on first use."""
+    global _client, _pool
+    with _init_lock:
+        if _client is None:
+            import httpx
+            _client = httpx.Client(
+                base_url=OPENAI_BASE_URL,
+                headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+                timeout=LLM_TIMEOUT,
+                limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                                    max_keepalive_connections=LLM_MAX_CONCURRENCY),
+            )
+            _pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+    return _client, _pool
+
+def _describe(key: tuple) -> dict:
+    metric, direction, bucket, leading, scope = key
+    return {"metric": metric, "direction": direction, "severity_z": bucket,
+            "drivers": list(leading) or ["not decomposed"], "scope": scope}
+
+def _complete(keys: list[tuple]) -> dict:
+    """One chat completion for a batch of feature keys; {key: {analysis, actions}}."""
+    client, _ = _resources()
+    cases = [{"case": i, **_describe(k)} for i, k in enumerate(keys)]
+    resp = client.post("/chat/completions", json={
+        "model": LLM_MODEL,
+        "temperature": 0.2,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": json.dumps({"cases": cases})},
+        ],
+    })
+    resp.raise_for_status()
+    content = resp.json()["choices"][0]["message"]["content"]
+    out = {}
+    for r in json.loads(content).get("results", []):
+        i = r.get("case")
+        if isinstance(i, int) and 0 <= i < len(keys) and r.get("analysis"):
+            out[keys[i]] = {"analysis": str(r["analysis"]),
+                            "actions": [str(a) for a in (r.get("actions") or [])][:3]}
+    return out
+
+def explain_features(keys: list[tuple]) -> dict:
+    """Answers for the given feature keys from the cache or the LLM. Keys that
+    could not be answered before LLM_TIMEOUT are missing from the result."""
+    found, todo = {}, []
+    for k in dict.fromkeys(keys):
+        hit = cache.get(k)
+        if hit is not None:
+            found[k] = hit
+        else:
+            todo.append(k)
+    count("llm_cache_hits", len(found))
+    if not todo:
+        return found
+
+    _, pool = _resources()
+    batches = [todo[i:i + LLM_BATCH_SIZE] for i in range(0, len(todo), LLM_BATCH_SIZE)]
+    count("llm_calls", len(batches))
+    deadline = time.monotonic() + LLM_TIMEOUT
+    with stage("llm"):
+        futures = [pool.submit(_complete, b) for b in batches]
+        for fut in futures:
+            try:
+                answers = fut.result(timeout=max(deadline - time.monotonic(), 0.0))
+            except Exception as e:  # timeout, HTTP or parse error -> playbook fallback
+                print(f"LLM explanation batch failed: {e!r}")
+                fut.cancel()
+                continue
+            for k, v in answers.items():
+                cache.set(k, v)
+            found.update(answers)
+    return found
@@ -0,0 +1,253 @@
+from __future__ import annotations
+import os
+from datetime import date, timedelta
+import pandas as pd
+import numpy as np
+from sqlalchemy import String, select, delete, func, type_coerce
+from sqlalchemy.orm import Session
+from app.db.models import MetricsDaily, Anomaly
+from app.services.detect import BASELINES, detect_anomalies
+from app.services import entities, episodes
+from app.utils.telemetry import stage, count
+
+# enough history for the longest detection baseline
+HISTORY_DAYS = max(window for _, window in BASELINES.values())
+POST_INGEST_MIN_Z = float(os.getenv("POST_INGEST_MIN_Z", "2.0"))
+# days of a range detected per history load; larger blocks load fewer overlapping rows but hold more
+RANGE_BLOCK_DAYS = int(os.getenv("RANGE_BLOCK_DAYS", "28"))
+
+_COLUMNS = ["date", "customer_id", "campaign_id", "ad_group_id",
+            "clicks", "impressions", "cost", "conversions", "conv_value"]
+# what is read from metrics_daily: the surrogate keys stand in for the id columns
+_FETCHED = ["date", *entities.KEY_COLUMNS, *_COLUMNS[4:]]
+# in-memory dtypes of load_metrics frames; money stays float64 so stored
+# observed/expected values are unchanged, counts fit int32
+_KEY_COLUMNS = ["customer_id", "campaign_id", "ad_group_id"]
+_DTYPES = {"clicks": np.int32, "impressions": np.int32,
+           "cost": np.float64, "conversions": np.float64, "conv_value": np.float64}
+_CHUNK = 500
+# stored anomaly columns a re-detection may change; (window_end, entity_id, metric) identifies the row
+_VALUES = ["entity_type", "direction", "zscore", "observed", "expected", "spans", "window_start",
+           *entities.KEY_COLUMNS]
+# rows converted to compact columns at a time, bounding the Python objects alive during a load
+_FETCH_ROWS = 100_000
+EPOCH = date(1970, 1, 1)
+
+def day_number(d: date) -> int:
+    """Days since 1970-01-01, the representation of `date` in load_metrics frames."""
+    return (d - EPOCH).days
+
+def from_day_number(n) -> date:
+    return EPOCH + timedelta(days=int(n))
+
+def load_metrics(db: Session, start: date, end: date, ad_group_ids=None) -> pd.DataFrame:
+    """Rows with start <= date <= end, optionally restricted to some ad groups.
+
+    The frame is compact: `date` is an int32 day number (see day_number), the
+    entity ids are categoricals (decoded from the surrogate keys), and counts
+    are int32.
+    """
+    # dates come back as stored, skipping per-row date objects; _to_df parses them in bulk
+    q = (
+        select(type_coerce(MetricsDaily.date, String).label("date"),
+               *(getattr(MetricsDaily, c) for c in _FETCHED[1:]))
+        .where(MetricsDaily.date >= start)
+        .where(MetricsDaily.date <= end)
+        .execution_options(yield_per=_FETCH_ROWS)  # stream instead of buffering every row
+    )
+    # Core rows (no ORM row processing) on the session's connection
+    conn = db.connection()
+    with stage("sql_fetch"):
+        if ad_group_ids is None:
+            results = [conn.execute(q)]
+        else:
+            ids = sorted(entities.keys_of(db, "ad_group", ad_group_ids).values())
+            results = (conn.execute(q.where(MetricsDaily.ad_group_key.in_(ids[i:i + _CHUNK])))
+                       for i in range(0, len(ids), _CHUNK))
+        parts = [_compact(rows) for result in results for rows in result.partitions(_FETCH_ROWS)]
+    count("rows_loaded", sum(len(p["date"]) for p in parts))
+    with stage("to_df"):
+        return _to_df(db, parts)
+
+def load_window(db: Session, day: date, ad_group_ids=None):
+    """(history_df, today_df) for detecting `day`: the HISTORY_DAYS before it, and the day itself."""
+    df = load_metrics(db, day - timedelta(days=HISTORY_DAYS), day, ad_group_ids)
+    if df.empty:
+        return df, df
+    is_today = (df["date"] == day_number(day)).to_numpy()
+    return df[~is_today].reset_index(drop=True), df[is_today].reset_index(drop=True)
+
+def iter_windows(db: Session, start: date, end: date, ad_group_ids=None):
+    """Yield (day, history_df, today_df) for each day from start to end, like
+    load_window per day. Consecutive days share most of their history, so the
+    rows are loaded RANGE_BLOCK_DAYS days at a time (plus one history window)
+    and each day's window is sliced out of the block."""
+    block_start = start
+    while block_start <= end:
+        block_end = min(end, block_start + timedelta(days=RANGE_BLOCK_DAYS - 1))
+        df = load_metrics(db, block_start - timedelta(days=HISTORY_DAYS), block_end, ad_group_ids)
+        if not df.empty:
+            df = df.sort_values("date", kind="stable", ignore_index=True)
+        dates = df["date"].to_numpy() if not df.empty else np.empty(0, dtype=np.int32)
+        day = block_start
+        while day <= block_end:
+            n = day_number(day)
+            lo, mid, hi = np.searchsorted(dates, [n - HISTORY_DAYS, n, n + 1])
+            if lo == hi:
+                yield day, pd.DataFrame(), pd.DataFrame()  # as load_window returns for no rows
+            else:
+                yield day, df.iloc[lo:mid].reset_index(drop=True), df.iloc[mid:hi].reset_index(drop=True)
+            day += timedelta(days=1)
+        del df, dates
+        block_start = block_end + timedelta(days=1)
+
+def persist_anomalies(db: Session, day: date, det: pd.DataFrame, entity_ids=None):
+    """Make the stored anomalies of `day` (only those of `entity_ids`, if given) match `det`.
+
+    Rows are matched on (entity_id, metric): unchanged ones are left alone and
+    changed ones are updated in place, so ids handed out earlier stay valid.
+    Returns (row ids aligned with the rows of `det`, whether anything was written).
+    """
+    with stage("persist"):
+        return _persist(db, day, det, entity_ids)
+
+def _persist(db: Session, day: date, det: pd.DataFrame, entity_ids):
+    # change-point findings ("<metric>_shift") are maintained by services.cusum
+    q = (select(Anomaly.id, Anomaly.entity_id, Anomaly.metric, *(getattr(Anomaly, c) for c in _VALUES))
+         .where(Anomaly.window_end == day)
+         .where(~Anomaly.metric.endswith("_shift", autoescape=True)))
+    if entity_ids is not None:
+        ids = sorted(entity_ids)
+        stored = [r for i in range(0, len(ids), _CHUNK)
+                  for r in db.execute(q.where(Anomaly.entity_id.in_(ids[i:i + _CHUNK])))]
+    else:
+        stored = db.execute(q).all()
+    old, stale = {}, []
+    for r in stored:
+        if (r.entity_id, r.metric) in old:
+            stale.append(r.id)
+        else:
+            old[(r.entity_id, r.metric)] = r
+
+    rows = with_keys(db, [{
+        "entity_type": r.entity_type,
+        "entity_id": r.entity_id,
+        "metric": r.metric,
+        "direction": r.direction,
+        "zscore": float(r.zscore),
+        "observed": float(r.observed),
+        "expected": float(r.expected),
+        "spans": r.spans,
+        "window_start": r.window_start,
+        "window_end": day,
+    } for r in det.itertuples(index=False)])
+    ids, todo = {}, []
+    for row in rows:
+        prev = old.pop((row["entity_id"], row["metric"]), None)
+        if prev is not None:
+            ids[(row["entity_id"], row["metric"])] = prev.id
+        if prev is None or any(getattr(prev, c) != row[c] for c in _VALUES):
+            todo.append(row)
+    stale.extend(r.id for r in old.values())
+
+    # another writer of the same day (a concurrent /anomalies or ingest) may have
+    # inserted or deleted rows since the read above; the upsert and the delete by
+    # id both tolerate that instead of expecting exact row counts
+    for i in range(0, len(stale), _CHUNK):
+        db.execute(delete(Anomaly).where(Anomaly.id.in_(stale[i:i + _CHUNK])))
+    if todo:
+        # one multi-row INSERT ... ON CONFLICT DO UPDATE ... RETURNING for new and changed rows
+        stmt = _insert(db)
+        stmt = stmt.on_conflict_do_update(index_elements=["window_end", "entity_id", "metric"],
+                                          set_={c: stmt.excluded[c] for c in _VALUES})
+        ids.update(((r.entity_id, r.metric), r.id) for r in
+                   db.execute(stmt.returning(Anomaly.id, Anomaly.entity_id, Anomaly.metric), todo))
+    written = bool(stale or todo)
+    count("anomalies_written", len(todo))
+    if written:
+        episodes.refresh(db, day, entity_ids)
+    return [ids[(r["entity_id"], r["metric"])] for r in rows], written
+
+def _insert(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(Anomaly)
+
+def with_keys(db: Session, rows: list[dict]) -> list[dict]:
+    """Anomaly row dicts (entity_id = ad group) with customer_key/campaign_key/ad_group_key added."""
+    keys = entities.lineage(db, {r["entity_id"] for r in rows}) if rows else {}
+    return [{**r, **dict(zip(entities.KEY_COLUMNS, keys.get(r["entity_id"], (None, None, None))))} for r in rows]
+
+def detect_day(db: Session, day: date, min_z: float = 2.0, ad_group_ids=None) -> pd.DataFrame:
+    history_df, today_df = load_window(db, day, ad_group_ids)
+    if history_df.empty or today_df.empty:
+        return pd.DataFrame()
+    return detect_anomalies(history_df, today_df, min_z=min_z)
+
+def recompute_changed(db: Session, changed: dict) -> int:
+    """Re-run detection for the entities an ingest actually changed, per date,
+    refresh their stored anomalies, the dates' peer sketches and their
+    change-point state. Returns the number of anomalies written.
+
+    A changed day is also history for the HISTORY_DAYS after it, so stored
+    days in that span are re-detected for the same entities."""
+    from app.services.cusum import update_changed
+    from app.services import sketches
+
+    sketches.refresh(db, changed)
+    written = 0
+    for day, ad_group_ids in sorted(_with_following(db, changed).items()):
+        det = detect_day(db, day, min_z=POST_INGEST_MIN_Z, ad_group_ids=ad_group_ids)
+        persist_anomalies(db, day, det, entity_ids=ad_group_ids)
+        written += len(det)
+    return written + update_changed(db, changed)
+
+def _with_following(db: Session, changed: dict) -> dict:
+    """`changed` ({date: set(ad_group_id)}) plus, for each changed date, the stored
+    dates within HISTORY_DAYS after it, mapped to the same ad groups."""
+    if not changed:
+        return changed
+    first, last = min(changed), max(changed) + timedelta(days=HISTORY_DAYS)
+    stored = db.scalars(select(MetricsDaily.date).distinct()
+                        .where(MetricsDaily.date > first).where(MetricsDaily.date <= last)).all()
+    out = {day: set(ids) for day, ids in changed.items()}
+    for later in stored:
+        for day, ids in changed.items():
+            if day < later <= day + timedelta(days=HISTORY_DAYS):
+                out.setdefault(later, set()).update(ids)
+    return out
+
+def warm_up(db: Session) -> dict:
+    """Run one detection pass (not persisted) over the latest ingested date, so the
+    data stack is imported and the DB pages are cached before real traffic."""
+    latest = db.execute(select(func.max(MetricsDaily.date))).scalar()
+    if latest is None:
+        return {"date": None, "anomalies": 0}
+    return {"date": str(latest), "anomalies": len(detect_day(db, latest))}
+
+def _compact(rows) -> dict:
+    """Columns of one fetched chunk in their compact dtypes."""
+    cols = dict(zip(_FETCHED, zip(*rows)))
+    # few distinct dates per chunk: parse each once
+    codes, uniques = pd.factorize(np.asarray(cols["date"], dtype=object))
+    days = pd.to_datetime(uniques).to_numpy().astype("datetime64[D]").astype(np.int32)
+    out = {"date": days[codes]}
+    for c in entities.KEY_COLUMNS:
+        out[c] = np.asarray(cols[c], dtype=np.int64)
+    for c, dtype in _DTYPES.items():
+        out[c] = np.asarray(cols[c], dtype=dtype)
+    return out
+
+def _to_df(db: Session, parts: list[dict]) -> pd.DataFrame:
+    parts = [p for p in parts if len(p["date"])]
+    if not parts:
+        return pd.DataFrame()
+    data = {"date": np.concatenate([p["date"] for p in parts])}
+    for key, c in zip(entities.KEY_COLUMNS, _KEY_COLUMNS):
+        # one sorted category set per id column, so frames sliced from this one merge and group on codes
+        data[c] = entities.categorical(db, np.concatenate([p[key] for p in parts]))
+    for c in _DTYPES:
+        data[c] = np.concatenate([p[c] for p in parts])
+    return pd.DataFrame(data, columns=_COLUMNS)
@@ -0,0 +1,230 @@
+"""Portfolio percentiles: per-day quantile sketches of each metric over all ad groups.
+
+A LogSketch counts values in logarithmic buckets (gamma^(i-1), gamma^i] with
+gamma = (1 + alpha) / (1 - alpha), so every quantile it returns is within a
+relative error of alpha. Merging two sketches adds their bucket counts.
+The sketches are stored per day, metric and campaign, and the sketch of a
+customer or of the whole portfolio is merged from those rows without reading
+metrics_daily again. Sketches hold at most SKETCH_MAX_BINS buckets. When there
+are more, the lowest buckets are folded together, so memory per day and metric
+stays bounded whatever the number of entities.
+
+Thin ad groups are sketched too: every ad group whose metric is defined that
+day (rates need a non-zero denominator) counts as a peer.
+"""
+from __future__ import annotations
+import math
+import os
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, insert, delete
+from sqlalchemy.orm import Session
+from app.db.models import MetricsDaily, MetricSketch
+from app.services.drivers import RATES
+from app.services.pipeline import load_metrics, from_day_number
+from app.utils.telemetry import stage, count
+
+SKETCH_ALPHA = float(os.getenv("SKETCH_ALPHA", "0.01"))
+SKETCH_MAX_BINS = int(os.getenv("SKETCH_MAX_BINS", "1024"))
+SKETCH_METRICS = ["cost", "clicks", "conversions", "ctr", "cpc", "cvr", "roas"]
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+_CHUNK = 500
+_ZERO = np.iinfo(np.int64).min  # bucket key of values <= 0 while building
+
+class LogSketch:
+    """Mergeable quantile sketch with relative accuracy `alpha`. Values <= 0 are
+    counted as zeros; the metrics sketched here are never negative."""
+
+    def __init__(self, alpha: float = SKETCH_ALPHA, keys=(), counts=(), zeros: int = 0):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.zeros = int(zeros)
+        self._compact()
+
+    @property
+    def n(self) -> int:
+        return self.zeros + int(self.counts.sum())
+
+    def bucket(self, values: np.ndarray) -> np.ndarray:
+        """Bucket index of each positive value."""
+        return np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+
+    def add(self, values) -> "LogSketch":
+        v = np.asarray(values, dtype=float)
+        v = v[~np.isnan(v)]
+        pos = v > 0
+        self.zeros += int((~pos).sum())
+        keys = self.bucket(v[pos])
+        self.keys = np.concatenate([self.keys, keys])
+        self.counts = np.concatenate([self.counts, np.ones(len(keys), dtype=np.int64)])
+        self._compact()
+        return self
+
+    def merge(self, other: "LogSketch") -> "LogSketch":
+        if other.alpha != self.alpha:
+            raise ValueError(f"cannot merge sketches with alpha {self.alpha} and {other.alpha}")
+        self.zeros += other.zeros
+        self.keys = np.concatenate([self.keys, other.keys])
+        self.counts = np.concatenate([self.counts, other.counts])
+        self._compact()
+        return self
+
+    @classmethod
+    def merged(cls, sketches, alpha: float = SKETCH_ALPHA) -> "LogSketch":
+        """One sketch of the union of `sketches`, combined in a single pass."""
+        sketches = list(sketches)
+        if any(s.alpha != alpha for s in sketches):
+            raise ValueError(f"all sketches must have alpha {alpha}")
+        if not sketches:
+            return cls(alpha)
+        return cls(alpha,
+                   np.concatenate([s.keys for s in sketches]),
+                   np.concatenate([s.counts for s in sketches]),
+                   sum(s.zeros for s in sketches))
+
+    def _compact(self):
+        if len(self.keys):
+            keys, inverse = np.unique(self.keys, return_inverse=True)
+            counts = np.bincount(inverse, weights=self.counts).astype(np.int64)
+            cut = len(keys) - SKETCH_MAX_BINS
+            if cut > 0:
+                counts[cut] += counts[:cut].sum()
+                keys, counts = keys[cut:], counts[cut:]
+            self.keys, self.counts = keys, counts
+
+    def quantile(self, q: float) -> float | None:
+        """Value at quantile q (0..1), within relative error alpha; None when empty."""
+        n = self.n
+        if n == 0:
+            return None
+        rank = q * (n - 1)
+        if rank < self.zeros:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), rank - self.zeros, side="right"))
+        i = min(i, len(self.keys) - 1)
+        return 2 * self.gamma ** float(self.keys[i]) / (self.gamma + 1)
+
+    def rank(self, values) -> np.ndarray:
+        """Fraction of the sketched values below each value, counting half of the
+        values that share its bucket (a mid-rank, so ties land in the middle).
+        NaN for NaN inputs or an empty sketch."""
+        v = np.asarray(values, dtype=float)
+        n = self.n
+        out = np.full(v.shape, np.nan)
+        if n == 0:
+            return out
+        zero = v <= 0
+        out[zero] = 0.5 * self.zeros / n
+        pos = v > 0
+        if pos.any():
+            k = self.bucket(v[pos])
+            before = np.concatenate(([0], np.cumsum(self.counts)))
+            lo = np.searchsorted(self.keys, k, side="left")
+            hi = np.searchsorted(self.keys, k, side="right")
+            out[pos] = (self.zeros + before[lo] + 0.5 * (before[hi] - before[lo])) / n
+        return out
+
+    def to_bytes(self) -> bytes:
+        return np.column_stack([self.keys, self.counts]).astype("<i8").tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes, zeros: int, alpha: float) -> "LogSketch":
+        pairs = np.frombuffer(blob, dtype="<i8").reshape(-1, 2)
+        return cls(alpha, pairs[:, 0], pairs[:, 1], zeros)
+
+def metric_values(df: pd.DataFrame, metric: str) -> np.ndarray:
+    """Per-row value of `metric`; NaN where a rate's denominator is zero."""
+    if metric in RATES:
+        num, den = RATES[metric]
+        n = df[num].to_numpy(dtype=float)
+        d = df[den].to_numpy(dtype=float)
+        return np.divide(n, d, out=np.full(len(df), np.nan), where=d != 0)
+    return df[metric].to_numpy(dtype=float)
+
+def build(df: pd.DataFrame, alpha: float = SKETCH_ALPHA) -> list[dict]:
+    """MetricSketch rows (one per date, metric and campaign) for a load_metrics frame."""
+    if df.empty:
+        return []
+    probe = LogSketch(alpha)
+    parts = []
+    for metric in SKETCH_METRICS:
+        v = metric_values(df, metric)
+        ok = ~np.isnan(v)
+        keys = np.full(int(ok.sum()), _ZERO)
+        pos = v[ok] > 0
+        keys[pos] = probe.bucket(v[ok][pos])
+        parts.append(df.loc[ok, ["date", "campaign_id", "customer_id"]].assign(metric=metric, key=keys))
+    counts = (pd.concat(parts, ignore_index=True)
+              .groupby(["date", "metric", "campaign_id", "customer_id", "key"], observed=True)
+              .size().reset_index(name="count"))
+
+    # rows are sorted by group, so each sketch is one contiguous slice
+    group = counts.groupby(["date", "metric", "campaign_id", "customer_id"], sort=False, observed=True).ngroup().to_numpy()
+    bounds = np.flatnonzero(np.diff(group)) + 1
+    keys, cnt = counts["key"].to_numpy(), counts["count"].to_numpy()
+    first = counts.iloc[np.concatenate(([0], bounds))]
+    rows = []
+    for (day, metric, campaign, customer), k, c in zip(
+        first[["date", "metric", "campaign_id", "customer_id"]].itertuples(index=False),
+        np.split(keys, bounds), np.split(cnt, bounds),
+    ):
+        zero = k == _ZERO
+        sketch = LogSketch(alpha, k[~zero], c[~zero], c[zero].sum())
+        rows.append({"date": from_day_number(day), "metric": metric, "campaign_id": campaign, "customer_id": customer,
+                     "alpha": alpha, "n": sketch.n, "zeros": sketch.zeros, "bins": sketch.to_bytes()})
+    return rows
+
+def refresh(db: Session, days) -> int:
+    """Rebuild the stored sketches of each of `days` from metrics_daily.
+    Returns the number of sketch rows written. The caller commits."""
+    written = 0
+    with stage("sketches"):
+        for day in sorted(set(days)):
+            db.execute(delete(MetricSketch).where(MetricSketch.date == day))
+            rows = build(load_metrics(db, day, day))
+            if rows:
+                db.execute(insert(MetricSketch), rows)
+            written += len(rows)
+    count("sketches_written", written)
+    return written
+
+def ensure_day(db: Session, day: date) -> bool:
+    """Build the sketches of `day` if it has metrics but no sketches at the current
+    SKETCH_ALPHA (days ingested before sketching existed, or after changing it).
+    Returns True if they were built and committed."""
+    if db.execute(select(MetricSketch.date).where(MetricSketch.date == day)
+                  .where(MetricSketch.alpha == SKETCH_ALPHA).limit(1)).first() is not None:
+        return False
+    if db.execute(select(MetricsDaily.id).where(MetricsDaily.date == day).limit(1)).first() is None:
+        return False
+    refresh(db, [day])
+    db.commit()
+    return True
+
+def peer_sketches(db: Session, day: date, metric: str, by: str = "portfolio", keys=None) -> dict:
+    """Merged sketches of `metric` on `day`: {None: sketch} for the portfolio, or
+    {customer_id: sketch} / {campaign_id: sketch} for `by` = "customer" / "campaign",
+    optionally only for the given customer or campaign ids."""
+    q = (select(MetricSketch.customer_id, MetricSketch.campaign_id, MetricSketch.alpha,
+                MetricSketch.zeros, MetricSketch.bins)
+         .where(MetricSketch.date == day).where(MetricSketch.metric == metric))
+    col = {"customer": MetricSketch.customer_id, "campaign": MetricSketch.campaign_id}.get(by)
+    if col is not None and keys is not None:
+        ids = sorted(set(keys))
+        rows = []
+        for i in range(0, len(ids), _CHUNK):
+            rows.extend(db.execute(q.where(col.in_(ids[i:i + _CHUNK]))).all())
+    else:
+        rows = db.execute(q).all()
+
+    groups: dict = {}
+    for customer, campaign, alpha, zeros, blob in rows:
+        key = {"customer": customer, "campaign": campaign}.get(by)
+        groups.setdefault(key, []).append(LogSketch.from_bytes(blob, zeros, alpha))
+    count("sketches_merged", len(rows))
+    return {key: LogSketch.merged(parts, parts[0].alpha) for key, parts in groups.items()}
@@ -0,0 +1,105 @@
+"""Threshold sweeps: how many anomalies each min_z / impression floor would flag.
+
+Z-scores are computed once per day. Each entity/metric keeps the |z| of its
+strongest baseline, which is the value detect_anomalies compares with min_z.
+The |z| values are sorted once per (impression floor, metric, direction)
+group, and the count at every threshold is a binary search into that sorted
+index. With ground-truth labels (from generate_synthetic_data.py --labels),
+the same index gives precision and recall per threshold.
+"""
+from __future__ import annotations
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from app.services.detect import BASELINES, compute_zscores
+from app.services.pipeline import iter_windows
+from app.utils.telemetry import stage, count
+
+THRESHOLDS = [1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 5.0, 6.0]
+IMPRESSION_FLOORS = [0, 100, 200, 500, 1000]
+
+def candidates(db: Session, start: date, end: date) -> pd.DataFrame:
+    """One row per scored entity/metric/day: date, ad_group_id, metric,
+    impressions, direction and abs_z (the strongest baseline's |z|)."""
+    names = [f"z_{b}" for b in BASELINES]
+    parts = []
+    for day, history_df, today_df in iter_windows(db, start, end):
+        scores = compute_zscores(history_df, today_df)
+        if not scores.empty:
+            z = scores[names].to_numpy()
+            scored = ~np.isnan(z).all(axis=1)
+            z, scores = z[scored], scores[scored]
+            best = np.nanargmax(np.abs(z), axis=1)
+            zbest = z[np.arange(len(z)), best]
+            parts.append(pd.DataFrame({
+                "date": day,
+                "ad_group_id": scores["ad_group_id"].to_numpy(),
+                "metric": scores["metric"].to_numpy(),
+                "impressions": scores["impressions"].to_numpy(),
+                "direction": np.where(zbest > 0, "up", "down"),
+                "abs_z": np.abs(zbest),
+            }))
+    out = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=["date", "ad_group_id", "metric", "impressions", "direction", "abs_z"])
+    count("sweep_candidates", len(out))
+    return out
+
+def _at_least(abs_z: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """Number of values >= each threshold, from one sort."""
+    ordered = np.sort(abs_z)
+    return len(ordered) - np.searchsorted(ordered, thresholds, side="left")
+
+def _ratio(num: int, den: int):
+    return round(num / den, 4) if den else None
+
+def _f1(p, r):
+    # undefined only when precision or recall is; no true positives scores 0
+    if p is None or r is None:
+        return None
+    return round(2 * p * r / (p + r), 4) if p + r else 0.0
+
+def sweep(cand: pd.DataFrame, thresholds=THRESHOLDS, floors=IMPRESSION_FLOORS, labels: pd.DataFrame | None = None) -> dict:
+    """{"counts": [...]} per floor, threshold, metric and direction, plus
+    {"scores": [...]} with precision/recall per floor, threshold and metric
+    ("all" for every metric) when `labels` (date, ad_group_id, metric and
+    optionally direction) are given."""
+    with stage("sweep"):
+        return _sweep(cand, np.asarray(sorted(thresholds), dtype=float), sorted(floors), labels)
+
+def _sweep(cand: pd.DataFrame, thresholds: np.ndarray, floors, labels) -> dict:
+    out = {"counts": []}
+    for floor in floors:
+        sub = cand[cand["impressions"] >= floor]
+        for (metric, direction), g in sub.groupby(["metric", "direction"]):
+            for t, n in zip(thresholds, _at_least(g["abs_z"].to_numpy(), thresholds)):
+                out["counts"].append({"min_impressions": floor, "min_z": float(t), "metric": metric,
+                                      "direction": direction, "anomalies": int(n)})
+    if labels is None:
+        return out
+
+    keys = ["date", "ad_group_id", "metric"]
+    if "direction" in labels and labels["direction"].notna().all():
+        keys.append("direction")
+    labels = labels[keys].drop_duplicates()
+    hit = cand.merge(labels.assign(labelled=True), on=keys, how="left")["labelled"].fillna(False).to_numpy(dtype=bool)
+    cand = cand.assign(labelled=hit)
+    out["labels"] = len(labels)
+    out["scores"] = []
+    metrics = sorted(cand["metric"].unique())
+    for floor in floors:
+        sub = cand[cand["impressions"] >= floor]
+        for metric in ["all", *metrics]:
+            g = sub if metric == "all" else sub[sub["metric"] == metric]
+            total = len(labels) if metric == "all" else int((labels["metric"] == metric).sum())
+            detected = _at_least(g["abs_z"].to_numpy(), thresholds)
+            tp = _at_least(g.loc[g["labelled"], "abs_z"].to_numpy(), thresholds)
+            for t, d, k in zip(thresholds, detected, tp):
+                p, r = _ratio(int(k), int(d)), _ratio(int(k), total)
+                out["scores"].append({
+                    "min_impressions": floor, "min_z": float(t), "metric": metric,
+                    "detected": int(d), "true_positives": int(k), "labels": total,
+                    "precision": p, "recall": r,
+                    "f1": _f1(p, r),
+                })
+    return out
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from app.services.detect import add_derived_metrics
+
+# summed per period; rates are re-derived from the sums so they stay correct after aggregation
+BASE_METRICS = ["clicks", "impressions", "cost", "conversions", "conv_value"]
+DERIVED_METRICS = ["ctr", "cpc", "cvr", "roas"]
+FREQS = {"day": "D", "week": "W-MON", "month": "MS"}
+
+def aggregate(df: pd.DataFrame, freq: str = "day") -> pd.DataFrame:
+    """Sum the selected rows per period (all matching entities combined) and add rates.
+    Weeks/months without any rows stay NaN rather than reading as zero."""
+    s = df.assign(date=pd.to_datetime(df["date"])).groupby("date")[BASE_METRICS].sum()
+    if freq == "week":
+        s = s.resample(FREQS[freq], label="left", closed="left").sum(min_count=1)
+    elif freq != "day":
+        s = s.resample(FREQS[freq]).sum(min_count=1)
+    return add_derived_metrics(s.reset_index())
+
+def expectation_band(series: pd.Series, window: int = 28, span: int = 14, k: float = 2.0) -> pd.DataFrame:
+    """Per point, the EWMA expectation and +/- k sigma band from the `window` points
+    before it -- ewma_expected's estimate, computed for every point at once. Missing
+    points are skipped, as in detection."""
+    values = series.to_numpy(dtype=float)
+    # row i holds the `window` points before point i (NaN before the first one)
+    lagged = np.lib.stride_tricks.sliding_window_view(
+        np.concatenate([np.full(window, np.nan), values]), window)[:len(values)]
+    alpha = 2.0 / (span + 1.0)
+    level = np.full(len(values), np.nan)
+    n = np.zeros(len(values))
+    total = np.zeros(len(values))
+    total_sq = np.zeros(len(values))
+    for t in range(window):
+        v = lagged[:, t]
+        use = ~np.isnan(v)
+        level = np.where(use, np.where(np.isnan(level), v, level + alpha * (v - level)), level)
+        resid = np.where(use, v - level, 0.0)
+        n += use
+        total += resid
+        total_sq += resid * resid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(np.maximum(total_sq - total * total / n, 0.0) / (n - 1))
+    std = np.where(n > 1, std, np.where(n == 1, 0.0, np.nan))
+    return pd.DataFrame({"expected": level, "lower": level - k * std, "upper": level + k * std})
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points preserving the visual shape."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
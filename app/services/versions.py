@@ -0,0 +1,43 @@
+from __future__ import annotations
+import hashlib
+from datetime import date
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+from app.db.models import DataVersion, Anomaly
+
+def bump(db: Session, dates) -> None:
+    """Increment the data version of each date. The caller commits."""
+    dates = sorted(set(dates))
+    if not dates:
+        return
+    known = set(db.execute(select(DataVersion.date).where(DataVersion.date.in_(dates))).scalars())
+    if known:
+        db.execute(
+            update(DataVersion)
+            .where(DataVersion.date.in_(known))
+            .values(version=DataVersion.version + 1)
+        )
+    db.add_all(DataVersion(date=d, version=1) for d in dates if d not in known)
+
+def etag(db: Session, start: date, end: date, *params, anomalies_of: date | None = None) -> str:
+    """Strong ETag for a response computed from the data of start..end plus `params`.
+
+    With `anomalies_of`, the stored anomaly ids of that date are folded in too,
+    so a response that hands out ids changes whenever those rows are rewritten.
+    """
+    versions = db.execute(
+        select(DataVersion.date, DataVersion.version)
+        .where(DataVersion.date >= start)
+        .where(DataVersion.date <= end)
+        .order_by(DataVersion.date)
+    ).all()
+    h = hashlib.sha1()
+    for d, v in versions:
+        h.update(f"{d}:{v};".encode())
+    if anomalies_of is not None:
+        watermark = db.execute(
+            select(func.count(Anomaly.id), func.max(Anomaly.id)).where(Anomaly.window_end == anomalies_of)
+        ).one()
+        h.update(f"anomalies:{watermark[0]}:{watermark[1]};".encode())
+    h.update(repr(params).encode())
+    return f'"{h.hexdigest()[:20]}"'
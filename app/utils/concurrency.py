@@ -0,0 +1,100 @@
+"""Request coalescing and admission control for CPU-heavy endpoints.
+
+Sync endpoints run on FastAPI's threadpool, so both primitives are thread-based.
+"""
+from __future__ import annotations
+import threading
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from fastapi import HTTPException
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one execution.
+
+    The first caller (the leader) runs the function; callers arriving while it
+    runs wait and receive the same result or exception. Results are not cached
+    beyond the in-flight call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+
+    def do(self, key, fn):
+        """Returns (result, shared); shared is True for callers that waited on a leader."""
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+        if not leader:
+            return fut.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class Admission:
+    """At most `limit` concurrent holders; up to `max_queue` callers wait up to
+    `timeout` seconds for a slot, anyone beyond that gets 429."""
+
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float):
+        self.name, self.limit, self.max_queue, self.timeout = name, limit, max_queue, timeout
+        self._sem = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    def reserve(self) -> "Ticket":
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise self._busy()
+            self._waiting += 1
+        try:
+            acquired = self._sem.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise self._busy()
+        return Ticket(self._sem)
+
+    @contextmanager
+    def slot(self):
+        ticket = self.reserve()
+        try:
+            yield
+        finally:
+            ticket.release()
+
+    def _busy(self) -> HTTPException:
+        return HTTPException(status_code=429, detail=f"{self.name} is at capacity, retry shortly",
+                             headers={"Retry-After": "1"})
+
+class Ticket:
+    """A held admission slot. release() is idempotent."""
+
+    def __init__(self, sem: threading.BoundedSemaphore):
+        self._sem = sem
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._sem.release()
+
+    def bind(self, obj):
+        """Also release when `obj` is garbage-collected, e.g. a response generator
+        that is dropped before it ever runs because the client went away."""
+        weakref.finalize(obj, self.release)
+        return obj
@@ -0,0 +1,61 @@
+"""In-process wake-ups for streaming endpoints.
+
+Writers (sync endpoints on the threadpool) call `publish()` after committing;
+each subscriber is an asyncio.Event on the server's loop that gets set. The
+event carries no payload: subscribers re-read the database from their own
+cursor, so a missed or coalesced wake-up never loses rows.
+"""
+from __future__ import annotations
+import asyncio
+import threading
+
+class Broadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: set = set()
+
+    def subscribe(self) -> "Subscription":
+        sub = Subscription(self, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def publish(self):
+        """Wake every subscriber. Safe to call from any thread."""
+        with self._lock:
+            subs = list(self._subscribers)
+        for sub in subs:
+            sub._wake()
+
+    def _remove(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+class Subscription:
+    def __init__(self, broadcaster: Broadcaster, loop: asyncio.AbstractEventLoop):
+        self._broadcaster = broadcaster
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:  # loop already closed
+            pass
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self, timeout: float) -> bool:
+        """True if woken by publish(), False on timeout."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        self._broadcaster._remove(self)
+
+# woken after new Anomaly rows are committed
+anomaly_events = Broadcaster()
@@ -0,0 +1,90 @@
+"""Conditional GET, binary tabular formats and compression for API responses."""
+from __future__ import annotations
+import gzip
+import io
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.utils.telemetry import stage
+
+# bodies below this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """A 304 response if the client's If-None-Match already covers `etag`."""
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return None
+    tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def tabular_response(request: Request, payload: dict, table_key: str, fmt: str, etag: str | None = None) -> Response:
+    """Render `payload` as JSON, or its `table_key` records as Arrow IPC / Parquet,
+    compressing large bodies with br or gzip when the client accepts them."""
+    with stage("serialize"):
+        return _render(request, payload, table_key, fmt, etag)
+
+def _render(request: Request, payload: dict, table_key: str, fmt: str, etag: str | None) -> Response:
+    if fmt == "json":
+        body = JSONResponse(jsonable_encoder(payload)).body
+        media_type = "application/json"
+    else:
+        body = _binary(payload[table_key], fmt)
+        media_type = MEDIA_TYPES[fmt]
+
+    headers = {"Vary": "Accept-Encoding"}
+    if etag:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+    encoding = _pick_encoding(request.headers.get("accept-encoding", "")) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding == "br":
+        import brotli
+        body = brotli.compress(body, quality=5)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def _binary(records: list[dict], fmt: str) -> bytes:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"format={fmt} needs pyarrow installed on the server")
+    import pandas as pd
+    table = pa.Table.from_pandas(pd.DataFrame.from_records(records), preserve_index=False)
+    buf = io.BytesIO()
+    if fmt == "arrow":
+        with pa.ipc.new_stream(buf, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, buf)
+    return buf.getvalue()
+
+def _pick_encoding(accept_encoding: str) -> str | None:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip())
+    if "br" in accepted and _has_brotli():
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def _has_brotli() -> bool:
+    try:
+        import brotli  # noqa: F401
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,147 @@
+"""On-demand profiling of single requests.
+
+Send `X-Profile: 1` (or `?profile=1`) together with `X-Admin-Token: $ADMIN_TOKEN`.
+The endpoint then runs under cProfile while a sampler thread records its
+stacks. The capture is written to PROFILE_DIR as <id>.prof (pstats),
+<id>.folded (collapsed stacks for flamegraph.pl/speedscope) and <id>.json (top
+functions). The response carries X-Profile-Id and X-Profile-Summary headers.
+When no profile is requested, endpoints pay one ContextVar lookup.
+"""
+from __future__ import annotations
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from fastapi import Header, HTTPException
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.001"))
+TOP_N = 15
+
+_capture = ContextVar("gaar_profile_capture", default=None)
+# cProfile allows one active profiler per process
+_busy = threading.Lock()
+
+def is_admin(token: str | None) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    """Dependency guarding admin-only endpoints."""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+def wants_profile(request) -> bool:
+    return request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1"
+
+def begin_capture():
+    """Mark the current request for profiling; returns (token, capture dict)."""
+    capture = {}
+    return _capture.set(capture), capture
+
+def end_capture(token):
+    _capture.reset(token)
+
+def active() -> bool:
+    """Whether the current request is being profiled. A streamed body runs after
+    the endpoint returns, outside the profiler, so endpoints build it up front then."""
+    return _capture.get() is not None
+
+def profiled(fn):
+    """Run a (sync) endpoint under the profiler when its request asked for it."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        capture = _capture.get()
+        if capture is None:
+            return fn(*args, **kwargs)
+        if not _busy.acquire(blocking=False):
+            capture["busy"] = True
+            return fn(*args, **kwargs)
+        try:
+            return _run(capture, fn, args, kwargs)
+        finally:
+            _busy.release()
+    return wrapper
+
+def _run(capture: dict, fn, args, kwargs):
+    sampler = _StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    sampler.start()
+    t0 = time.perf_counter()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - t0
+        sampler.stop()
+        capture.update(_save(profiler, sampler.stacks, fn.__name__, elapsed))
+
+def _save(profiler: cProfile.Profile, stacks: Counter, endpoint: str, elapsed: float) -> dict:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    base = os.path.join(PROFILE_DIR, profile_id)
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".folded", "w") as f:
+        for stack, n in stacks.most_common():
+            f.write(f"{stack} {n}\n")
+
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)
+    top = [
+        {"function": f"{os.path.basename(file)}:{line}({name})", "ncalls": nc,
+         "tottime": round(tt, 6), "cumtime": round(ct, 6)}
+        for (file, line, name), (cc, nc, tt, ct, _) in rows[:TOP_N]
+    ]
+    summary = {"id": profile_id, "endpoint": endpoint, "elapsed": round(elapsed, 6),
+               "samples": sum(stacks.values()), "top": top}
+    with open(base + ".json", "w") as f:
+        json.dump(summary, f, indent=2)
+    return {"id": profile_id, "summary": summary}
+
+def header_summary(summary: dict, n: int = 5) -> str:
+    """Compact 'function=cumtime' list for a response header."""
+    return "; ".join(f"{t['function']}={t['cumtime']:.4f}s" for t in summary["top"][:n])
+
+def load_summary(profile_id: str) -> dict | None:
+    path = os.path.join(PROFILE_DIR, os.path.basename(profile_id) + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def list_profiles() -> list[str]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((f[:-5] for f in os.listdir(PROFILE_DIR) if f.endswith(".json")), reverse=True)
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
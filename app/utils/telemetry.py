@@ -0,0 +1,100 @@
+"""In-process request instrumentation, rendered in the Prometheus text format.
+
+Code under a request wraps its phases in `stage("name")` and reports sizes with
+`count("kind", n)`. Totals are kept per request (a context variable survives the
+hop into FastAPI's threadpool) and observed into histograms when the request
+finishes, labelled with its route. Stages nest, so a stage includes the time of
+any stages inside it.
+"""
+from __future__ import annotations
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, s in sorted(series.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for le, c in zip(self.buckets, s):
+                cumulative += c
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {s[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {s[-2]}")
+            lines.append(f"{self.name}_count{{{base}}} {s[-1]}")
+        return lines
+
+REQUEST_SECONDS = Histogram("gaar_request_seconds", "End-to-end request latency.",
+                            ("route", "method", "status"), TIME_BUCKETS)
+STAGE_SECONDS = Histogram("gaar_stage_seconds", "Time spent per request in each pipeline stage.",
+                          ("route", "stage"), TIME_BUCKETS)
+ITEMS = Histogram("gaar_items", "Rows, entities and anomalies handled per request.",
+                  ("route", "kind"), COUNT_BUCKETS)
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, ITEMS]
+
+_current = ContextVar("gaar_request_stats", default=None)
+
+def begin_request():
+    """Start collecting stage totals for the current request; returns a token for end_request."""
+    return _current.set({"stages": {}, "counts": {}})
+
+def end_request(token, route: str, method: str, status: int, elapsed: float):
+    stats = _current.get()
+    _current.reset(token)
+    REQUEST_SECONDS.observe(elapsed, route, method, str(status))
+    for name, seconds in stats["stages"].items():
+        STAGE_SECONDS.observe(seconds, route, name)
+    for kind, n in stats["counts"].items():
+        ITEMS.observe(n, route, kind)
+
+@contextmanager
+def stage(name: str):
+    stats = _current.get()
+    if stats is None:  # not inside a request (scripts, warm-up)
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = stats["stages"]
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - t0
+
+def count(kind: str, n: int):
+    stats = _current.get()
+    if stats is not None:
+        stats["counts"][kind] = stats["counts"].get(kind, 0) + n
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,90 @@
+"""
+Memory footprint of a detection history window, compact vs. the old layout.
+
+Loads synthetic data into a temporary SQLite database, then reports for one
+detection window:
+- the deep size of the frame load_window returns (int32 day numbers,
+  categorical keys, int32 counts);
+- the deep size of the same rows in the old layout (date objects, string keys,
+  64-bit counts);
+- peak traced memory of the load and of detect_anomalies on each layout.
+
+    python benchmarks/history_memory.py [--ad-groups 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def traced(fn):
+    tracemalloc.start()
+    try:
+        t0 = time.perf_counter()
+        out = fn()
+        return out, time.perf_counter() - t0, tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def legacy(df):
+    """The frame as _to_df used to build it: Python date objects, string keys, int64 counts."""
+    from app.services.pipeline import from_day_number
+    days = {n: from_day_number(n) for n in df["date"].unique()}
+    return df.assign(
+        date=df["date"].map(days).astype(object),
+        **{c: df[c].astype(str) for c in ("customer_id", "campaign_id", "ad_group_id")},
+        clicks=df["clicks"].astype("int64"), impressions=df["impressions"].astype("int64"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ad-groups", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'memory.db')}"
+        from datetime import date
+        from app.db.session import engine, SessionLocal
+        from app.db.migrate import ensure_schema
+        from app.services import synthetic
+        from app.services.detect import detect_anomalies
+        from app.services.pipeline import HISTORY_DAYS, load_window
+
+        customers = max(1, args.ad_groups // 1000)
+        end = date(2025, 6, 30)
+        df, _ = synthetic.generate(customers, 20, max(1, args.ad_groups // (customers * 20)),
+                                   HISTORY_DAYS + 1, end_date=end, seed=args.seed)
+        ensure_schema(engine)
+        synthetic.write_db(engine, df)
+        del df
+
+        db = SessionLocal()
+        (history, today), load_s, load_peak = traced(lambda: load_window(db, end))
+        db.close()
+        old_history, old_today = legacy(history), legacy(today)
+
+        rows = len(history)
+        compact_mb = history.memory_usage(deep=True).sum() / 1e6
+        old_mb = old_history.memory_usage(deep=True).sum() / 1e6
+        _, det_s, det_peak = traced(lambda: detect_anomalies(history, today))
+        _, old_det_s, old_det_peak = traced(lambda: detect_anomalies(old_history, old_today))
+
+    print(f"history window: {rows:,} rows ({HISTORY_DAYS} days)")
+    print(f"{'':<28} {'old layout':>12} {'compact':>12}")
+    print(f"{'frame size (MB)':<28} {old_mb:>12.1f} {compact_mb:>12.1f}")
+    print(f"{'bytes per row':<28} {old_mb * 1e6 / rows:>12.0f} {compact_mb * 1e6 / rows:>12.0f}")
+    print(f"{'detect peak (MB)':<28} {old_det_peak:>12.1f} {det_peak:>12.1f}")
+    print(f"{'detect seconds (traced)':<28} {old_det_s:>12.2f} {det_s:>12.2f}")
+    print(f"load_window: peak {load_peak:.1f} MB, {load_s:.2f}s (traced)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Cost and latency of LLM explanations as the number of anomalies grows.
+
+Starts mock_llm_server.py in-process, then explains N synthetic anomalies twice
+(cold cache, then warm) and reports completions made and time per anomaly.
+Batching and the feature cache should keep both flat as N grows.
+
+    python benchmarks/llm_explain.py [--sizes 10 100 1000] [--latency 0.3]
+"""
+import argparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(port: int, latency: float):
+    import uvicorn
+    import mock_llm_server
+    mock_llm_server.LATENCY = latency
+    server = uvicorn.Server(uvicorn.Config(mock_llm_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return mock_llm_server.stats
+
+
+def fake_anomalies(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    metrics = {"cost": ["impressions", "ctr", "cpc"], "ctr": ["clicks", "impressions"], "cvr": ["conversions", "clicks"]}
+    anomalies, drivers = [], []
+    for _ in range(n):
+        metric = rng.choice(list(metrics))
+        direction = rng.choice(["up", "down"])
+        z = rng.uniform(2, 8) * (1 if direction == "up" else -1)
+        ranked = rng.sample(metrics[metric], 2)
+        anomalies.append({"metric": metric, "direction": direction, "zscore": round(z, 3),
+                          "observed": 1.0, "expected": 1.0})
+        drivers.append({
+            "baseline_days": 28,
+            "drivers": [{"driver": d, "baseline": 1.0, "observed": 1.0,
+                         "change_pct": rng.uniform(-50, 50), "share": rng.uniform(0.1, 0.9)} for d in ranked],
+            "siblings": {"ad_groups": 5, "change_pct": 1.0, "campaign_wide": rng.random() < 0.3},
+        })
+    return anomalies, drivers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock completion latency in seconds")
+    args = parser.parse_args()
+
+    port = free_port()
+    stats = start_mock(port, args.latency)
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    from app.services import llm
+    from app.services.explain import explain_many
+
+    print(f"{'anomalies':>9} {'pass':>5} {'completions':>11} {'seconds':>8} {'ms/anomaly':>10} {'from llm':>8}")
+    for n in args.sizes:
+        llm.cache.clear()
+        anomalies, drivers = fake_anomalies(n)
+        for label in ("cold", "warm"):
+            before = stats["completions"]
+            t0 = time.perf_counter()
+            out = explain_many(anomalies, drivers)
+            elapsed = time.perf_counter() - t0
+            answered = sum(o.get("source") == "llm" for o in out)
+            print(f"{n:>9} {label:>5} {stats['completions'] - before:>11} {elapsed:>8.3f} "
+                  f"{elapsed / n * 1000:>10.2f} {answered:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+HTTP load test: how many concurrent dashboard users one uvicorn server sustains.
+
+Seeds a temporary SQLite database with synthetic data, starts uvicorn on it
+(`--workers` processes), then runs `--concurrency` simulated users for
+`--duration` seconds per level. Each user loops over a weighted mix of
+requests, pausing `--think` seconds between them:
+
+    anomalies   GET /anomalies for one of the last 14 days, min_z 2-3
+    range       GET /anomalies/range over the last 7 days
+    explain     POST /explain for an anomaly id seen in an earlier response
+    upload      POST /ingest/upload re-sending a recent day with fresh values
+
+For each level it reports throughput, p50/p95/p99/max latency and the error
+rate per endpoint. Any non-2xx status, including 429 from admission control,
+counts as an error. Nothing external is needed: the mock fetcher and
+synthetic data stand in for Google Ads, and explanations use the playbook.
+
+    python benchmarks/load_test.py --concurrency 1 4 16 32 --duration 20
+    python benchmarks/load_test.py --mix anomalies=6,range=1,explain=3 --workers 2 --json out.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+END_DATE = "2025-06-30"
+DEFAULT_MIX = "anomalies=5,range=1,explain=3,upload=1"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed_db(url: str, customers: int, campaigns: int, ad_groups: int, days: int, seed: int) -> list[bytes]:
+    """Load `days` of synthetic data and return CSV uploads for the last few days
+    (different noise seeds, so every upload changes rows and triggers recompute)."""
+    os.environ["DATABASE_URL"] = url
+    from datetime import date, timedelta
+    from app.db.session import engine
+    from app.db.migrate import ensure_schema
+    from app.services import synthetic
+
+    end = date.fromisoformat(END_DATE)
+    df, _ = synthetic.generate(customers, campaigns, ad_groups, days, end_date=end, seed=seed)
+    ensure_schema(engine)
+    synthetic.write_db(engine, df)
+    return [
+        synthetic.generate_day(end - timedelta(days=i % 3), customers, campaigns, ad_groups,
+                               seed=seed + 1 + i).to_csv(index=False).encode()
+        for i in range(6)
+    ]
+
+
+def start_server(port: int, url: str, workers: int, tmp: str) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": url, "MOCK_GADS": "1", "OPENAI_API_KEY": "",
+           "PROFILE_DIR": os.path.join(tmp, "profiles")}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,  # keep stderr: server errors stay visible
+    )
+    import httpx
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("uvicorn did not become healthy within 60s")
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("anomalies", "range", "explain", "upload"):
+            raise SystemExit(f"unknown endpoint in --mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Scenario:
+    """Builds the next request of a simulated user; remembers anomaly ids for /explain."""
+
+    def __init__(self, uploads: list[bytes], rng: random.Random):
+        from datetime import date, timedelta
+        end = date.fromisoformat(END_DATE)
+        self.days = [str(end - timedelta(days=i)) for i in range(14)]
+        self.end = str(end)
+        self.uploads = uploads
+        self.rng = rng
+        self.anomaly_ids: list[int] = []
+
+    def request(self, name: str) -> dict:
+        r = self.rng
+        if name == "anomalies":
+            return {"method": "GET", "url": "/anomalies",
+                    "params": {"date": r.choice(self.days), "min_z": r.choice([2.0, 2.5, 3.0])}}
+        if name == "range":
+            return {"method": "GET", "url": "/anomalies/range", "params": {"end_date": self.end, "days": 7}}
+        if name == "explain":
+            if not self.anomaly_ids:  # nothing seen yet: look at a day first, like a user would
+                return self.request("anomalies")
+            return {"method": "POST", "url": "/explain", "json": {"anomaly_id": r.choice(self.anomaly_ids)}}
+        return {"method": "POST", "url": "/ingest/upload",
+                "files": {"file": ("day.csv", r.choice(self.uploads), "text/csv")}}
+
+    def observe(self, url: str, body):
+        if url == "/anomalies" and isinstance(body, dict):
+            ids = [a["id"] for a in body.get("anomalies", []) if "id" in a]
+            self.anomaly_ids = (self.anomaly_ids + ids)[-500:]
+
+
+async def user(client, scenario: Scenario, mix: dict, think: float, stop: float, samples: dict):
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < stop:
+        name = scenario.rng.choices(names, weights)[0]
+        req = scenario.request(name)
+        label = {"/anomalies": "anomalies", "/anomalies/range": "range", "/explain": "explain",
+                 "/ingest/upload": "upload"}[req["url"]]
+        t0 = time.perf_counter()
+        try:
+            resp = await client.request(**req)
+            ok = 200 <= resp.status_code < 300
+            status = resp.status_code
+            if ok and label == "anomalies":
+                scenario.observe(req["url"], resp.json())
+        except Exception as e:  # connection errors and timeouts count as failures
+            ok, status = False, type(e).__name__
+        samples[label].append((time.perf_counter() - t0, ok, status))
+        if think:
+            await asyncio.sleep(scenario.rng.uniform(0, 2 * think))
+
+
+async def run_level(base_url: str, concurrency: int, duration: float, mix: dict, think: float,
+                    uploads: list[bytes], seed: int, timeout: float) -> tuple[dict, float]:
+    import httpx
+    samples = defaultdict(list)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        t0 = time.monotonic()
+        stop = t0 + duration
+        await asyncio.gather(*(
+            user(client, Scenario(uploads, random.Random(seed * 1000 + i)), mix, think, stop, samples)
+            for i in range(concurrency)
+        ))
+        elapsed = time.monotonic() - t0
+    return samples, elapsed
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values), math.ceil(q / 100 * len(sorted_values))) - 1)
+    return sorted_values[k]
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    out = {}
+    everything = [s for rows in samples.values() for s in rows]
+    for name, rows in sorted(samples.items()) + [("all", everything)]:
+        lat = sorted(s[0] for s in rows)
+        errors = [s for s in rows if not s[1]]
+        statuses = defaultdict(int)
+        for s in errors:
+            statuses[str(s[2])] += 1
+        out[name] = {
+            "requests": len(rows),
+            "rps": round(len(rows) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(lat, 50) * 1000, 1),
+            "p95_ms": round(percentile(lat, 95) * 1000, 1),
+            "p99_ms": round(percentile(lat, 99) * 1000, 1),
+            "max_ms": round(lat[-1] * 1000, 1) if lat else float("nan"),
+            "error_rate": round(len(errors) / len(rows), 4) if rows else 0.0,
+            "errors": dict(statuses),
+        }
+    return out
+
+
+def print_level(concurrency: int, elapsed: float, summary: dict):
+    print(f"\nconcurrency {concurrency} ({elapsed:.1f}s)")
+    print(f"{'endpoint':<10} {'requests':>8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'errors':>7}")
+    for name, s in summary.items():
+        errs = f"{s['error_rate']:.1%}"
+        print(f"{name:<10} {s['requests']:>8} {s['rps']:>7.2f} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} "
+              f"{s['p99_ms']:>8.1f} {s['max_ms']:>8.1f} {errs:>7}"
+              + (f"  {s['errors']}" if s["errors"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="Simulated users; one run per level")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights, e.g. anomalies=5,range=1")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean pause between a user's requests (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout (s)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--shape", default="1,10,20", help="customers,campaigns,ad_groups of the seeded data")
+    parser.add_argument("--days", type=int, default=90, help="Days of seeded history")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    customers, campaigns, ad_groups = (int(x) for x in args.shape.split(","))
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        t0 = time.perf_counter()
+        uploads = seed_db(url, customers, campaigns, ad_groups, args.days, args.seed)
+        print(f"Seeded {customers * campaigns * ad_groups} ad groups x {args.days} days "
+              f"in {time.perf_counter() - t0:.1f}s")
+        port = free_port()
+        server = start_server(port, url, args.workers, tmp)
+        results = []
+        try:
+            for level in args.concurrency:
+                samples, elapsed = asyncio.run(run_level(
+                    f"http://127.0.0.1:{port}", level, args.duration, mix, args.think,
+                    uploads, args.seed, args.timeout))
+                summary = summarize(samples, elapsed)
+                print_level(level, elapsed, summary)
+                results.append({"concurrency": level, "seconds": round(elapsed, 2), "endpoints": summary})
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"mix": mix, "workers": args.workers, "shape": args.shape, "days": args.days,
+                       "levels": results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
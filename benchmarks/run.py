@@ -0,0 +1,240 @@
+"""
+Benchmark suite for detection, ingest and the anomaly endpoints, with drift checks.
+
+For each size (number of ad groups), a fresh interpreter loads synthetic data
+into a temporary SQLite database and times these cases against the app
+in-process. Everything runs offline: there is no network and no LLM.
+
+    detect          detect_anomalies on one loaded day
+    anomalies       GET /anomalies for the last day
+    range_30        GET /anomalies/range over 30 days
+    range_90        GET /anomalies/range over 90 days
+    explain         POST /explain/batch for every anomaly of the last day
+    ingest_mock     POST /ingest of a new day from the mock fetcher
+    ingest_upload   POST /ingest/upload of a new day as CSV
+
+For each case it reports the median wall time and the peak traced allocation
+(tracemalloc, measured in one extra run). --save writes the results to the
+baseline file. Otherwise they are compared with the baseline, and the run
+exits non-zero if any case got slower or bigger than the tolerances allow.
+Baselines are machine-specific; save them on the machine that checks them.
+
+    python benchmarks/run.py --save                       # record baselines (1k ad groups)
+    python benchmarks/run.py                              # compare with them
+    python benchmarks/run.py --sizes 1000 10000 100000 --save   # full grid, takes hours
+    python benchmarks/run.py --sizes 10000 --cases detect anomalies explain
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CASES = ["detect", "anomalies", "range_30", "range_90", "explain", "ingest_mock", "ingest_upload"]
+END_DATE = "2025-06-30"
+CAMPAIGNS = 20
+
+
+def shape(size: int) -> tuple[int, int, int]:
+    """(customers, campaigns, ad_groups per campaign) for about `size` ad groups."""
+    customers = max(1, size // 1000)
+    return customers, CAMPAIGNS, max(1, size // (customers * CAMPAIGNS))
+
+
+# ---------------------------------------------------------------- worker side
+
+def measure(fn, repeat: int, max_seconds: float, memory: bool) -> dict:
+    """Median of up to `repeat` timed runs (fewer once a run exceeds
+    `max_seconds`), plus the peak traced allocation of one more run."""
+    import tracemalloc
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        if times[-1] > max_seconds:
+            break
+    out = {"seconds": round(statistics.median(times), 4), "runs": len(times)}
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            out["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+        finally:
+            tracemalloc.stop()
+    return out
+
+
+def worker(args):
+    from datetime import date, timedelta
+    from fastapi.testclient import TestClient
+    from app.db.session import engine, SessionLocal
+    from app.db.migrate import ensure_schema
+    from app.services import synthetic
+    from app.services.detect import detect_anomalies
+    from app.services.pipeline import HISTORY_DAYS, load_window
+    from app.main import app
+
+    customers, campaigns, ad_groups = shape(args.worker)
+    end = date.fromisoformat(END_DATE)
+    days = 90 + HISTORY_DAYS
+    t0 = time.perf_counter()
+    df, _ = synthetic.generate(customers, campaigns, ad_groups, days, end_date=end, seed=args.seed)
+    ensure_schema(engine)
+    synthetic.write_db(engine, df)
+    setup = round(time.perf_counter() - t0, 1)
+    del df
+
+    def ok(resp):
+        if resp.status_code != 200:
+            raise RuntimeError(f"{resp.request.url} -> {resp.status_code}: {resp.text[:200]}")
+        return resp
+
+    # ingest cases append new days after the loaded range, one per run
+    next_day = [end]
+
+    def new_day():
+        next_day[0] += timedelta(days=1)
+        return next_day[0]
+
+    results = {}
+    with TestClient(app) as client:
+        db = SessionLocal()
+        history, today = load_window(db, end)
+        db.close()
+        cases = {
+            "detect": lambda: detect_anomalies(history, today, min_z=2.0),
+            "anomalies": lambda: ok(client.get("/anomalies", params={"date": str(end), "min_z": 2.0})),
+            "range_30": lambda: ok(client.get("/anomalies/range", params={"end_date": str(end), "days": 30})),
+            "range_90": lambda: ok(client.get("/anomalies/range", params={"end_date": str(end), "days": 90})),
+            "explain": lambda: ok(client.post("/explain/batch", json={"date": str(end)})),
+            "ingest_mock": lambda: ok(client.post("/ingest", params={"date": str(new_day())})),
+            "ingest_upload": lambda: ok(client.post("/ingest/upload", files={"file": (
+                "day.csv", synthetic.generate_day(new_day(), customers, campaigns, ad_groups,
+                                                  seed=args.seed).to_csv(index=False), "text/csv")})),
+        }
+        # /explain/batch reads the anomalies stored by /anomalies
+        ok(client.get("/anomalies", params={"date": str(end), "min_z": 2.0}))
+        for name in args.cases:
+            results[name] = measure(cases[name], args.repeat, args.max_seconds, not args.no_memory)
+            print(f"  {args.worker}:{name} {results[name]}", file=sys.stderr)
+    rows = customers * campaigns * ad_groups
+    print(json.dumps({"size": args.worker, "ad_groups": rows, "days": days, "setup_seconds": setup,
+                      "results": results}))
+
+
+# ---------------------------------------------------------------- parent side
+
+def run_size(size: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "MOCK_GADS": "1",
+            "MOCK_GADS_SHAPE": ",".join(map(str, shape(size))),
+            "MOCK_GADS_SEED": str(args.seed),
+            "OPENAI_API_KEY": "",
+            "WARMUP": "0",
+            "PROFILE_DIR": os.path.join(tmp, "profiles"),
+        }
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", str(size), "--repeat", str(args.repeat),
+               "--max-seconds", str(args.max_seconds), "--seed", str(args.seed), "--cases", *args.cases]
+        if args.no_memory:
+            cmd.append("--no-memory")
+        out = subprocess.run(cmd, cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True, check=True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(current: dict, baseline: dict, args) -> list[str]:
+    """Drift messages for every case that regressed beyond the tolerances."""
+    failures = []
+    for key, now in current.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        slower = now["seconds"] - before["seconds"]
+        if slower > args.min_seconds and now["seconds"] > before["seconds"] * (1 + args.time_tolerance):
+            failures.append(f"{key}: {before['seconds']:.3f}s -> {now['seconds']:.3f}s "
+                            f"(+{slower / before['seconds']:.0%}, tolerance {args.time_tolerance:.0%})")
+        if "peak_mb" in now and "peak_mb" in before:
+            bigger = now["peak_mb"] - before["peak_mb"]
+            if bigger > args.min_mb and now["peak_mb"] > before["peak_mb"] * (1 + args.memory_tolerance):
+                failures.append(f"{key}: peak {before['peak_mb']:.1f} MB -> {now['peak_mb']:.1f} MB "
+                                f"(+{bigger / before['peak_mb']:.0%}, tolerance {args.memory_tolerance:.0%})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="Ad group counts")
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (median is reported)")
+    parser.add_argument("--max-seconds", type=float, default=20.0,
+                        help="Stop repeating a case once one run takes longer than this")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=os.path.join(ROOT, "benchmarks", "baselines.json"))
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--time-tolerance", type=float, default=float(os.getenv("BENCH_TIME_TOLERANCE", "0.30")),
+                        help="Allowed relative slowdown before failing")
+    parser.add_argument("--memory-tolerance", type=float, default=float(os.getenv("BENCH_MEMORY_TOLERANCE", "0.20")),
+                        help="Allowed relative growth of peak memory before failing")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many seconds (timer noise)")
+    parser.add_argument("--min-mb", type=float, default=5.0, help="Ignore memory growth smaller than this")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    current, meta = {}, []
+    for size in args.sizes:
+        print(f"size {size}: loading and running {len(args.cases)} case(s)...", flush=True)
+        out = run_size(size, args)
+        meta.append({k: out[k] for k in ("size", "ad_groups", "days", "setup_seconds")})
+        for name, r in out["results"].items():
+            current[f"{size}:{name}"] = r
+
+    print(f"\n{'case':<22} {'seconds':>9} {'runs':>5} {'peak MB':>9}")
+    for key, r in current.items():
+        print(f"{key:<22} {r['seconds']:>9.3f} {r['runs']:>5} {r.get('peak_mb', float('nan')):>9.1f}")
+
+    if args.save:
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f).get("results", {})
+        saved.update(current)
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.platform(),
+                       "datasets": meta, "results": saved}, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save first")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    failures = compare(current, baseline, args)
+    missing = sorted(set(current) - set(baseline))
+    if missing:
+        print(f"\nNot in baseline (not checked): {', '.join(missing)}")
+    for msg in failures:
+        print(f"FAIL: {msg}")
+    if not failures:
+        print("\nOK: no case drifted past the tolerances")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
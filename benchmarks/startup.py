@@ -0,0 +1,65 @@
+"""
+Startup-time budget check for `import app.main`.
+
+Each run imports the app in a fresh interpreter. The median wall time must stay
+under the budget, and the heavy data stack (pandas/numpy) must not be imported
+at boot. Exits non-zero on failure.
+
+    python benchmarks/startup.py [--runs 5] [--budget 1.25]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("pandas", "numpy", "pyarrow")
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t0
+print(json.dumps({"seconds": elapsed, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+
+def measure(runs: int) -> tuple[list[float], list[str]]:
+    times, heavy = [], set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True,
+                             text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result["seconds"])
+        heavy.update(result["heavy"])
+    return times, sorted(heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET_SECONDS", "1.25")),
+                        help="Maximum median import time in seconds")
+    args = parser.parse_args()
+
+    times, heavy = measure(args.runs)
+    median = statistics.median(times)
+    print(f"import app.main: median {median:.3f}s, min {min(times):.3f}s, max {max(times):.3f}s "
+          f"over {args.runs} runs (budget {args.budget:.3f}s)")
+
+    failed = False
+    if median > args.budget:
+        print(f"FAIL: startup {median:.3f}s exceeds budget {args.budget:.3f}s")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Generate a large synthetic dataset (customers x campaigns x ad groups x days)
+with weekly seasonality and injected anomalies, for fixtures and load tests.
+
+Examples:
+    python generate_synthetic_data.py --customers 10 --campaigns 20 --ad-groups 50 --days 90 --db
+    python generate_synthetic_data.py --customers 100 --campaigns 20 --ad-groups 50 --days 100 \\
+        --parquet data/synthetic.parquet --labels data/synthetic_labels.csv
+"""
+import argparse
+import time
+from datetime import date
+from app.services.synthetic import generate, write_parquet, write_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic Google Ads data generator")
+    parser.add_argument("--customers", type=int, default=1)
+    parser.add_argument("--campaigns", type=int, default=10)
+    parser.add_argument("--ad-groups", type=int, default=10)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--end-date", default=None, help="Last date (YYYY-MM-DD), defaults to today")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--anomaly-rate", type=float, default=0.002,
+                        help="Probability that an entity-day after warm-up carries an anomaly")
+    parser.add_argument("--warmup-days", type=int, default=28)
+    parser.add_argument("--parquet", default=None, help="Write metrics to this Parquet file")
+    parser.add_argument("--csv", default=None, help="Write metrics to this CSV (upload format)")
+    parser.add_argument("--db", action="store_true", help="Bulk-load into DATABASE_URL")
+    parser.add_argument("--labels", default=None, help="Write ground-truth anomalies to this CSV")
+    args = parser.parse_args()
+
+    end = date.fromisoformat(args.end_date) if args.end_date else date.today()
+    t0 = time.perf_counter()
+    df, labels = generate(args.customers, args.campaigns, args.ad_groups, args.days,
+                          end_date=end, seed=args.seed, anomaly_rate=args.anomaly_rate,
+                          warmup_days=args.warmup_days)
+    print(f"Generated {len(df):,} rows and {len(labels):,} labelled anomalies in {time.perf_counter() - t0:.1f}s")
+
+    if args.parquet:
+        t0 = time.perf_counter()
+        write_parquet(df, args.parquet)
+        print(f"Wrote {args.parquet} in {time.perf_counter() - t0:.1f}s")
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f"Wrote {args.csv}")
+    if args.db:
+        from app.db.session import engine
+        from app.db.migrate import ensure_schema
+        ensure_schema(engine)
+        t0 = time.perf_counter()
+        write_db(engine, df)
+        print(f"Loaded {len(df):,} rows into {engine.url} in {time.perf_counter() - t0:.1f}s")
+    if args.labels:
+        labels.to_csv(args.labels, index=False)
+        print(f"Wrote ground truth to {args.labels}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API, for exercising
+the LLM explainer without a provider or API key.
+
+    python mock_llm_server.py --port 9100 --latency 0.5
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:9100/v1 uvicorn app.main:app
+
+Answers every case of a batched explanation prompt after `--latency` seconds.
+GET /stats reports how many completions and cases it has served.
+"""
+import argparse
+import asyncio
+import json
+import os
+from fastapi import FastAPI, Request
+
+LATENCY = float(os.getenv("MOCK_LLM_LATENCY", "0.2"))
+
+app = FastAPI(title="Mock LLM")
+stats = {"completions": 0, "cases": 0}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    cases = json.loads(body["messages"][-1]["content"]).get("cases", [])
+    await asyncio.sleep(LATENCY)
+    stats["completions"] += 1
+    stats["cases"] += len(cases)
+    results = [{
+        "case": c["case"],
+        "analysis": f"{c['metric'].upper()} {c['direction']} ({c['severity_z']} sigma), "
+                    f"driven by {', '.join(c['drivers'])}; scope: {c['scope']}.",
+        "actions": [f"Review {d.split()[0]} for this ad group." for d in c["drivers"]][:3],
+    } for c in cases]
+    return {
+        "id": f"mock-{stats['completions']}",
+        "object": "chat.completion",
+        "model": body.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": json.dumps({"results": results})}}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Seconds to wait before answering")
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
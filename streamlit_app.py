@@ -1,9 +1,14 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 
+# Seconds a backend response is reused across reruns with the same inputs
+CACHE_TTL_SECONDS = 120
+
 # Page config
 st.set_page_config(
     page_title="Google Ads Anomaly Radar",
@@ -12,6 +17,81 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One pooled keep-alive session per server process, shared by all reruns."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def api_get(api_url, path, params):
+    response = http_session().get(f"{api_url}{path}", params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def api_post(api_url, path, **kwargs):
+    response = http_session().post(f"{api_url}{path}", timeout=30, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+# Cached on their arguments, so reruns caused by other widgets reuse the last
+# result instead of re-running detection. Errors are raised and never cached.
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_anomalies(api_url, date_iso, min_z, mode, days):
+    if mode == "Date Range (Last N Days)":
+        return api_get(api_url, "/anomalies/range", {"end_date": date_iso, "days": days, "min_z": min_z})
+    return api_get(api_url, "/anomalies", {"date": date_iso, "min_z": min_z})
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_sweep(api_url, date_iso, thresholds):
+    """Anomalies per min_z for one day, from a single z-score pass."""
+    out = api_post(api_url, "/anomalies/sweep", json={
+        "start_date": date_iso, "end_date": date_iso,
+        "thresholds": list(thresholds), "min_impressions": [200],
+    })
+    counts = pd.DataFrame(out["counts"], columns=["min_z", "anomalies"])
+    return counts.groupby("min_z")["anomalies"].sum()
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_explanation(api_url, anomaly_id):
+    return api_post(api_url, "/explain", json={"anomaly_id": anomaly_id})
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_trend(api_url, ad_group_id, metric, end_date_iso):
+    return api_get(api_url, "/metrics/timeseries", {
+        "ad_group_id": ad_group_id, "metrics": metric, "end_date": end_date_iso,
+        "start_date": (datetime.fromisoformat(end_date_iso) - timedelta(days=90)).date().isoformat(),
+        "max_points": 200,
+    })
+
+def fetch_parallel(**calls):
+    """Run independent fetches at once: name=(fn, *args) -> {name: result or exception}."""
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = {name: pool.submit(fn, *args) for name, (fn, *args) in calls.items()}
+    out = {}
+    for name, fut in futures.items():
+        try:
+            out[name] = fut.result()
+        except Exception as e:
+            out[name] = e
+    return out
+
+def show_http_error(e):
+    st.error(f"❌ Error: {e.response.status_code}")
+    try:
+        st.error(e.response.json().get("detail", e.response.text))
+    except ValueError:
+        st.write(e.response.text)
+
+def clear_data_caches():
+    """New data invalidates cached detections, explanations and trends."""
+    fetch_anomalies.clear()
+    fetch_sweep.clear()
+    fetch_explanation.clear()
+    fetch_trend.clear()
+
 # Title and description
 st.title("📊 Google Ads Anomaly Radar (GAAR)")
 st.markdown("Detect and explain performance anomalies in your Google Ads campaigns")
@@ -40,6 +120,13 @@ with st.sidebar:
         step=0.5,
         help="Higher = only most significant anomalies"
     )
+    with st.expander("Anomalies per threshold"):
+        try:
+            per_z = fetch_sweep(api_url, selected_date.isoformat(), (1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0))
+            st.bar_chart(per_z)
+            st.caption(f"{int(per_z.get(min_z_score, 0))} anomalies at the current threshold on {selected_date}")
+        except requests.exceptions.RequestException:
+            st.caption("Backend unavailable")
     
     st.divider()
     st.markdown("### Instructions")
@@ -64,19 +151,12 @@ with tab1:
         if st.button("📥 Ingest Data", key="ingest_btn", use_container_width=True):
             try:
                 with st.spinner("Ingesting data..."):
-                    response = requests.post(
-                        f"{api_url}/ingest",
-                        params={"date": selected_date.isoformat()},
-                        timeout=30
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        st.success(f"✅ Successfully ingested {result['rows']} rows for {result['date']}")
-                        st.json(result)
-                    else:
-                        st.error(f"❌ Error: {response.status_code}")
-                        st.write(response.text)
+                    result = api_post(api_url, "/ingest", params={"date": selected_date.isoformat()})
+                    clear_data_caches()
+                    st.success(f"✅ Successfully ingested {result['rows']} rows for {result['date']}")
+                    st.json(result)
+            except requests.exceptions.HTTPError as e:
+                show_http_error(e)
             except requests.exceptions.ConnectionError:
                 st.error(f"❌ Cannot connect to backend at {api_url}")
                 st.info("Make sure your FastAPI server is running: `uvicorn app.main:app --reload --port 8000`")
@@ -120,24 +200,13 @@ with tab1:
 
                         # Send file to backend
                         files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "text/csv")}
-                        response = requests.post(
-                            f"{api_url}/ingest/upload",
-                            files=files,
-                            timeout=30
-                        )
-
-                        if response.status_code == 200:
-                            result = response.json()
-                            st.success(f"✅ {result['message']}")
-                            st.json(result)
-                        else:
-                            st.error(f"❌ Error: {response.status_code}")
-                            try:
-                                error_detail = response.json().get("detail", response.text)
-                                st.error(error_detail)
-                            except:
-                                st.error(response.text)
+                        result = api_post(api_url, "/ingest/upload", files=files)
+                        clear_data_caches()
+                        st.success(f"✅ {result['message']}")
+                        st.json(result)
 
+                except requests.exceptions.HTTPError as e:
+                    show_http_error(e)
                 except requests.exceptions.ConnectionError:
                     st.error(f"❌ Cannot connect to backend at {api_url}")
                     st.info("Make sure your FastAPI server is running")
@@ -155,6 +224,7 @@ with tab2:
         horizontal=True
     )
 
+    days_back = 7
     if detection_mode == "Date Range (Last N Days)":
         days_back = st.slider(
             "Number of days to analyze",
@@ -174,81 +244,64 @@ with tab2:
     if st.session_state.get("detect_clicked"):
         try:
             with st.spinner("Detecting anomalies..."):
-                # Choose endpoint based on detection mode
-                if st.session_state.get("detection_mode") == "Date Range (Last N Days)":
-                    response = requests.get(
-                        f"{api_url}/anomalies/range",
-                        params={
-                            "end_date": selected_date.isoformat(),
-                            "days": days_back,
-                            "min_z": min_z_score
-                        },
-                        timeout=30
-                    )
-                else:
-                    response = requests.get(
-                        f"{api_url}/anomalies",
-                        params={
-                            "date": selected_date.isoformat(),
-                            "min_z": min_z_score
-                        },
-                        timeout=30
-                    )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    anomalies = result.get("anomalies", [])
-                    
-                    if not anomalies:
-                        st.info(f"✅ No anomalies detected for {selected_date} with Z-score >= {min_z_score}")
-                    else:
-                        st.success(f"Found {len(anomalies)} anomalies")
-                        
-                        # Convert to dataframe for better display
-                        df_anomalies = pd.DataFrame(anomalies)
-
-                        # Reorder and format columns for readability
-                        display_cols = [
-                            "detection_date", "entity_type", "entity_id", "metric", "direction",
-                            "observed", "expected", "zscore"
-                        ]
-                        # Only include detection_date if it exists (range mode)
-                        available_cols = [col for col in display_cols if col in df_anomalies.columns]
-                        df_display = df_anomalies[available_cols].copy()
-                        
-                        # Format numeric columns
-                        for col in ["observed", "expected", "zscore"]:
-                            if col in df_display.columns:
-                                df_display[col] = df_display[col].round(2)
-                        
-                        st.dataframe(df_display, use_container_width=True, hide_index=True)
-                        
-                        # Store anomalies in session state for explain tab
-                        st.session_state.anomalies = anomalies
-                        
-                        # Summary stats
-                        st.divider()
-                        col1, col2, col3, col4 = st.columns(4)
-                        
-                        with col1:
-                            st.metric("Total Anomalies", len(anomalies))
-                        
-                        with col2:
-                            entity_types = df_anomalies["entity_type"].nunique()
-                            st.metric("Entity Types", entity_types)
-                        
-                        with col3:
-                            metrics = df_anomalies["metric"].nunique()
-                            st.metric("Metric Types", metrics)
-                        
-                        with col4:
-                            avg_z = df_anomalies["zscore"].mean()
-                            st.metric("Avg Z-Score", f"{avg_z:.2f}")
-                
-                else:
-                    st.error(f"❌ Error: {response.status_code}")
-                    st.write(response.text)
-        
+                # Cached per (date, min_z, mode, days): other widget changes reuse this result
+                mode = st.session_state.get("detection_mode")
+                result = fetch_anomalies(
+                    api_url,
+                    selected_date.isoformat(),
+                    min_z_score,
+                    mode,
+                    days_back if mode == "Date Range (Last N Days)" else None,
+                )
+            anomalies = result.get("anomalies", [])
+
+            if not anomalies:
+                st.info(f"✅ No anomalies detected for {selected_date} with Z-score >= {min_z_score}")
+            else:
+                st.success(f"Found {len(anomalies)} anomalies")
+
+                # Convert to dataframe for better display
+                df_anomalies = pd.DataFrame(anomalies)
+
+                # Reorder and format columns for readability
+                display_cols = [
+                    "detection_date", "entity_type", "entity_id", "metric", "direction",
+                    "observed", "expected", "zscore"
+                ]
+                # Only include detection_date if it exists (range mode)
+                available_cols = [col for col in display_cols if col in df_anomalies.columns]
+                df_display = df_anomalies[available_cols].copy()
+
+                # Format numeric columns
+                for col in ["observed", "expected", "zscore"]:
+                    if col in df_display.columns:
+                        df_display[col] = df_display[col].round(2)
+
+                st.dataframe(df_display, use_container_width=True, hide_index=True)
+
+                # Store anomalies in session state for explain tab
+                st.session_state.anomalies = anomalies
+
+                # Summary stats
+                st.divider()
+                col1, col2, col3, col4 = st.columns(4)
+
+                with col1:
+                    st.metric("Total Anomalies", len(anomalies))
+
+                with col2:
+                    entity_types = df_anomalies["entity_type"].nunique()
+                    st.metric("Entity Types", entity_types)
+
+                with col3:
+                    metrics = df_anomalies["metric"].nunique()
+                    st.metric("Metric Types", metrics)
+
+                with col4:
+                    avg_z = df_anomalies["zscore"].mean()
+                    st.metric("Avg Z-Score", f"{avg_z:.2f}")
+        except requests.exceptions.HTTPError as e:
+            show_http_error(e)
         except requests.exceptions.ConnectionError:
             st.error(f"❌ Cannot connect to backend at {api_url}")
         except Exception as e:
@@ -303,47 +356,62 @@ with tab3:
             
             # Get explanation
             if st.button("💡 Get Explanation", use_container_width=True):
+                st.session_state.explain_id = selected_anomaly.get("id")
+                st.session_state.explain_requested = True
+
+            # Kept across reruns (cached), until another anomaly is selected
+            if st.session_state.get("explain_requested") and st.session_state.get("explain_id") == selected_anomaly.get("id"):
                 try:
-                    # Find anomaly ID from DB (or use index as fallback)
-                    anomaly_id = selected_idx + 1  # Assuming sequential IDs
-                    
+                    # /anomalies returns the persisted id of every anomaly
+                    anomaly_id = selected_anomaly.get("id")
+                    if anomaly_id is None:
+                        st.warning("⚠️ This anomaly has no stored id; run single-date detection to explain it.")
+                        st.stop()
+
+                    # Explanation and entity trend are independent: fetch both at once (cached)
                     with st.spinner("Generating explanation..."):
-                        response = requests.post(
-                            f"{api_url}/explain",
-                            json={"anomaly_id": anomaly_id},
-                            timeout=30
+                        results = fetch_parallel(
+                            explanation=(fetch_explanation, api_url, anomaly_id),
+                            trend=(fetch_trend, api_url, selected_anomaly.get("entity_id"),
+                                   selected_anomaly.get("metric"),
+                                   selected_anomaly.get("detection_date") or selected_date.isoformat()),
                         )
-                        
-                        if response.status_code == 200:
-                            explanation = response.json()
-                            
-                            if "error" in explanation:
-                                st.warning(f"⚠️ {explanation['error']}")
-                            else:
-                                st.success("✅ Explanation Generated")
-                                
-                                # Display explanation
-                                if "explanation" in explanation:
-                                    st.markdown("### Likely Causes")
-                                    st.write(explanation["explanation"])
-                                
-                                if "suggestions" in explanation:
-                                    st.markdown("### Suggested Actions")
-                                    suggestions = explanation["suggestions"]
-                                    if isinstance(suggestions, list):
-                                        for i, suggestion in enumerate(suggestions, 1):
-                                            st.write(f"{i}. {suggestion}")
-                                    else:
-                                        st.write(suggestions)
-                                
-                                # Show full response for debugging
-                                with st.expander("Full Response"):
-                                    st.json(explanation)
-                        
-                        else:
-                            st.error(f"❌ Error: {response.status_code}")
-                            st.write(response.text)
-                
+
+                    explanation = results["explanation"]
+                    if isinstance(explanation, Exception):
+                        raise explanation
+
+                    if "error" in explanation:
+                        st.warning(f"⚠️ {explanation['error']}")
+                    else:
+                        st.success("✅ Explanation Generated")
+
+                        st.markdown("### Likely Causes")
+                        st.write(explanation.get("analysis") or explanation.get("summary"))
+
+                        if explanation.get("drivers"):
+                            st.markdown("### Drivers")
+                            st.dataframe(pd.DataFrame(explanation["drivers"]), use_container_width=True, hide_index=True)
+
+                        if explanation.get("actions"):
+                            st.markdown("### Suggested Actions")
+                            for i, suggestion in enumerate(explanation["actions"], 1):
+                                st.write(f"{i}. {suggestion}")
+
+                        # Show full response for debugging
+                        with st.expander("Full Response"):
+                            st.json(explanation)
+
+                    trend = results["trend"]
+                    if not isinstance(trend, Exception):
+                        points = trend["series"].get(selected_anomaly.get("metric"), [])
+                        if points:
+                            st.markdown("### Trend (90 days)")
+                            df_trend = pd.DataFrame(points).set_index("date")
+                            st.line_chart(df_trend[[c for c in ("value", "expected", "lower", "upper") if c in df_trend.columns]])
+
+                except requests.exceptions.HTTPError as e:
+                    show_http_error(e)
                 except requests.exceptions.ConnectionError:
                     st.error(f"❌ Cannot connect to backend at {api_url}")
                 except Exception as e:
@@ -0,0 +1,37 @@
+from datetime import date
+import pandas as pd
+from app.services.sweep import sweep
+
+DAY = date(2025, 11, 3)
+
+
+def _cand(rows):
+    return pd.DataFrame(rows, columns=["date", "ad_group_id", "metric", "impressions", "direction", "abs_z"])
+
+
+def _score(out, min_z, metric="all"):
+    return next(s for s in out["scores"] if s["min_z"] == min_z and s["metric"] == metric and s["min_impressions"] == 0)
+
+
+def test_f1_is_zero_when_a_threshold_has_no_true_positives():
+    cand = _cand([(DAY, "ag_1", "cost", 1000, "up", 4.0), (DAY, "ag_2", "cost", 1000, "up", 1.0)])
+    labels = pd.DataFrame({"date": [DAY], "ad_group_id": ["ag_2"], "metric": ["cost"]})
+    out = sweep(cand, thresholds=[3.0], floors=[0], labels=labels)
+    s = _score(out, 3.0)
+    assert (s["detected"], s["true_positives"]) == (1, 0)
+    assert s["precision"] == 0.0 and s["recall"] == 0.0
+    assert s["f1"] == 0.0
+
+
+def test_f1_is_none_when_nothing_is_detected():
+    cand = _cand([(DAY, "ag_1", "cost", 1000, "up", 1.0)])
+    labels = pd.DataFrame({"date": [DAY], "ad_group_id": ["ag_1"], "metric": ["cost"]})
+    s = _score(sweep(cand, thresholds=[3.0], floors=[0], labels=labels), 3.0)
+    assert s["precision"] is None and s["f1"] is None
+
+
+def test_f1_when_both_are_defined():
+    cand = _cand([(DAY, "ag_1", "cost", 1000, "up", 4.0), (DAY, "ag_2", "cost", 1000, "up", 5.0)])
+    labels = pd.DataFrame({"date": [DAY], "ad_group_id": ["ag_1"], "metric": ["cost"]})
+    s = _score(sweep(cand, thresholds=[3.0], floors=[0], labels=labels), 3.0)
+    assert (s["precision"], s["recall"], s["f1"]) == (0.5, 1.0, 0.6667)
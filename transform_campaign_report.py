@@ -1,25 +1,79 @@
 """
 Script to transform Google Ads Campaign report to Ad Group format for GAAR
+
+Single report:  python transform_campaign_report.py [customer_id] [date]
+Batch mode:     python transform_campaign_report.py [customer_id] --batch "exports/*.csv" \
+                    [--output data/batch_upload.csv] [--workers 8] [--ingest]
 """
+import argparse
+import csv
+import glob
+import os
 import pandas as pd
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-def transform_campaign_report(input_file, output_file, customer_id, date_str):
+REPORT_DATE_FORMAT = "%B %d, %Y"  # e.g. "November 3, 2025"
+
+
+def read_report_date(input_file):
     """
-    Transform a Google Ads Campaign report to the required format.
+    Extract the report date from a Google Ads export header.
 
-    Args:
-        input_file: Path to the Campaign report CSV
-        customer_id: Your Google Ads customer ID (e.g., '1234567890')
-        date_str: Date for the data (YYYY-MM-DD format)
+    Exports start with a title row and a date row such as
+    "October 1, 2025 - November 3, 2025"; for a range the end date is used.
+    Returns a YYYY-MM-DD string, or None if the header has no date.
     """
+    with open(input_file, encoding="utf-8-sig", newline="") as f:
+        header = [next(csv.reader(f), [""]) for _ in range(2)]
+    for row in reversed(header):
+        last = (row[0] if row else "").split(" - ")[-1].strip()
+        try:
+            return datetime.strptime(last, REPORT_DATE_FORMAT).date().isoformat()
+        except ValueError:
+            continue
+    return None
 
-    print(f"Reading Campaign report: {input_file}")
+
+# currency symbols and codes, thousands separators and spaces in exported numbers
+_NUMBER_NOISE = r"[$€£¥₹,\s\u00a0]|^[A-Z]{3}(?=[\d.-])"
+# what Google Ads writes for "no data"; read as 0, like blank cells
+_EMPTY = {"", "--"}
+
+
+def _to_number(col, name, lines, input_file):
+    """
+    Parse an exported metric column ("$1,234.50", "1,024", "--", blank).
+    Raises ValueError naming the file lines of any value that still doesn't parse.
+    """
+    blank = col.isna()
+    text = col.where(~blank, "").astype(str).str.strip().str.replace(_NUMBER_NOISE, "", regex=True)
+    values = pd.to_numeric(text, errors='coerce')
+    empty = blank | text.isin(_EMPTY)
+    bad = values.isna() & ~empty
+    if bad.any():
+        shown = ", ".join(f"line {lines[i]}: {col[i]!r}" for i in bad[bad].index[:10])
+        raise ValueError(f"{input_file}: {bad.sum()} unparseable {name} value(s): {shown}")
+    return values.where(~empty, 0)
+
+
+def parse_campaign_report(input_file, customer_id, date_str=None):
+    """
+    Parse one Campaign report into the upload format, without printing.
+    If date_str is None, the date is read from the report header.
+    """
+    if date_str is None:
+        date_str = read_report_date(input_file)
+        if date_str is None:
+            raise ValueError(f"No report date found in header of {input_file}; pass one explicitly")
 
     # Read CSV, skipping metadata rows
     # Google Ads exports typically have 2 header rows
     df = pd.read_csv(input_file, skiprows=2)
+    # file line of each row: 2 metadata rows, the header, 1-based
+    df['_line'] = df.index + 4
 
     # Remove summary/total rows and null campaigns
     df = df[~df['Campaign status'].str.contains('Total:', na=False)]
@@ -29,8 +83,6 @@ def transform_campaign_report(input_file, output_file, customer_id, date_str):
     # Reset index after filtering
     df = df.reset_index(drop=True)
 
-    print(f"Found {len(df)} campaign(s)")
-
     # Create the required columns
     num_rows = len(df)
     transformed = pd.DataFrame()
@@ -46,23 +98,40 @@ def transform_campaign_report(input_file, output_file, customer_id, date_str):
     # Or create a default ad group name
     transformed['ad_group_id'] = transformed['campaign_id'] + '_default_ag'
 
-    # Map the metric columns
-    # Remove commas and convert to numeric
-    transformed['impressions'] = df['Impr.'].str.replace(',', '').astype(int)
-    transformed['clicks'] = df['Clicks'].astype(int)
-
-    # Cost - remove currency symbols if present
-    transformed['cost'] = df['Cost'].astype(float)
-
-    # Conversions
-    transformed['conversions'] = df['Conversions'].astype(float)
+    # Map the metric columns; separators and currency symbols are stripped,
+    # anything else that doesn't parse rejects the file
+    lines = df['_line']
+    transformed['impressions'] = _to_number(df['Impr.'], 'Impr.', lines, input_file).astype(int)
+    transformed['clicks'] = _to_number(df['Clicks'], 'Clicks', lines, input_file).astype(int)
+    transformed['cost'] = _to_number(df['Cost'], 'Cost', lines, input_file).astype(float)
+    transformed['conversions'] = _to_number(df['Conversions'], 'Conversions', lines, input_file).astype(float)
 
     # Conv value - if not present, estimate from conversions
     if 'Conv. value' in df.columns:
-        transformed['conv_value'] = df['Conv. value'].astype(float)
+        transformed['conv_value'] = _to_number(df['Conv. value'], 'Conv. value', lines, input_file).astype(float)
     else:
         # Estimate conversion value (you should adjust this)
         transformed['conv_value'] = transformed['conversions'] * 50.0  # Assume $50 per conversion
+        transformed.attrs['estimated_conv_value'] = True
+
+    return transformed
+
+
+def transform_campaign_report(input_file, output_file, customer_id, date_str):
+    """
+    Transform a Google Ads Campaign report to the required format.
+
+    Args:
+        input_file: Path to the Campaign report CSV
+        customer_id: Your Google Ads customer ID (e.g., '1234567890')
+        date_str: Date for the data (YYYY-MM-DD format), or None to read it from the header
+    """
+
+    print(f"Reading Campaign report: {input_file}")
+
+    transformed = parse_campaign_report(input_file, customer_id, date_str)
+    print(f"Found {len(transformed)} campaign(s)")
+    if transformed.attrs.get('estimated_conv_value'):
         print("Warning: No conversion value column found. Using estimated value of $50 per conversion.")
 
     # Save to output file
@@ -75,38 +144,139 @@ def transform_campaign_report(input_file, output_file, customer_id, date_str):
     return transformed
 
 
+def _expand_inputs(pattern):
+    """A directory (all *.csv inside), a glob, or a single file -> sorted file list."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.csv")
+    return sorted(glob.glob(pattern))
+
+
+def _parse_one(args):
+    # top-level so it can be pickled into worker processes
+    path, customer_id = args
+    try:
+        return path, parse_campaign_report(path, customer_id), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def _in_order(pool, fn, items, window):
+    """fn(item) for each item, yielded in input order, with at most `window` calls in flight."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def transform_batch(pattern, output_file, customer_id, workers=None, ingest=False):
+    """
+    Transform many exports in parallel.
+
+    Files are parsed in a process pool, at most two per worker at a time, and
+    results are appended to output_file in file order, so memory stays
+    bounded by the in-flight files and the output is the same on every run.
+    With ingest=True the results are also written into the database through
+    the delta-ingest path once all files are parsed: each date is upserted
+    once from every file that covers it (a date's upsert replaces its stored
+    rows, so per-file upserts would drop the earlier files' entities).
+    Returns (rows_written, failed_files).
+    """
+    files = _expand_inputs(pattern)
+    if not files:
+        raise ValueError(f"No report files match {pattern}")
+    print(f"Transforming {len(files)} report(s) with {workers or os.cpu_count()} worker(s)")
+
+    db = None
+    if ingest:
+        from app.db.session import SessionLocal, engine
+        from app.db.migrate import ensure_schema
+        from app.services.ingest import normalize_metrics, upsert_metrics
+        from app.services.pipeline import recompute_changed
+        ensure_schema(engine)
+        db = SessionLocal()
+
+    rows_written, failed, frames = 0, [], []
+    try:
+        with open(output_file, "w", newline="") as out, ProcessPoolExecutor(max_workers=workers) as pool:
+            header = True
+            window = 2 * (workers or os.cpu_count() or 1)
+            for path, df, error in _in_order(pool, _parse_one, [(path, customer_id) for path in files], window):
+                if error:
+                    failed.append((path, error))
+                    print(f"  FAILED {path}: {error}")
+                    continue
+                df.to_csv(out, index=False, header=header)
+                out.flush()
+                header = False
+                rows_written += len(df)
+                if db is not None and not df.empty:
+                    frames.append(normalize_metrics(df.assign(date=pd.to_datetime(df['date']).dt.date)))
+                print(f"  {path}: {len(df)} row(s) for {df['date'].iloc[0] if len(df) else '-'}")
+        if frames:
+            result = upsert_metrics(db, normalize_metrics(pd.concat(frames, ignore_index=True)))
+            recompute_changed(db, result["changed"])
+            db.commit()
+            print(f"Ingested {len(result['changed'])} changed date(s): {result['inserted']} inserted, "
+                  f"{result['updated']} updated, {result['deleted']} deleted")
+    finally:
+        if db is not None:
+            db.close()
+
+    print(f"\nWrote {rows_written} row(s) from {len(files) - len(failed)} file(s) to {output_file}")
+    return rows_written, failed
+
+
 if __name__ == "__main__":
     # Configuration
     INPUT_FILE = r"C:\Users\willk\Desktop\Campaign report.csv"
     OUTPUT_FILE = r"data\transformed_campaign_data.csv"
+    BATCH_OUTPUT_FILE = r"data\batch_upload.csv"
+
+    parser = argparse.ArgumentParser(description="Campaign Report Transformation Tool")
+    parser.add_argument("customer_id", nargs="?", default=None)
+    parser.add_argument("date", nargs="?", default=None,
+                        help="YYYY-MM-DD; defaults to the date in the report header")
+    parser.add_argument("--input", default=INPUT_FILE, help="Single report to transform")
+    parser.add_argument("--batch", default=None, help="Directory or glob of reports to transform in parallel")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--ingest", action="store_true", help="Also load batch results into the database")
+    args = parser.parse_args()
 
     print("=" * 60)
     print("Campaign Report Transformation Tool")
     print("=" * 60)
 
     # Use command line arguments or defaults
-    if len(sys.argv) > 1:
-        customer_id = sys.argv[1]
+    if args.customer_id:
+        customer_id = args.customer_id
     else:
         customer_id = "1234567890"  # Default
         print(f"\nUsing default Customer ID: {customer_id}")
         print("(You can specify: python transform_campaign_report.py <customer_id> <date>)")
 
-    if len(sys.argv) > 2:
-        date_input = sys.argv[2]
-    else:
-        # Use the date from the report: October 1, 2025 - November 3, 2025
-        # Let's use the end date
-        date_input = "2025-11-03"
-        print(f"Using date: {date_input}")
+    date_input = args.date
+    if date_input is None and not args.batch:
+        print("Using date from the report header")
 
     print("\n" + "=" * 60)
 
     try:
-        result = transform_campaign_report(INPUT_FILE, OUTPUT_FILE, customer_id, date_input)
+        if args.batch:
+            output_file = args.output or BATCH_OUTPUT_FILE
+            rows, failed = transform_batch(args.batch, output_file, customer_id,
+                                           workers=args.workers, ingest=args.ingest)
+            if failed:
+                sys.exit(1)
+        else:
+            output_file = args.output or OUTPUT_FILE
+            result = transform_campaign_report(args.input, output_file, customer_id, date_input)
         print("\n" + "=" * 60)
         print("SUCCESS! You can now upload the transformed file:")
-        print(f"   {OUTPUT_FILE}")
+        print(f"   {output_file}")
         print("=" * 60)
     except Exception as e:
         print(f"\nERROR: {str(e)}")